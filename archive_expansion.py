@@ -0,0 +1,293 @@
+import io
+import os
+import bz2
+import gzip
+import lzma
+import shutil
+import logging
+import tarfile
+import zipfile
+import tempfile
+from email import policy
+from email.parser import BytesParser
+
+from attachment_source import SPILL_THRESHOLD, open_source, source_bytes, source_name
+
+# Limits applied across one attachment and everything nested inside it, so a
+# zip bomb or a deeply nested archive cannot exhaust memory or disk.
+MAX_DEPTH = 3
+MAX_TOTAL_BYTES = 256 * 1024 * 1024
+MAX_FILES = 200
+COPY_CHUNK = 1024 * 1024
+
+ARCHIVE_TYPES = ('zip', 'tar', '7z', 'eml', 'compressed')
+
+# A gzip, bzip2 or xz stream that does not hold a tarball is one compressed file
+DECOMPRESSORS = [
+    (b'\x1f\x8b', gzip.open, ('.gz', '.gzip')),
+    (b'BZh', bz2.open, ('.bz2',)),
+    (b'\xfd7zXZ\x00', lzma.open, ('.xz',)),
+]
+# Name of the inner document holding an attached email's own text
+BODY_NAME = 'body.txt'
+# HTML elements that end a line when an HTML-only body is turned into text
+HTML_BLOCK_TAGS = ['br', 'p', 'div', 'tr', 'li', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'table', 'blockquote']
+
+
+class ExpansionLimitError(Exception):
+    pass
+
+
+class ExpansionBudget:
+    """Running file count and byte total for one top-level attachment."""
+
+    def __init__(self, max_files=MAX_FILES, max_bytes=MAX_TOTAL_BYTES):
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        self.files = 0
+        self.bytes = 0
+
+    def add_file(self, name):
+        self.files += 1
+        if self.files > self.max_files:
+            raise ExpansionLimitError(f"more than {self.max_files} files (at {name})")
+
+    def add_bytes(self, count, name):
+        self.bytes += count
+        if self.bytes > self.max_bytes:
+            raise ExpansionLimitError(f"more than {self.max_bytes} expanded bytes (at {name})")
+
+
+def read_member(stream, budget, name, spill_path):
+    """
+    Read a member stream in chunks, charging the actual bytes read to the budget.
+
+    Sizes declared in archive headers can lie, so they are not trusted.
+    Members up to SPILL_THRESHOLD are kept in memory; larger ones are written
+    to `spill_path`.
+
+    :param stream: Readable binary stream
+    :param budget: ExpansionBudget
+    :param name: Member name, for error messages
+    :param spill_path: File to write the member to if it is too large for memory
+    :return: The member's bytes, or spill_path if it was written to disk
+    """
+    buffer = bytearray()
+    destination = None
+    try:
+        while True:
+            chunk = stream.read(COPY_CHUNK)
+            if not chunk:
+                break
+            budget.add_bytes(len(chunk), name)
+            if destination is None and len(buffer) + len(chunk) > SPILL_THRESHOLD:
+                destination = open(spill_path, 'wb')
+                destination.write(buffer)
+                buffer = None
+            if destination is None:
+                buffer += chunk
+            else:
+                destination.write(chunk)
+    finally:
+        if destination is not None:
+            destination.close()
+    return spill_path if destination is not None else bytes(buffer)
+
+
+def iter_zip(file_path):
+    with open_source(file_path) as source, zipfile.ZipFile(source) as archive:
+        for info in archive.infolist():
+            if info.is_dir():
+                continue
+            with archive.open(info) as stream:
+                yield info.filename, None, stream
+
+
+def iter_tar(file_path):
+    # Stream mode reads members sequentially without seeking (handles .tar.gz/.bz2/.xz)
+    with open_source(file_path) as source, tarfile.open(fileobj=source, mode='r|*') as archive:
+        for member in archive:
+            if not member.isfile():
+                continue
+            stream = archive.extractfile(member)
+            if stream is not None:
+                yield member.name, None, stream
+
+
+def iter_7z(file_path, budget):
+    try:
+        import py7zr
+    except ImportError:
+        raise RuntimeError("py7zr is required to expand .7z attachments")
+    with open_source(file_path) as source, py7zr.SevenZipFile(source) as archive:
+        members = [info for info in archive.list() if not info.is_directory]
+        if len(members) > budget.max_files - budget.files:
+            raise ExpansionLimitError(f"7z archive declares {len(members)} files")
+        # 7z blocks are usually solid and cannot be streamed, so each member is
+        # unpacked on its own to a scratch file and removed once the consumer
+        # moves on. Declared sizes only screen members out early; the bytes
+        # actually unpacked are charged when the member is read (read_member).
+        with tempfile.TemporaryDirectory() as scratch:
+            for info in members:
+                if (info.uncompressed or 0) > budget.max_bytes - budget.bytes:
+                    raise ExpansionLimitError(f"7z member {info.filename} declares {info.uncompressed} bytes")
+                archive.reset()
+                archive.extract(path=scratch, targets=[info.filename])
+                path = os.path.join(scratch, info.filename)
+                if not os.path.isfile(path):
+                    continue
+                try:
+                    with open(path, 'rb') as stream:
+                        yield info.filename, None, stream
+                finally:
+                    os.remove(path)
+
+
+def iter_compressed(file_path, name):
+    with open_source(file_path) as source:
+        head = source.read(8)
+        source.seek(0)
+        for magic, decompressor, extensions in DECOMPRESSORS:
+            if head.startswith(magic):
+                break
+        else:
+            raise ValueError(f"Not a gzip, bzip2 or xz stream: {name}")
+        stem, extension = os.path.splitext(os.path.basename(name))
+        with decompressor(source) as stream:
+            yield (stem if extension.lower() in extensions else stem + extension), None, stream
+
+
+def html_to_text(html):
+    """
+    :param html: HTML document
+    :return: Its visible text, one block per line
+    """
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(html, 'html.parser')
+    for element in soup(['script', 'style', 'head']):
+        element.decompose()
+    for element in soup(HTML_BLOCK_TAGS):
+        element.append('\n')
+    for element in soup(['td', 'th']):
+        element.append(' ')
+    lines = (' '.join(line.split()) for line in soup.get_text().splitlines())
+    return "\n".join(line for line in lines if line)
+
+
+def email_body_text(message):
+    """
+    :param message: email.message.EmailMessage
+    :return: The plain-text body, else the HTML body as text, else ""
+    """
+    body = message.get_body(preferencelist=('plain', 'html'))
+    if body is None:
+        return ""
+    try:
+        content = body.get_content()
+    except (LookupError, UnicodeError):
+        content = body.get_payload(decode=True).decode('utf-8', errors='replace')
+    return html_to_text(content) if body.get_content_type() == 'text/html' else content.strip()
+
+
+def read_text(file_path):
+    """
+    Text extractor for plain-text documents, such as the body of an attached email.
+
+    :param file_path: Path to the text file, or its bytes
+    :return: The decoded text
+    """
+    return bytes(source_bytes(file_path)).decode('utf-8', errors='replace')
+
+
+def iter_eml(file_path):
+    with open_source(file_path) as source:
+        message = BytesParser(policy=policy.default).parse(source)
+    # The forwarded message's own text often carries the order details
+    body = email_body_text(message)
+    if body:
+        yield BODY_NAME, 'text/plain', io.BytesIO(body.encode('utf-8'))
+    for part in message.iter_attachments():
+        if part.get_content_type() == 'message/rfc822':
+            # A forwarded message nested in this one is passed on as an .eml member
+            inner = part.get_content().as_bytes()
+            yield (part.get_filename() or 'forwarded.eml'), 'message/rfc822', io.BytesIO(inner)
+            continue
+        payload = part.get_payload(decode=True)
+        if payload:
+            yield (part.get_filename() or 'attachment'), part.get_content_type(), io.BytesIO(payload)
+
+
+def iter_members(file_path, file_type, budget, name=None):
+    """
+    Yield the members of an archive or email as (name, declared MIME type, stream).
+
+    :param file_path: Path to the container, or its bytes
+    :param file_type: One of ARCHIVE_TYPES
+    :param budget: ExpansionBudget
+    :param name: Container file name, which a single compressed file is named after
+    :return: Generator of (name, mime_type or None, readable binary stream)
+    """
+    if file_type == 'zip':
+        return iter_zip(file_path)
+    if file_type == 'tar':
+        return iter_tar(file_path)
+    if file_type == '7z':
+        return iter_7z(file_path, budget)
+    if file_type == 'eml':
+        return iter_eml(file_path)
+    if file_type == 'compressed':
+        return iter_compressed(file_path, name or source_name(file_path, 'attachment'))
+    raise ValueError(f"Not an archive type: {file_type}")
+
+
+def expand_attachment(file_path, identify, mime_type=None, max_depth=MAX_DEPTH, budget=None):
+    """
+    Expand an attachment into the documents it contains, recursing into nested archives.
+
+    Members are read one at a time and handed on as bytes; only members
+    larger than SPILL_THRESHOLD are written to disk, under generated names so
+    member paths cannot escape the scratch directory, and removed as soon as
+    the consumer moves on. A file that is not an archive is yielded as-is.
+    Expansion stops with a warning when a limit is reached; documents already
+    yielded are kept.
+
+    :param file_path: Path to the attachment, or its bytes
+    :param identify: Callable(source, mime_type, name) -> file type (see ExtractorRegistry.identify)
+    :param mime_type: MIME type declared for the attachment, if any
+    :param max_depth: Maximum archive nesting depth
+    :param budget: ExpansionBudget shared across the nesting levels
+    :return: Generator of (display name, path or bytes, declared MIME type)
+    """
+    budget = budget or ExpansionBudget()
+    scratch = tempfile.mkdtemp(prefix='po_expand_')
+    name = source_name(file_path, 'attachment')
+    try:
+        yield from _expand(file_path, name, identify, mime_type, 0, max_depth, budget, scratch)
+    except ExpansionLimitError as e:
+        logging.warning(f"Stopped expanding {file_path}: {e}")
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+        if budget.files:
+            logging.info(f"Expanded {name}: {budget.files} files, {budget.bytes} bytes")
+
+
+def _expand(file_path, name, identify, mime_type, depth, max_depth, budget, scratch):
+    file_type = identify(file_path, mime_type, os.path.basename(name))
+    if file_type not in ARCHIVE_TYPES:
+        yield name, file_path, mime_type
+        return
+    if depth >= max_depth:
+        logging.warning(f"Skipping {name}: archive nesting deeper than {max_depth}")
+        return
+
+    for member_name, member_mime, stream in iter_members(file_path, file_type, budget, name):
+        budget.add_file(member_name)
+        suffix = os.path.splitext(member_name)[1][:16]
+        spill_path = os.path.join(scratch, f"{budget.files:05d}{suffix}")
+        member = read_member(stream, budget, member_name, spill_path)
+        try:
+            yield from _expand(member, f"{name}/{member_name}", identify, member_mime,
+                               depth + 1, max_depth, budget, scratch)
+        finally:
+            if member is spill_path:
+                os.remove(spill_path)
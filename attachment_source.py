@@ -0,0 +1,205 @@
+import io
+import os
+import logging
+import tempfile
+import threading
+from contextlib import contextmanager
+
+# Extractors accept an attachment "source": a file path, or the attachment's
+# bytes as bytes / bytearray / memoryview / a binary file object (BytesIO).
+# Buffers are only written to disk when a tool needs a real file (LibreOffice,
+# the PDF worker pool) or when ingestion is told to persist attachments.
+
+# Attachments larger than this are spilled to disk by ingestion instead of
+# being held in memory until extraction
+SPILL_THRESHOLD = int(os.environ.get('PO_SPILL_THRESHOLD', 16 * 1024 * 1024))
+# Total in-memory attachment bytes held at once; further attachments are spilled
+MAX_MEMORY_BYTES = int(os.environ.get('PO_MAX_MEMORY_ATTACHMENTS', 256 * 1024 * 1024))
+# Keep every attachment in the attachments folder. On by default, since the
+# stages can run as separate scripts that pick attachments up from disk;
+# pipeline.py runs them in one process and turns it off unless
+# PO_PERSIST_ATTACHMENTS=1 (PERSIST_REQUESTED) or --keep-attachments is given.
+_persist_setting = os.environ.get('PO_PERSIST_ATTACHMENTS')
+PERSIST_ATTACHMENTS = _persist_setting is None or _persist_setting.lower() in ('1', 'true', 'yes')
+PERSIST_REQUESTED = _persist_setting is not None and PERSIST_ATTACHMENTS
+
+
+def is_path(source):
+    return isinstance(source, (str, os.PathLike))
+
+
+def source_name(source, default='<memory>'):
+    """
+    :param source: Path or buffer
+    :param default: Name used for anonymous buffers
+    :return: Base file name for logging and extension checks
+    """
+    if is_path(source):
+        return os.path.basename(os.fspath(source))
+    name = getattr(source, 'name', None)
+    return os.path.basename(name) if isinstance(name, str) else default
+
+
+def source_size(source):
+    """
+    :param source: Path or buffer
+    :return: Size in bytes
+    """
+    if is_path(source):
+        return os.path.getsize(source)
+    if isinstance(source, (bytes, bytearray)):
+        return len(source)
+    if isinstance(source, memoryview):
+        return source.nbytes
+    if isinstance(source, io.BytesIO):
+        return source.getbuffer().nbytes
+    position = source.tell()
+    size = source.seek(0, io.SEEK_END)
+    source.seek(position)
+    return size
+
+
+def source_bytes(source):
+    """
+    Return the full content of a source, without copying where possible.
+
+    :param source: Path or buffer
+    :return: bytes, bytearray or memoryview
+    """
+    if is_path(source):
+        with open(source, 'rb') as file:
+            return file.read()
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return source
+    if isinstance(source, io.BytesIO):
+        return source.getbuffer()
+    source.seek(0)
+    return source.read()
+
+
+@contextmanager
+def open_source(source):
+    """
+    Open a source as a seekable binary stream positioned at the start.
+
+    Streams passed in by the caller are rewound but not closed.
+
+    :param source: Path or buffer
+    :return: Context manager yielding a binary file object
+    """
+    if is_path(source):
+        with open(source, 'rb') as file:
+            yield file
+    elif isinstance(source, (bytes, bytearray, memoryview)):
+        yield io.BytesIO(source)
+    else:
+        source.seek(0)
+        yield source
+
+
+def read_head(source, size):
+    """
+    :param source: Path or buffer
+    :param size: Number of leading bytes wanted
+    :return: Up to `size` leading bytes
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return bytes(source[:size])
+    with open_source(source) as stream:
+        return stream.read(size)
+
+
+@contextmanager
+def source_path(source, suffix=''):
+    """
+    Provide a file path for a source, spilling buffers to a temporary file.
+
+    :param source: Path or buffer
+    :param suffix: Extension for the temporary file (some tools go by it)
+    :return: Context manager yielding a path
+    """
+    if is_path(source):
+        yield os.fspath(source)
+        return
+    with tempfile.NamedTemporaryFile('wb', suffix=suffix, delete=False) as file:
+        file.write(source_bytes(source))
+    try:
+        yield file.name
+    finally:
+        os.remove(file.name)
+
+
+class AttachmentStore:
+    """
+    Attachments handed from ingestion to extraction within one process.
+
+    Each attachment is recorded under the link that is written to the email
+    sheet. Small attachments stay in memory; large ones, and all of them when
+    persistence is on, are written to the attachments folder as before, so
+    later stages find them either way.
+    """
+
+    def __init__(self, directory='attachments', persist=PERSIST_ATTACHMENTS,
+                 spill_threshold=SPILL_THRESHOLD, max_memory_bytes=MAX_MEMORY_BYTES):
+        """
+        :param directory: Folder attachments are written to when spilled or persisted
+        :param persist: Write every attachment to disk
+        :param spill_threshold: Attachments larger than this are written to disk
+        :param max_memory_bytes: Cap on the total size of attachments held in memory
+        """
+        self.directory = directory
+        self.persist = persist
+        self.spill_threshold = spill_threshold
+        self.max_memory_bytes = max_memory_bytes
+        self._buffers = {}
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+
+    def put(self, filename, data):
+        """
+        Store an attachment.
+
+        :param filename: Attachment file name
+        :param data: Attachment bytes
+        :return: Link to record for the attachment (its path in the attachments folder)
+        """
+        link = os.path.join(self.directory, filename)
+        with self._lock:
+            previous = self._buffers.pop(os.path.normpath(link), None)
+            if previous is not None:
+                self._memory_bytes -= len(previous)
+            in_memory = (not self.persist and len(data) <= self.spill_threshold
+                         and self._memory_bytes + len(data) <= self.max_memory_bytes)
+            if in_memory:
+                self._buffers[os.path.normpath(link)] = data
+                self._memory_bytes += len(data)
+                return link
+        os.makedirs(self.directory, exist_ok=True)
+        with open(link, 'wb') as file:
+            file.write(data)
+        logging.debug(f"Wrote attachment {link} ({len(data)} bytes) to disk")
+        return link
+
+    def get(self, link):
+        """
+        :param link: Link returned by put
+        :return: The attachment bytes, or None if it is not held in memory
+        """
+        with self._lock:
+            return self._buffers.get(os.path.normpath(str(link)))
+
+    def discard(self, link):
+        """
+        Release an in-memory attachment once it has been extracted, or once
+        classification has ruled its email out.
+
+        :param link: Link returned by put
+        """
+        with self._lock:
+            data = self._buffers.pop(os.path.normpath(str(link)), None)
+            if data is not None:
+                self._memory_bytes -= len(data)
+
+
+# Shared between gmailreader (ingestion) and POExtractor (extraction)
+attachment_store = AttachmentStore()
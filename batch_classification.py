@@ -0,0 +1,439 @@
+import os
+import json
+import time
+import uuid
+import hashlib
+import logging
+import argparse
+
+import pandas as pd
+
+from classification_cache import ClassificationCache, cache_key
+from email_classification import (
+    FAILED_LABEL, MAX_TOKENS, MODEL, PROMPT_VERSION, TEMPERATURE, build_messages, email_fields, normalize_label
+)
+from pre_classifier import LABELS, PreClassifier, email_text
+
+# Batch request files and manifests are kept here so a submitted batch can be
+# collected by a later process (e.g. the next morning)
+BATCH_DIR = os.environ.get('PO_BATCH_DIR', 'batches')
+BATCH_ENDPOINT = '/v1/chat/completions'
+COMPLETION_WINDOW = '24h'
+POLL_INTERVAL = float(os.environ.get('PO_BATCH_POLL_INTERVAL', 60))
+# Batch API statuses after which nothing more will happen
+TERMINAL_STATUSES = ('completed', 'failed', 'expired', 'cancelled')
+# The Batch API takes at most 50,000 requests and 200 MB per input file;
+# larger sheets are split into several batches under one manifest
+MAX_BATCH_REQUESTS = 50000
+MAX_BATCH_BYTES = 200 * 1000 * 1000
+
+
+def row_custom_id(row):
+    """
+    Stable request id for an email row: the Gmail message id plus a hash of
+    the attachment. Sheets without those columns fall back to a hash of the
+    sender, subject, date and filename.
+
+    :param row: pandas Series (or dict) of one email
+    :return: custom_id string
+    """
+    message_id = row.get('Message ID')
+    attachment_hash = row.get('Attachment Hash')
+    if isinstance(message_id, str) and message_id:
+        suffix = attachment_hash[:16] if isinstance(attachment_hash, str) and attachment_hash else 'none'
+        return f"{message_id}-{suffix}"
+    key = "\x1f".join(str(row.get(column, '')) for column in ('Sender Email', 'Subject', 'Date', 'Filename'))
+    return f"row-{hashlib.sha256(key.encode('utf-8')).hexdigest()[:24]}"
+
+
+def batch_request(custom_id, fields):
+    """
+    :param custom_id: Request id
+    :param fields: Prompt fields (see email_classification.email_fields)
+    :return: One line of a Batch API request file, as a dictionary
+    """
+    return {
+        'custom_id': custom_id,
+        'method': 'POST',
+        'url': BATCH_ENDPOINT,
+        'body': {
+            'model': MODEL,
+            'messages': build_messages(**fields),
+            'temperature': TEMPERATURE,
+            'max_tokens': MAX_TOKENS,
+        },
+    }
+
+
+def write_batch_files(df, path_stem, max_requests=MAX_BATCH_REQUESTS, max_bytes=MAX_BATCH_BYTES):
+    """
+    Write one classification request per email to JSONL batch files, starting
+    a new file before one would exceed max_requests lines or max_bytes.
+
+    Rows sharing a custom_id (the same attachment listed twice) are sent once.
+
+    :param df: Email sheet
+    :param path_stem: Path of the files to write, without the "-<part>.jsonl" suffix
+    :param max_requests: Most requests per file
+    :param max_bytes: Largest file size in bytes
+    :return: Tuple of (list of custom_ids, one per row of df; list of file paths written)
+    """
+    custom_ids = []
+    written = set()
+    paths = []
+    file = None
+    count = size = 0
+    try:
+        for _, row in df.iterrows():
+            custom_id = row_custom_id(row)
+            custom_ids.append(custom_id)
+            if custom_id in written:
+                continue
+            written.add(custom_id)
+            line = (json.dumps(batch_request(custom_id, email_fields(row)), ensure_ascii=False) + "\n").encode('utf-8')
+            if file is None or count >= max_requests or size + len(line) > max_bytes:
+                if file is not None:
+                    file.close()
+                paths.append(f"{path_stem}-{len(paths) + 1:03d}.jsonl")
+                file = open(paths[-1], 'wb')
+                count = size = 0
+            file.write(line)
+            count += 1
+            size += len(line)
+    finally:
+        if file is not None:
+            file.close()
+    logging.info(f"Wrote {len(written)} batch requests for {len(custom_ids)} rows to {len(paths)} files")
+    return custom_ids, paths
+
+
+def parse_batch_output(text, usage=None):
+    """
+    Read the labels out of a Batch API output (or error) file.
+
+    :param text: JSONL content
+    :param usage: Dictionary filled with custom_id -> (prompt tokens, completion tokens), or None
+    :return: Dictionary of custom_id -> "PO", "Not PO", or FAILED_LABEL for failed
+        requests and answers that are neither
+    """
+    labels = {}
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        result = json.loads(line)
+        response = result.get('response') or {}
+        try:
+            if result.get('error') or response.get('status_code') != 200:
+                raise ValueError(result.get('error') or response.get('status_code'))
+            label = normalize_label(response['body']['choices'][0]['message']['content'])
+            if label not in LABELS:
+                raise ValueError(f"unexpected answer {label[:80]!r}")
+            labels[result['custom_id']] = label
+            if usage is not None:
+                tokens = response['body'].get('usage') or {}
+                usage[result['custom_id']] = (tokens.get('prompt_tokens'), tokens.get('completion_tokens'))
+        except (KeyError, IndexError, TypeError, ValueError) as e:
+            logging.error(f"Batch request {result.get('custom_id')} failed: {e}")
+            labels[result.get('custom_id')] = FAILED_LABEL
+    return labels
+
+
+def label_known_rows(df, cache=None, pre_classifier=None):
+    """
+    Label the rows that need no request: those in the classification cache,
+    then those the pre-classifier is confident about.
+
+    :param df: Email sheet
+    :param cache: ClassificationCache, or None
+    :param pre_classifier: PreClassifier, or None
+    :return: Tuple of (labels, cache keys), one per row of df; label None where a request is needed
+    """
+    rows = [email_fields(row) for _, row in df.iterrows()]
+    keys = [cache_key(MODEL, PROMPT_VERSION, fields['subject'], fields['body'], fields['filename'],
+                      fields['attachment_info']) for fields in rows]
+    labels = [cache.get(key) if cache is not None else None for key in keys]
+    pending = [i for i, label in enumerate(labels) if label is None]
+    if pre_classifier is not None and pending:
+        decided = pre_classifier.decide([email_text(**rows[i]) for i in pending])
+        for i, label in zip(pending, decided):
+            labels[i] = label
+        logging.info(f"Pre-classifier: {pre_classifier.stats()}")
+    return labels, keys
+
+
+class OpenAIBatchBackend:
+    """Submits request files to the OpenAI Batch API."""
+
+    def __init__(self, api_key=None, client=None):
+        """
+        :param api_key: OpenAI API key (default: OPENAI_API_KEY)
+        :param client: OpenAI client to use instead of creating one
+        """
+        if client is None:
+            from openai import OpenAI
+            client = OpenAI(api_key=api_key or os.environ.get("OPENAI_API_KEY"))
+        self.client = client
+
+    def submit(self, path):
+        """
+        :param path: JSONL request file
+        :return: Batch id
+        """
+        with open(path, 'rb') as file:
+            uploaded = self.client.files.create(file=file, purpose='batch')
+        batch = self.client.batches.create(input_file_id=uploaded.id, endpoint=BATCH_ENDPOINT,
+                                           completion_window=COMPLETION_WINDOW)
+        return batch.id
+
+    def status(self, batch_id):
+        """
+        :param batch_id: Batch id
+        :return: Tuple of (status, output file id or None, error file id or None)
+        """
+        batch = self.client.batches.retrieve(batch_id)
+        return batch.status, batch.output_file_id, batch.error_file_id
+
+    def download(self, file_id):
+        """
+        :param file_id: Output or error file id
+        :return: File content as text
+        """
+        return self.client.files.content(file_id).text
+
+
+class LocalBatchBackend:
+    """
+    File-based stand-in for the Batch API, for testing the round trip offline.
+
+    A submitted batch is copied to its own folder and answered in full on the
+    first status poll, in the Batch API's output format. Answers come from
+    `responder`, which by default labels an email PO when its subject or
+    attachment mentions a purchase order.
+    """
+
+    def __init__(self, directory=os.path.join(BATCH_DIR, 'local'), responder=None):
+        """
+        :param directory: Folder holding the local batches
+        :param responder: Callable(request body) -> label
+        """
+        self.directory = directory
+        self.responder = responder or self.keyword_responder
+
+    @staticmethod
+    def keyword_responder(body):
+        prompt = body['messages'][-1]['content'].lower()
+        subject = prompt.split('subject:', 1)[-1].split('\n', 1)[0]
+        # The fixed PO definition (after '---' in the v1 prompt layout) must not be matched
+        attachment = prompt.split('attachment information:', 1)[-1].split('---', 1)[0]
+        return "PO" if 'purchase order' in subject or 'purchase order' in attachment else "Not PO"
+
+    def _folder(self, batch_id):
+        return os.path.join(self.directory, batch_id)
+
+    def submit(self, path):
+        batch_id = f"batch_local_{uuid.uuid4().hex[:12]}"
+        folder = self._folder(batch_id)
+        os.makedirs(folder)
+        with open(path, 'rb') as source, open(os.path.join(folder, 'input.jsonl'), 'wb') as copy:
+            copy.write(source.read())
+        with open(os.path.join(folder, 'status'), 'w') as file:
+            file.write('in_progress')
+        return batch_id
+
+    def status(self, batch_id):
+        folder = self._folder(batch_id)
+        with open(os.path.join(folder, 'status')) as file:
+            status = file.read().strip()
+        if status == 'in_progress':
+            self._run(folder)
+            status = 'completed'
+            with open(os.path.join(folder, 'status'), 'w') as file:
+                file.write(status)
+        return status, os.path.join(folder, 'output.jsonl'), None
+
+    def _run(self, folder):
+        with open(os.path.join(folder, 'input.jsonl'), encoding='utf-8') as requests_file, \
+                open(os.path.join(folder, 'output.jsonl'), 'w', encoding='utf-8') as output:
+            for line in requests_file:
+                request = json.loads(line)
+                content = self.responder(request['body'])
+                result = {
+                    'id': f"batch_req_{uuid.uuid4().hex[:12]}",
+                    'custom_id': request['custom_id'],
+                    'response': {
+                        'status_code': 200,
+                        'request_id': uuid.uuid4().hex,
+                        'body': {'choices': [{'index': 0, 'finish_reason': 'stop',
+                                              'message': {'role': 'assistant', 'content': content}}]},
+                    },
+                    'error': None,
+                }
+                output.write(json.dumps(result) + "\n")
+
+    def download(self, file_id):
+        with open(file_id, encoding='utf-8') as file:
+            return file.read()
+
+
+def submit_classification_batch(input_file, backend, batch_dir=BATCH_DIR, use_cache=True, use_pre_classifier=True):
+    """
+    Write the classification requests for an email sheet and submit them as a batch.
+
+    Emails found in the classification cache or labelled by the pre-classifier
+    are not sent; their labels are kept in the manifest. If no email is left,
+    no batch is submitted; sheets over the Batch API's per-file limits are
+    submitted as several batches.
+
+    :param input_file: Email sheet (Excel)
+    :param backend: OpenAIBatchBackend or LocalBatchBackend
+    :param batch_dir: Folder for the request file and manifest
+    :param use_cache: Reuse labels of emails classified in earlier runs
+    :param use_pre_classifier: Label confident cases with the local pre-classifier
+    :return: Path of the manifest needed to collect the results
+    """
+    os.makedirs(batch_dir, exist_ok=True)
+    df = pd.read_excel(input_file)
+    custom_ids = [row_custom_id(row) for _, row in df.iterrows()]
+    cache = ClassificationCache() if use_cache else None
+    try:
+        labels, keys = label_known_rows(df, cache, PreClassifier.load() if use_pre_classifier else None)
+    finally:
+        if cache is not None:
+            cache.close()
+    known = {custom_id: label for custom_id, label in zip(custom_ids, labels) if label is not None}
+    pending = [label is None and custom_id not in known for custom_id, label in zip(custom_ids, labels)]
+
+    # The random part keeps two submits in the same second from overwriting each other
+    stem = os.path.join(batch_dir, f"classification-{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}")
+    request_files, batch_ids = [], []
+    if any(pending):
+        _, request_files = write_batch_files(df[pending], stem)
+        batch_ids = [backend.submit(request_file) for request_file in request_files]
+    manifest_path = f"{stem}.manifest.json"
+    with open(manifest_path, 'w', encoding='utf-8') as file:
+        json.dump({'batch_ids': batch_ids, 'input_file': os.path.abspath(input_file),
+                   'request_files': request_files, 'custom_ids': custom_ids,
+                   'known_labels': known, 'cache_keys': dict(zip(custom_ids, keys)), 'model': MODEL},
+                  file, indent=2)
+    logging.info(f"Submitted {len(batch_ids)} batches {', '.join(batch_ids)} "
+                 f"({len(set(custom_ids)) - len(known)} requests, {len(known)} labelled without a request); "
+                 f"manifest {manifest_path}")
+    return manifest_path
+
+
+def collect_classification_batch(manifest_path, output_file, backend, wait=True, poll_interval=POLL_INTERVAL,
+                                 use_cache=True):
+    """
+    Fetch a submitted batch's results and merge them into the email sheet.
+
+    Rows whose request failed or is missing from the output get FAILED_LABEL.
+    New labels are written to the classification cache.
+
+    :param manifest_path: Manifest written by submit_classification_batch
+    :param output_file: Path to save the classified sheet
+    :param backend: The backend the batch was submitted to
+    :param wait: Poll until the batch finishes; otherwise return False if it is still running
+    :param poll_interval: Seconds between status checks
+    :param use_cache: Write the new labels to the classification cache
+    :return: True if results were merged and saved
+    """
+    with open(manifest_path, encoding='utf-8') as file:
+        manifest = json.load(file)
+    # Manifests written before sheets were split hold a single batch_id
+    batch_ids = manifest.get('batch_ids', [manifest.get('batch_id')] if manifest.get('batch_id') else [])
+    finished = {}
+    while True:
+        for batch_id in batch_ids:
+            if batch_id not in finished:
+                status, output_file_id, error_file_id = backend.status(batch_id)
+                if status in TERMINAL_STATUSES:
+                    finished[batch_id] = (status, output_file_id, error_file_id)
+        running = [batch_id for batch_id in batch_ids if batch_id not in finished]
+        if not running:
+            break
+        if not wait:
+            logging.info(f"{len(running)} of {len(batch_ids)} batches still running")
+            return False
+        logging.info(f"{len(running)} of {len(batch_ids)} batches still running; "
+                     f"checking again in {poll_interval:.0f}s")
+        time.sleep(poll_interval)
+
+    labels, usage = {}, {}
+    for batch_id, (status, output_file_id, error_file_id) in finished.items():
+        if status != 'completed':
+            logging.warning(f"Batch {batch_id} {status}")
+        # Expired batches still return the requests that completed in time
+        for file_id in (output_file_id, error_file_id):
+            if file_id:
+                labels.update(parse_batch_output(backend.download(file_id), usage))
+    if use_cache and labels:
+        cache = ClassificationCache()
+        try:
+            for custom_id, label in labels.items():
+                key = manifest.get('cache_keys', {}).get(custom_id)
+                if key is not None and label in LABELS:
+                    cache.set(key, manifest['model'], label, *usage.get(custom_id, (None, None)))
+        finally:
+            cache.close()
+    labels.update(manifest.get('known_labels', {}))
+
+    df = pd.read_excel(manifest['input_file'])
+    df['Classification'] = [labels.get(custom_id, FAILED_LABEL) for custom_id in manifest['custom_ids']]
+    failed = sum(label == FAILED_LABEL for label in df['Classification'])
+    df.to_excel(output_file, index=False)
+    logging.info(f"{len(batch_ids)} batches done: {len(df)} rows classified ({failed} failed), saved to {output_file}")
+    return True
+
+
+def run_batch_classification(input_file, output_file, backend, poll_interval=POLL_INTERVAL, use_cache=True,
+                             use_pre_classifier=True):
+    """
+    Submit an email sheet as a batch, wait for it and save the classified sheet.
+
+    :param input_file: Email sheet (Excel)
+    :param output_file: Path to save the classified sheet
+    :param backend: OpenAIBatchBackend or LocalBatchBackend
+    :param poll_interval: Seconds between status checks
+    :param use_cache: Read and write the classification cache
+    :param use_pre_classifier: Label confident cases with the local pre-classifier
+    """
+    manifest_path = submit_classification_batch(input_file, backend, use_cache=use_cache,
+                                                use_pre_classifier=use_pre_classifier)
+    collect_classification_batch(manifest_path, output_file, backend, poll_interval=poll_interval,
+                                 use_cache=use_cache)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Classify emails through the OpenAI Batch API")
+    parser.add_argument('--local', action='store_true', help='Use the offline file-based stand-in')
+    parser.add_argument('--poll-interval', type=float, default=POLL_INTERVAL)
+    parser.add_argument('--no-cache', action='store_true', help='Ignore and do not update the classification cache')
+    parser.add_argument('--no-pre-classifier', action='store_true',
+                        help='Send every email, even ones the local pre-classifier is sure of')
+    commands = parser.add_subparsers(dest='command', required=True)
+    submit = commands.add_parser('submit', help='Write and submit the requests for an email sheet')
+    submit.add_argument('input_file')
+    collect = commands.add_parser('collect', help='Merge the results of a submitted batch')
+    collect.add_argument('manifest')
+    collect.add_argument('output_file')
+    collect.add_argument('--no-wait', action='store_true', help='Return at once if the batch is still running')
+    run = commands.add_parser('run', help='Submit, wait and merge')
+    run.add_argument('input_file')
+    run.add_argument('output_file')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s: %(message)s')
+    backend = LocalBatchBackend() if args.local else OpenAIBatchBackend()
+    if args.command == 'submit':
+        print(submit_classification_batch(args.input_file, backend, use_cache=not args.no_cache,
+                                          use_pre_classifier=not args.no_pre_classifier))
+    elif args.command == 'collect':
+        collect_classification_batch(args.manifest, args.output_file, backend, wait=not args.no_wait,
+                                     poll_interval=args.poll_interval, use_cache=not args.no_cache)
+    else:
+        run_batch_classification(args.input_file, args.output_file, backend, args.poll_interval,
+                                 use_cache=not args.no_cache, use_pre_classifier=not args.no_pre_classifier)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Benchmark concurrent email classification against a local mock endpoint.
+
+Every request to the mock takes a fixed latency, so the run time shows how
+many requests overlap: one at a time (the old per-row behaviour) against the
+asyncio classifier at increasing concurrency. A share of requests can be made
+to fail to check that the rest of the batch still completes.
+
+With --pack-size K, K emails share a request; the mock drops --drop-rate of
+the ids from its answers so the individual re-queue is exercised too.
+
+Usage:
+    python benchmarks/bench_async_classification.py [--emails N] [--latency S] [--fail-rate F]
+        [--pack-size K] [--drop-rate D]
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import logging
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from openai import AsyncOpenAI
+
+import email_classification
+from fixtures import make_emails
+from mock_llm import MockLLMServer
+
+
+async def run(rows, base_url, concurrency, timeout, pack_size):
+    # No client retries: injected failures should show up as failed rows
+    client = AsyncOpenAI(api_key='mock', base_url=base_url, max_retries=0)
+    try:
+        return await email_classification.classify_rows(rows, client, concurrency, timeout,
+                                                         pack_size=pack_size)
+    finally:
+        await client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Async classification benchmark")
+    parser.add_argument('--emails', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.2, help="Seconds per mock request")
+    parser.add_argument('--fail-rate', type=float, default=0.05)
+    parser.add_argument('--timeout', type=float, default=10)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32, 64])
+    parser.add_argument('--pack-size', type=int, default=1, help="Emails per request")
+    parser.add_argument('--drop-rate', type=float, default=0.0, help="Share of ids left out of packed answers")
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    emails = make_emails(args.emails)
+    rows = [email_classification.email_fields(row) for row in emails]
+    expected = ["PO" if i % 2 == 0 else "Not PO" for i in range(len(rows))]
+
+    print(f"{args.emails} emails, {args.latency}s per request, {args.fail_rate:.0%} injected failures, "
+          f"{args.pack_size} emails per request")
+    print(f"{'concurrency':>11} {'total s':>8} {'emails/s':>9} {'failed':>7} {'in order':>9} {'requests':>9} "
+          f"{'prompt tok':>11}")
+    for concurrency in args.concurrency:
+        with MockLLMServer(latency=args.latency, fail_rate=args.fail_rate, drop_rate=args.drop_rate) as server:
+            start = time.perf_counter()
+            labels = asyncio.run(run(rows, server.base_url, concurrency, args.timeout, args.pack_size))
+            elapsed = time.perf_counter() - start
+        failed = sum(label == email_classification.FAILED_LABEL for label in labels)
+        in_order = all(label in (want, email_classification.FAILED_LABEL) for label, want in zip(labels, expected))
+        print(f"{concurrency:>11} {elapsed:>8.2f} {len(labels) / elapsed:>9.1f} {failed:>7} {str(in_order):>9} {server.requests:>9} "
+              f"{server.prompt_tokens:>11}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Compare classification throughput of the OpenAI API and the local Ollama backend.
+
+Each available backend classifies the same synthetic emails at several
+concurrency levels: OpenAI when OPENAI_API_KEY is set, Ollama when it answers
+at OLLAMA_HOST (the model is preloaded first and its load time reported).
+With --mock both are replaced by the local mock server, with the latencies
+given, to check the harness itself.
+
+Usage:
+    python benchmarks/bench_classification_backends.py [--emails N] [--mock]
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import logging
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests
+from openai import AsyncOpenAI
+
+import email_classification
+import local_classification
+from fixtures import make_emails
+from mock_llm import MockLLMServer
+
+
+async def run(rows, api_key, base_url, model, concurrency, timeout):
+    client = AsyncOpenAI(api_key=api_key, base_url=base_url, max_retries=0)
+    try:
+        return await email_classification.classify_rows(rows, client, concurrency, timeout, model=model)
+    finally:
+        await client.close()
+
+
+def ollama_available(url):
+    try:
+        return requests.get(f"{url}/api/tags", timeout=2).ok
+    except requests.RequestException:
+        return False
+
+
+def measure(name, rows, api_key, base_url, model, levels, timeout):
+    for concurrency in levels:
+        start = time.perf_counter()
+        labels = asyncio.run(run(rows, api_key, base_url, model, concurrency, timeout))
+        elapsed = time.perf_counter() - start
+        failed = sum(label == email_classification.FAILED_LABEL for label in labels)
+        print(f"{name:<8} {concurrency:>11} {elapsed:>8.2f} {len(rows) / elapsed:>9.2f} {failed:>7}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Classification backend throughput benchmark")
+    parser.add_argument('--emails', type=int, default=40)
+    parser.add_argument('--timeout', type=float, default=local_classification.LOCAL_TIMEOUT)
+    parser.add_argument('--mock', action='store_true', help='Use mock servers instead of the real backends')
+    parser.add_argument('--openai-latency', type=float, default=0.6, help='Mock OpenAI seconds per request')
+    parser.add_argument('--local-latency', type=float, default=1.5, help='Mock Ollama seconds per request')
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    rows = [email_classification.email_fields(row) for row in make_emails(args.emails)]
+    parallel = local_classification.LOCAL_CONCURRENCY
+    print(f"{args.emails} emails")
+    print(f"{'backend':<8} {'concurrency':>11} {'total s':>8} {'emails/s':>9} {'failed':>7}")
+
+    if args.mock:
+        with MockLLMServer(latency=args.openai_latency) as server:
+            measure('openai', rows, 'mock', server.base_url, email_classification.MODEL, [1, 16], args.timeout)
+        with MockLLMServer(latency=args.local_latency) as server:
+            local_classification.preload_model(host=server.url)
+            measure('local', rows, 'ollama', server.base_url, local_classification.LOCAL_MODEL,
+                    [1, parallel], args.timeout)
+        return
+
+    if os.environ.get('OPENAI_API_KEY'):
+        measure('openai', rows, os.environ['OPENAI_API_KEY'], None, email_classification.MODEL,
+                [1, email_classification.CLASSIFY_CONCURRENCY], args.timeout)
+    else:
+        print("openai   skipped (OPENAI_API_KEY not set)")
+
+    url = local_classification.ollama_url()
+    if ollama_available(url):
+        start = time.perf_counter()
+        local_classification.preload_model()
+        print(f"local    model load {time.perf_counter() - start:.1f}s")
+        # Past the server's parallelism, requests only queue inside Ollama
+        measure('local', rows, 'ollama', f"{url}/v1", local_classification.LOCAL_MODEL,
+                [1, parallel, 2 * parallel], args.timeout)
+    else:
+        print(f"local    skipped (no Ollama server at {url})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""
+Compare OCR on raw images against the preprocessing pipeline.
+
+For every test-cases screenshot, reports OCR time and character count for the
+raw image (fixed --psm 6), the preprocessed image (--psm 6) and the
+preprocessed image with the auto-selected PSM. Preprocessing time is
+included in the preprocessed timings; the cache is bypassed.
+
+Usage:
+    python benchmarks/bench_image_preprocessing.py
+"""
+import os
+import sys
+import glob
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from PIL import Image
+
+from image_preprocessing import preprocess_image_file
+from ocr_engine import get_ocr_engine
+
+
+def run(label, file_path, engine):
+    start = time.perf_counter()
+    if label == 'raw':
+        image, psm = Image.open(file_path), 6
+    else:
+        image, psm = preprocess_image_file(file_path, use_cache=False)
+        if label == 'pre':
+            psm = 6
+    text = engine.image_to_string(image, config=f'--psm {psm}')
+    return time.perf_counter() - start, len(text.strip()), psm
+
+
+def main():
+    engine = get_ocr_engine()
+    images = sorted(glob.glob(os.path.join(ROOT, 'test-cases', '**', '*.png'), recursive=True))
+    totals = {label: [0.0, 0] for label in ('raw', 'pre', 'auto')}
+    print(f"{'image':<40} {'raw s':>6} {'chars':>6} {'pre s':>6} {'chars':>6} {'auto s':>6} {'chars':>6} {'psm':>4}")
+    for file_path in images:
+        row = []
+        for label in totals:
+            elapsed, chars, psm = run(label, file_path, engine)
+            totals[label][0] += elapsed
+            totals[label][1] += chars
+            row += [f"{elapsed:>6.2f}", f"{chars:>6}"]
+        print(f"{os.path.basename(file_path)[-40:]:<40} {' '.join(row)} {psm:>4}")
+    print(f"{'TOTAL':<40} " + " ".join(f"{t:>6.2f} {c:>6}" for t, c in totals.values()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""
+Benchmark the OCR engines on the test-cases screenshots.
+
+Compares the original one-tesseract-process-per-image approach with the
+batch list-file engine and, if tesserocr is installed, the in-process pool.
+
+Usage:
+    python benchmarks/bench_ocr_engine.py [--workers N] [--repeat N]
+"""
+import os
+import sys
+import glob
+import time
+import argparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import ocr_engine
+
+
+def time_engine(engine, images, repeat):
+    best = float('inf')
+    texts = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        texts = engine.images_to_strings(images, config='--psm 6')
+        best = min(best, time.perf_counter() - start)
+    return best, sum(len(text) for text in texts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OCR engine benchmark")
+    parser.add_argument('--workers', type=int, default=ocr_engine.OCR_WORKERS)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    images = sorted(glob.glob(os.path.join(ROOT, 'test-cases', '**', '*.png'), recursive=True))
+    print(f"{len(images)} images, {args.workers} workers")
+
+    engines = [
+        ocr_engine.SubprocessOCREngine(),
+        ocr_engine.BatchCLIOCREngine(workers=args.workers),
+    ]
+    if ocr_engine.tesserocr is not None:
+        engines.append(ocr_engine.TesserocrOCREngine(workers=args.workers))
+
+    print(f"{'engine':<12} {'total s':>8} {'per image ms':>13} {'chars':>8}")
+    for engine in engines:
+        elapsed, chars = time_engine(engine, images, args.repeat)
+        engine.close()
+        print(f"{engine.name:<12} {elapsed:>8.2f} {1000 * elapsed / len(images):>13.1f} {chars:>8}")
+
+
+if __name__ == "__main__":
+    main()
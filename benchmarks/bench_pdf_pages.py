@@ -0,0 +1,54 @@
+"""
+Benchmark sequential vs page-parallel PDF extraction on 1, 10 and 100 page documents.
+
+Usage:
+    python benchmarks/bench_pdf_pages.py [--workers N] [--repeat N]
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pdf_extraction
+from fixtures import make_pdf
+
+
+def time_extraction(file_path, max_workers, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        pages = pdf_extraction.extract_pdf_pages(file_path, max_workers=max_workers)
+        best = min(best, time.perf_counter() - start)
+    return best, len(pages)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PDF page-parallel extraction benchmark")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'pages':>6} {'sequential s':>13} {'parallel s':>11} {'speedup':>8}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for page_count in (1, 10, 100):
+            file_path = os.path.join(tmp, f"po_{page_count}.pdf")
+            with open(file_path, 'wb') as f:
+                f.write(make_pdf(page_count))
+
+            sequential, _ = time_extraction(file_path, 1, args.repeat)
+            # Force sharding regardless of the size thresholds so every size is measured
+            threshold = pdf_extraction.PARALLEL_PAGE_THRESHOLD
+            pdf_extraction.PARALLEL_PAGE_THRESHOLD = 0
+            try:
+                parallel, extracted = time_extraction(file_path, args.workers, args.repeat)
+            finally:
+                pdf_extraction.PARALLEL_PAGE_THRESHOLD = threshold
+            assert extracted == page_count
+            print(f"{page_count:>6} {sequential:>13.3f} {parallel:>11.3f} {sequential / parallel:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""
+Benchmark how much of the classification prompt a provider can serve from
+its prompt cache, for each prompt template version.
+
+The mock reports cached tokens like OpenAI (longest prefix seen before, in
+128-token steps). With --min-cached-tokens 1024 it applies OpenAI's minimum;
+0 behaves like a local server reusing its KV cache for any shared prefix.
+
+Usage:
+    python benchmarks/bench_prompt_caching.py [--emails N] [--versions 1 2] [--min-cached-tokens 0 1024]
+"""
+import os
+import sys
+import asyncio
+import argparse
+import logging
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from openai import AsyncOpenAI
+
+import email_classification
+from fixtures import make_emails
+from mock_llm import MockLLMServer
+from prompt_templates import load_template, template_versions
+
+
+async def run(rows, base_url, concurrency, pack_size):
+    client = AsyncOpenAI(api_key='mock', base_url=base_url, max_retries=0)
+    try:
+        return await email_classification.classify_rows(rows, client, concurrency, pack_size=pack_size)
+    finally:
+        await client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prompt prefix caching benchmark")
+    parser.add_argument('--emails', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--pack-size', type=int, default=1)
+    parser.add_argument('--versions', type=int, nargs='+', default=template_versions('classification'))
+    parser.add_argument('--min-cached-tokens', type=int, nargs='+', default=[0, 1024])
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    rows = [email_classification.email_fields(row) for row in make_emails(args.emails)]
+    print(f"{args.emails} emails, {args.pack_size} per request, {args.concurrency} in flight")
+    print(f"{'template':>8} {'static':>7} {'min cached':>10} {'requests':>9} {'prompt tok':>11} {'cached tok':>11} "
+          f"{'cached':>7}")
+    for version in args.versions:
+        email_classification.CLASSIFY_TEMPLATE = load_template('classification', version)
+        email_classification.PACKED_TEMPLATE = load_template('classification-packed', version)
+        for min_cached_tokens in args.min_cached_tokens:
+            with MockLLMServer(latency=0.05, min_cached_tokens=min_cached_tokens) as server:
+                asyncio.run(run(rows, server.base_url, args.concurrency, args.pack_size))
+            share = server.cached_tokens / server.prompt_tokens if server.prompt_tokens else 0.0
+            print(f"{'v' + str(version):>8} {email_classification.CLASSIFY_TEMPLATE.static_share:>7.0%} "
+                  f"{min_cached_tokens:>10} {server.requests:>9} {server.prompt_tokens:>11} "
+                  f"{server.cached_tokens:>11} {share:>7.0%}")
+
+
+if __name__ == "__main__":
+    main()
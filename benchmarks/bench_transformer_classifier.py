@@ -0,0 +1,89 @@
+"""
+Benchmark CPU transformer classification in emails/sec.
+
+Compares fixed-length padding in arrival order against length-sorted
+batches with dynamic padding, each in fp32 and int8, and puts the API
+backend (mock endpoint, --api-latency per request, 16 in flight) alongside.
+Without --model-dir a tiny randomly initialised model is generated, so the
+numbers show the batching gains rather than a real model's speed.
+
+Usage:
+    python benchmarks/bench_transformer_classifier.py [--model-dir DIR] [--emails N] [--threads N]
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import logging
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from openai import AsyncOpenAI
+
+import email_classification
+import transformer_classification
+from fixtures import make_emails, make_tiny_transformer
+from mock_llm import MockLLMServer
+from pre_classifier import email_text
+
+
+def time_transformer(model_dir, texts, threads, quantize, sort_by_length, max_length, batch_size):
+    classifier = transformer_classification.TransformerClassifier(
+        model_dir, max_length=max_length, batch_size=batch_size, num_threads=threads, quantize=quantize,
+        sort_by_length=sort_by_length)
+    if not sort_by_length:
+        # Baseline: every batch padded to max_length, as with static padding
+        pad = classifier.tokenizer.pad
+        classifier.tokenizer.pad = lambda features, **kwargs: pad(
+            features, padding='max_length', max_length=max_length, return_tensors='pt')
+    classifier.predict(texts[:batch_size])  # warm-up
+    start = time.perf_counter()
+    classifier.predict(texts)
+    return len(texts) / (time.perf_counter() - start)
+
+
+async def api_run(rows, base_url):
+    client = AsyncOpenAI(api_key='mock', base_url=base_url, max_retries=0)
+    try:
+        return await email_classification.classify_rows(rows, client, 16)
+    finally:
+        await client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Transformer classifier benchmark")
+    parser.add_argument('--model-dir', help='Fine-tuned model (default: a generated tiny model)')
+    parser.add_argument('--emails', type=int, default=512)
+    parser.add_argument('--threads', type=int, default=transformer_classification.NUM_THREADS)
+    parser.add_argument('--max-length', type=int, default=transformer_classification.MAX_LENGTH)
+    parser.add_argument('--batch-size', type=int, default=transformer_classification.BATCH_SIZE)
+    parser.add_argument('--api-latency', type=float, default=0.6, help='Mock API seconds per request')
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    emails = make_emails(args.emails)
+    texts = [email_text(**email_classification.email_fields(row)) for row in emails]
+    with tempfile.TemporaryDirectory() as tmp:
+        model_dir = args.model_dir or make_tiny_transformer(os.path.join(tmp, 'tiny'), texts)
+        print(f"{args.emails} emails, {args.threads} threads, max length {args.max_length}, "
+              f"batch {args.batch_size}, model {args.model_dir or 'tiny random'}")
+        print(f"{'variant':<34} {'emails/s':>9}")
+        for quantize in (False, True):
+            for sort_by_length in (False, True):
+                rate = time_transformer(model_dir, texts, args.threads, quantize, sort_by_length,
+                                        args.max_length, args.batch_size)
+                name = f"{'int8' if quantize else 'fp32'} {'sorted + dynamic' if sort_by_length else 'fixed padding'}"
+                print(f"{name:<34} {rate:>9.1f}")
+
+    rows = [email_classification.email_fields(row) for row in emails[:64]]
+    with MockLLMServer(latency=args.api_latency) as server:
+        start = time.perf_counter()
+        asyncio.run(api_run(rows, server.base_url))
+        rate = len(rows) / (time.perf_counter() - start)
+    print(f"{f'api (mock, {args.api_latency}s, 16 in flight)':<34} {rate:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+Synthetic documents for the benchmark scripts.
+
+The PDFs are written by hand so the benchmarks do not need a PDF authoring
+library; each page carries a PO-style header and a block of line items.
+"""
+
+
+def _escape(text):
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+
+def _page_stream(page_number, lines_per_page):
+    lines = [f"PURCHASE ORDER PO2300{page_number:04d}  Page {page_number}"]
+    for item in range(lines_per_page):
+        lines.append(
+            f"{item + 1:>3}  M3 X 17L HALF THREADED SCREW WITH WASHER  {1000 * (item + 1):>8} NOS  42.00"
+        )
+    ops = ["BT", "/F1 9 Tf", "11 TL", "40 800 Td"]
+    for line in lines:
+        ops.append(f"({_escape(line)}) Tj T*")
+    ops.append("ET")
+    return "\n".join(ops).encode('latin-1')
+
+
+def make_pdf(page_count, lines_per_page=60):
+    """
+    Build a text-layer PDF with the given number of pages.
+
+    :param page_count: Number of pages to generate
+    :param lines_per_page: Number of line-item rows per page
+    :return: PDF file content as bytes
+    """
+    objects = []
+    page_ids = []
+    # 1: catalog, 2: pages tree, 3: font; pages and streams follow
+    first_page_id = 4
+    for i in range(page_count):
+        page_ids.append(first_page_id + 2 * i)
+
+    objects.append(b"<< /Type /Catalog /Pages 2 0 R >>")
+    kids = " ".join(f"{pid} 0 R" for pid in page_ids)
+    objects.append(f"<< /Type /Pages /Kids [{kids}] /Count {page_count} >>".encode())
+    objects.append(b"<< /Type /Font /Subtype /Type1 /BaseFont /Courier >>")
+    for i, pid in enumerate(page_ids):
+        stream = _page_stream(i + 1, lines_per_page)
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {pid + 1} 0 R >>".encode()
+        )
+        objects.append(b"<< /Length " + str(len(stream)).encode() + b" >>\nstream\n" + stream + b"\nendstream")
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n".encode() + body + b"\nendobj\n"
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    for offset in offsets:
+        out += f"{offset:010d} 00000 n \n".encode()
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    return bytes(out)
+
+
+def make_emails(count):
+    """
+    Build rows of a synthetic email sheet, alternating PO and non-PO emails.
+
+    :param count: Number of emails
+    :return: List of row dictionaries with the columns the classifiers read
+    """
+    rows = []
+    for i in range(count):
+        if i % 2 == 0:
+            subject = f"Purchase Order PO2300{i:04d}"
+            body = f"Dear Sir,\nPlease find attached our purchase order PO2300{i:04d} for M3 screws.\nRegards"
+            info = f"PURCHASE ORDER PO2300{i:04d}\n1 | M3 X 17L HALF THREADED SCREW | {100 * (i + 1)} NOS | 42.00"
+            filename = f"PO2300{i:04d}.pdf"
+        else:
+            subject = f"Monthly newsletter #{i}"
+            body = "Hello,\nHere are this month's product updates and upcoming trade fairs.\nUnsubscribe"
+            info = ""
+            filename = ""
+        rows.append({
+            'Message ID': f"msg-{i:06d}",
+            'Subject': subject,
+            'Body': body,
+            'Filename': filename,
+            'Attachment Link': f"attachments/{filename}" if filename else "",
+            'extracted information from attachment': info,
+        })
+    return rows
+
+
+def make_tiny_transformer(directory, texts):
+    """
+    Save a tiny randomly initialised DistilBERT classifier and a word-level
+    tokenizer built from `texts`. Its predictions are meaningless; it only
+    exercises the inference path at realistic shapes.
+
+    :param directory: Directory to save the model and tokenizer to
+    :param texts: Texts whose words make up the vocabulary
+    :return: directory
+    """
+    import os
+    import re
+    from transformers import BertTokenizerFast, DistilBertConfig, DistilBertForSequenceClassification
+
+    words = sorted({word for text in texts for word in re.findall(r'\w+|[^\w\s]', text.lower())})
+    os.makedirs(directory, exist_ok=True)
+    vocab_file = os.path.join(directory, 'vocab.txt')
+    with open(vocab_file, 'w', encoding='utf-8') as file:
+        file.write("\n".join(['[PAD]', '[UNK]', '[CLS]', '[SEP]', '[MASK]'] + words) + "\n")
+    # DistilBERT takes no token_type_ids
+    tokenizer = BertTokenizerFast(vocab_file, model_input_names=['input_ids', 'attention_mask'])
+    config = DistilBertConfig(vocab_size=tokenizer.vocab_size, dim=64, hidden_dim=128, n_layers=2, n_heads=2,
+                              max_position_embeddings=512, num_labels=2,
+                              id2label={0: 'Not PO', 1: 'PO'}, label2id={'Not PO': 0, 'PO': 1})
+    DistilBertForSequenceClassification(config).save_pretrained(directory)
+    tokenizer.save_pretrained(directory)
+    return directory
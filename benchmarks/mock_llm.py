@@ -0,0 +1,160 @@
+"""
+Local stand-in for an OpenAI-compatible chat completions endpoint.
+
+Each request sleeps for a fixed latency before answering, so classifier
+benchmarks measure how well requests overlap rather than model speed. The
+answer is "PO" when the email subject mentions a purchase order. Packed
+prompts (several "### Email id:" blocks) are answered with a JSON array, from
+which a share of ids can be dropped to exercise the re-queue path. Usage
+reports cached prompt tokens the way OpenAI does: the longest prefix seen in
+an earlier request, in 128-token steps, once it reaches `min_cached_tokens`.
+"""
+import re
+import json
+import time
+import random
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SUBJECT = re.compile(r'Subject:\s*(.*)')
+CHARS_PER_TOKEN = 4
+CACHE_BLOCK_TOKENS = 128
+EMAIL_BLOCK = re.compile(r'^### Email id: (\S+)\n(.*?)(?=^### Email id: |\Z)', re.MULTILINE | re.DOTALL)
+
+
+def label_for(prompt):
+    match = SUBJECT.search(prompt)
+    subject = match.group(1).lower() if match else ''
+    return "PO" if 'purchase order' in subject or re.search(r'\bpo\d*\b', subject) else "Not PO"
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # Concurrent benchmark clients open many connections at once
+    request_queue_size = 256
+
+
+class MockLLMServer:
+    """
+    Threaded HTTP server answering POST /v1/chat/completions (and Ollama's
+    /api/generate model preload).
+
+    Use as a context manager; `base_url` is the OpenAI-compatible base URL
+    and `url` the server root.
+    """
+
+    def __init__(self, latency=0.2, fail_rate=0.0, drop_rate=0.0, min_cached_tokens=1024, seed=0):
+        """
+        :param latency: Seconds each request takes
+        :param fail_rate: Share of requests answered with HTTP 500
+        :param drop_rate: Share of emails left out of packed answers
+        :param min_cached_tokens: Shortest prefix served from the prompt cache
+            (1024 like OpenAI; 0 like a local server's KV cache)
+        :param seed: Seed for the failure and drop draws
+        """
+        self.latency = latency
+        self.fail_rate = fail_rate
+        self.drop_rate = drop_rate
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.min_cached_tokens = min_cached_tokens
+        self._prefixes = set()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = _Server(('127.0.0.1', 0), self._handler())
+        self._thread = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    @property
+    def base_url(self):
+        return f"{self.url}/v1"
+
+    def respond(self, path, payload):
+        """
+        :param path: Request path
+        :param payload: Decoded JSON request body
+        :return: Tuple of (HTTP status, JSON-serialisable response)
+        """
+        if path == '/api/generate':
+            # Ollama model preload (no prompt)
+            return 200, {'model': payload.get('model', 'mock'), 'response': '', 'done': True}
+        if not path.endswith('/chat/completions'):
+            return 404, {'error': {'message': f"unknown path {path}"}}
+        prompt = payload['messages'][-1]['content']
+        blocks = EMAIL_BLOCK.findall(prompt)
+        if blocks:
+            with self._lock:
+                kept = [(email_id, block) for email_id, block in blocks if self._random.random() >= self.drop_rate]
+            content = json.dumps([{'id': email_id, 'label': label_for(block)} for email_id, block in kept])
+        else:
+            content = label_for(prompt)
+        text = "".join(message['content'] for message in payload['messages'])
+        prompt_tokens = len(text) // CHARS_PER_TOKEN
+        cached_tokens = self._cached_tokens(text)
+        with self._lock:
+            self.prompt_tokens += prompt_tokens
+            self.cached_tokens += cached_tokens
+        return 200, {
+            'id': f"chatcmpl-{self.requests}",
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': payload.get('model', 'mock'),
+            'choices': [{'index': 0, 'finish_reason': 'stop',
+                         'message': {'role': 'assistant', 'content': content}}],
+            'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': 2,
+                      'total_tokens': prompt_tokens + 2,
+                      'prompt_tokens_details': {'cached_tokens': cached_tokens}},
+        }
+
+    def _cached_tokens(self, text):
+        """
+        :param text: Concatenated prompt messages
+        :return: Tokens of the longest block-aligned prefix seen before (0 below min_cached_tokens)
+        """
+        block = CACHE_BLOCK_TOKENS * CHARS_PER_TOKEN
+        cached = 0
+        with self._lock:
+            for end in range(block, len(text) + 1, block):
+                prefix = hash(text[:end])
+                if cached == end - block and prefix in self._prefixes:
+                    cached = end
+                self._prefixes.add(prefix)
+        tokens = cached // CHARS_PER_TOKEN
+        return tokens if tokens >= max(self.min_cached_tokens, CACHE_BLOCK_TOKENS) else 0
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                with server._lock:
+                    server.requests += 1
+                    fail = server._random.random() < server.fail_rate
+                time.sleep(server.latency)
+                status, body = (500, {'error': {'message': 'injected failure'}}) if fail \
+                    else server.respond(self.path, payload)
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
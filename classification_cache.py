@@ -0,0 +1,183 @@
+import os
+import re
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+
+from content_cache import CACHE_DIR
+
+DEFAULT_DB_PATH = os.path.join(CACHE_DIR, 'classifications.sqlite3')
+# Entries older than this are re-classified (the model behind an alias can change)
+CACHE_TTL = float(os.environ.get('PO_CLASSIFY_CACHE_TTL', 30 * 24 * 3600))
+# Least recently used entries beyond this count are evicted
+CACHE_MAX_ENTRIES = int(os.environ.get('PO_CLASSIFY_CACHE_MAX_ENTRIES', 100000))
+# Lookups run on the classification event loop, so hits only note their
+# last_used time and new labels are committed in groups of this many; both are
+# written out by flush (called from evict and close)
+CACHE_COMMIT_EVERY = 100
+
+# USD per million tokens (input, output), for the cost-saved counter
+MODEL_PRICES = {
+    'gpt-4o-mini-2024-07-18': (0.15, 0.60),
+}
+
+
+def normalize_field(value):
+    """
+    :param value: Prompt field (any type; NaN and None become "")
+    :return: Text with whitespace runs collapsed and ends stripped
+    """
+    if value is None or value != value:
+        return ""
+    return re.sub(r'\s+', ' ', str(value)).strip()
+
+
+def cache_key(model, template_version, subject, body, filename, attachment_info):
+    """
+    Key of a classification: the model, the prompt template version and a
+    hash of the normalised email fields the prompt is built from.
+
+    :return: Key string
+    """
+    digest = hashlib.sha256()
+    for field in (subject, body, filename, attachment_info):
+        digest.update(normalize_field(field).encode('utf-8'))
+        digest.update(b'\x1f')
+    return f"{model}:v{template_version}:{digest.hexdigest()}"
+
+
+class ClassificationCache:
+    """
+    SQLite table of email labels, so re-running a window only pays for new emails.
+
+    Classification runs at temperature 0, so the same model, template and
+    email give the same label. Entries expire after `ttl` seconds and the
+    least recently used are evicted beyond `max_entries`. Hits and new
+    labels reach the database file on flush, evict or close.
+    """
+
+    def __init__(self, db_path=DEFAULT_DB_PATH, ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES):
+        """
+        :param db_path: SQLite database file
+        :param ttl: Seconds an entry stays valid
+        :param max_entries: Maximum number of entries kept
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.tokens_saved = 0
+        self.cost_saved = 0.0
+        self._lock = threading.Lock()
+        # key -> last_used time of hits not yet written
+        self._touched = {}
+        self._uncommitted = 0
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS classifications ("
+            "key TEXT PRIMARY KEY, model TEXT NOT NULL, label TEXT NOT NULL, "
+            "prompt_tokens INTEGER, completion_tokens INTEGER, created_at REAL NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS classifications_last_used ON classifications (last_used)")
+        self._db.commit()
+
+    def get(self, key):
+        """
+        Look up a label, counting the hit or miss.
+
+        :param key: Key from cache_key
+        :return: Label, or None on a miss or an expired entry
+        """
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT model, label, prompt_tokens, completion_tokens, created_at FROM classifications WHERE key = ?",
+                (key,),
+            ).fetchone()
+            if row is None or now - row[4] > self.ttl:
+                self.misses += 1
+                return None
+            model, label, prompt_tokens, completion_tokens, _ = row
+            self._touched[key] = now
+            self.hits += 1
+            self.tokens_saved += (prompt_tokens or 0) + (completion_tokens or 0)
+            input_price, output_price = MODEL_PRICES.get(model, (0.0, 0.0))
+            self.cost_saved += ((prompt_tokens or 0) * input_price + (completion_tokens or 0) * output_price) / 1e6
+        return label
+
+    def set(self, key, model, label, prompt_tokens=None, completion_tokens=None):
+        """
+        Store a label with the token usage of the request that produced it.
+
+        :param key: Key from cache_key
+        :param model: Model that produced the label
+        :param label: Classification label
+        :param prompt_tokens: Prompt tokens of the request
+        :param completion_tokens: Completion tokens of the request
+        """
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO classifications VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, model, label, prompt_tokens, completion_tokens, now, now),
+            )
+            self._touched.pop(key, None)
+            self._uncommitted += 1
+            if self._uncommitted >= CACHE_COMMIT_EVERY:
+                self._db.commit()
+                self._uncommitted = 0
+
+    def flush(self):
+        """
+        Write the last_used times of this run's hits and commit pending labels.
+        """
+        with self._lock:
+            if self._touched:
+                self._db.executemany("UPDATE classifications SET last_used = ? WHERE key = ?",
+                                     [(used, key) for key, used in self._touched.items()])
+                self._touched.clear()
+            self._db.commit()
+            self._uncommitted = 0
+
+    def evict(self):
+        """
+        Delete expired entries, then the least recently used ones beyond max_entries.
+
+        :return: Number of entries deleted
+        """
+        self.flush()
+        with self._lock:
+            deleted = self._db.execute(
+                "DELETE FROM classifications WHERE created_at < ?", (time.time() - self.ttl,)
+            ).rowcount
+            deleted += self._db.execute(
+                "DELETE FROM classifications WHERE key IN (SELECT key FROM classifications "
+                "ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            ).rowcount
+            self._db.commit()
+        if deleted:
+            logging.info(f"Evicted {deleted} classification cache entries")
+        return deleted
+
+    def stats(self):
+        """
+        :return: Dictionary of lookups, hits, misses, hit rate, tokens and USD saved
+        """
+        lookups = self.hits + self.misses
+        return {
+            'lookups': lookups,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+            'tokens_saved': self.tokens_saved,
+            'cost_saved_usd': round(self.cost_saved, 4),
+        }
+
+    def close(self):
+        self.flush()
+        self._db.close()
@@ -0,0 +1,86 @@
+import os
+import pickle
+import hashlib
+import logging
+import tempfile
+
+from attachment_source import is_path, source_bytes
+
+# Shared on-disk cache for extraction results keyed by content hash, so the
+# same attachment bytes are never preprocessed or OCR'd twice.
+CACHE_DIR = os.environ.get('PO_EXTRACTION_CACHE_DIR', '.extraction_cache')
+
+
+def file_sha256(file_path, chunk_size=1024 * 1024):
+    """
+    Hash a file's content without reading it into memory at once.
+
+    :param file_path: Path to the file, or the content as an in-memory buffer
+    :param chunk_size: Bytes read per iteration
+    :return: Hex SHA-256 digest
+    """
+    if not is_path(file_path):
+        return hashlib.sha256(source_bytes(file_path)).hexdigest()
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for block in iter(lambda: file.read(chunk_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ContentCache:
+    """
+    Pickle-per-entry cache under CACHE_DIR/<namespace>/.
+
+    Keys are usually a content hash plus whatever settings affect the result.
+    Read and write failures are logged and treated as misses, never raised.
+    """
+
+    def __init__(self, namespace, cache_dir=None):
+        """
+        :param namespace: Sub-directory separating one kind of result from another
+        :param cache_dir: Root cache directory (defaults to CACHE_DIR)
+        """
+        self.directory = os.path.join(cache_dir or CACHE_DIR, namespace)
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, key):
+        name = hashlib.sha256(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, name[:2], name + '.pkl')
+
+    def get(self, key, default=None):
+        """
+        Look up a cached value.
+
+        :param key: Cache key
+        :param default: Value returned on a miss
+        :return: Cached value or default
+        """
+        try:
+            with open(self._path(key), 'rb') as file:
+                value = pickle.load(file)
+            self.hits += 1
+            return value
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logging.warning(f"Cache read error for {key}: {e}")
+        self.misses += 1
+        return default
+
+    def set(self, key, value):
+        """
+        Store a value, writing atomically so concurrent workers never see partial entries.
+
+        :param key: Cache key
+        :param value: Picklable value
+        """
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with tempfile.NamedTemporaryFile('wb', dir=os.path.dirname(path), delete=False) as file:
+                pickle.dump(value, file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(file.name, path)
+        except Exception as e:
+            logging.warning(f"Cache write error for {key}: {e}")
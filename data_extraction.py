@@ -1,15 +1,29 @@
 import os
 import pandas as pd
-import pytesseract
 from PIL import Image
-from PyPDF2 import PdfReader
-import pdfplumber
 import re
-from docx import Document
 import traceback
 import logging
 import requests
 import json
+from collections import Counter
+
+from archive_expansion import ARCHIVE_TYPES, expand_attachment
+from attachment_source import attachment_store, is_path, open_source, source_name
+from content_cache import file_sha256
+from extractor_registry import ExtractorRegistry
+from text_compaction import compact_text, compaction_stats
+
+# Image attachments of the PO rows are OCR'd ahead of extraction in batches
+# of this many, so the CLI OCR engine loads its model once per batch
+OCR_BATCH_IMAGES = 32
+# OCR profile for the single retry of an image whose text fails the quality
+# gate: sparse-text segmentation finds text scattered across photos
+OCR_RETRY_CONFIG = '--psm 11'
+# The image modules (hash index, preprocessing, triage, OCR) are imported by the
+# image handlers on first use; runs without image attachments never load them.
+# image_hash_distance defaults to image_hash_index.MAX_HAMMING_DISTANCE.
+DEFAULT_HASH_DISTANCE = 'default'
 
 # Configure logging
 logging.basicConfig(
@@ -22,17 +36,54 @@ logging.basicConfig(
 )
 
 class POExtractor:
-    def __init__(self, input_excel, attachments_folder, output_json):
+    def __init__(self, input_excel, attachments_folder, output_json, preprocess_images=True, auto_psm=False,
+                 triage_images=True, image_hash_distance=DEFAULT_HASH_DISTANCE, layout_ocr=False,
+                 compact_prompts=True, ocr_quality_gate=True):
         """
         Initialize POExtractor with input excel, attachments folder, and output JSON file path.
         
         :param input_excel: Path to the input Excel file containing email data
         :param attachments_folder: Folder containing attachment files
         :param output_json: Path to save the extracted PO details JSON
+        :param preprocess_images: Downscale, binarize, deskew and crop images before OCR
+        :param auto_psm: Pick the tesseract page segmentation mode from the image layout
+        :param triage_images: Skip OCR for logos, icons, tracking pixels and other non-text images
+        :param image_hash_distance: Max perceptual-hash distance for a near-duplicate image candidate;
+            verified near-duplicates reuse the OCR text, identical images also the PO details
+            (None disables the index)
+        :param layout_ocr: Rebuild rows and columns from OCR word boxes and emit tables as compact rows
+        :param compact_prompts: Strip whitespace runs, repeated page headers, OCR noise and boilerplate
+            from extracted text and cut it to the extraction token budget before prompting
+        :param ocr_quality_gate: Score OCR text (word shape, digit/symbol balance, confidence); retry
+            unreadable images once with another OCR profile and skip the LLM if they stay unreadable
         """
         self.input_excel = input_excel
         self.attachments_folder = attachments_folder
         self.output_json = output_json
+        self.preprocess_images = preprocess_images
+        self.auto_psm = auto_psm
+        self.triage_images = triage_images
+        self.layout_ocr = layout_ocr
+        self.compact_prompts = compact_prompts
+        self.ocr_quality_gate = ocr_quality_gate
+        self.image_hash_distance = image_hash_distance
+        self._image_index = None
+        # Near-duplicate matches found during OCR, consumed when PO details are extracted
+        self._image_matches = {}
+        # OCR quality of each image, consumed by the same step
+        self._ocr_quality = {}
+        # Index matches and (text, confidence) of images batched by prefetch_image_ocr,
+        # consumed by extract_text_from_image; all three are keyed by content hash
+        self._prefetched_matches = {}
+        self._prefetched_ocr = {}
+        # Attachments are routed by content, not by name; see extractor_registry
+        self.extractors = ExtractorRegistry(handlers={
+            'pdf': self.extract_text_from_pdf,
+            'image': self.extract_text_from_image,
+            'excel': self.extract_text_from_excel,
+            'word': self.extract_text_from_word,
+            'text': 'archive_expansion:read_text',
+        })
 
         # Define the columns for the output
         self.output_columns = [
@@ -51,6 +102,23 @@ class POExtractor:
             "Other remarks/instructions"
         ]
 
+    @property
+    def image_index(self):
+        """
+        Perceptual-hash index of OCR'd images, opened on first use.
+
+        :return: ImageHashIndex, or None if disabled
+        """
+        if self.image_hash_distance is None:
+            return None
+        if self._image_index is None:
+            from image_hash_index import ImageHashIndex, MAX_HAMMING_DISTANCE
+            distance = self.image_hash_distance
+            if distance == DEFAULT_HASH_DISTANCE:
+                distance = MAX_HAMMING_DISTANCE
+            self._image_index = ImageHashIndex(max_distance=distance)
+        return self._image_index
+
     def normalize_path(self, file_path):
         """
         Normalize the file path to ensure correct file access.
@@ -74,30 +142,16 @@ class POExtractor:
 
     def extract_text_from_pdf(self, file_path):
         """
-        Extract text from a PDF file using multiple methods.
+        Extract text from a PDF file. Text-layer pages are read directly, scanned
+        pages are OCR'd and large PDFs are extracted page-parallel (see pdf_extraction).
+        Line-item tables are emitted as compact '|'-separated rows ahead of the page text.
         
         :param file_path: Path to the PDF file
         :return: Extracted text from the PDF
         """
-        texts = []
         try:
-            # Try extracting with pdfplumber first
-            with pdfplumber.open(file_path) as pdf:
-                for page in pdf.pages:
-                    page_text = page.extract_text()
-                    if page_text:
-                        texts.append(page_text)
-            
-            # If pdfplumber fails, use PyPDF2
-            if not texts:
-                with open(file_path, 'rb') as file:
-                    pdf_reader = PdfReader(file)
-                    for page in pdf_reader.pages:
-                        page_text = page.extract_text()
-                        if page_text:
-                            texts.append(page_text)
-            
-            full_text = "\n".join(texts)
+            from pdf_extraction import extract_pdf_text
+            full_text = extract_pdf_text(file_path, tables=True)
             logging.info(f"PDF text extraction successful: {len(full_text)} characters")
             return full_text
         except Exception as e:
@@ -105,32 +159,217 @@ class POExtractor:
             logging.error(traceback.format_exc())
             return ""
 
-    def extract_text_from_image(self, file_path):
+    def extract_text_from_image(self, file_path, inline=False):
         """
         Extract text from an image file using Tesseract OCR.
+        Images that fail triage (logos, icons, tracking pixels) are not OCR'd.
         
-        :param file_path: Path to the image file
+        :param file_path: Path to the image file, or its bytes
+        :param inline: True if the image was an inline (Content-ID) email part
         :return: Extracted text from the image
         """
         try:
-            img = Image.open(file_path)
-            text = pytesseract.image_to_string(img, config='--psm 6')
+            from image_triage import triage_image
+            from ocr_quality import is_readable, record, score_text
+            if self.triage_images and not triage_image(file_path, inline=inline).accepted:
+                return ""
+            key = self._match_key(file_path)
+            prefetched = self._prefetched_ocr.pop(key, None)
+            match = self._prefetched_matches.pop(key, None)
+            if match is None and prefetched is None and self.image_index is not None:
+                match = self.image_index.lookup(file_path, self._ocr_variant())
+            if match is not None:
+                self._image_matches[key] = match
+                if self.ocr_quality_gate:
+                    self._ocr_quality[key] = score_text(match.text)
+                return match.text
+            if prefetched is not None:
+                text, confidence = prefetched
+            else:
+                img, config, variant = self._prepare_image(file_path)
+                text, confidence = self._ocr_image(file_path, img, config, variant)
             logging.info(f"Image OCR successful: {len(text)} characters")
+            readable = True
+            if self.ocr_quality_gate:
+                quality = score_text(text, confidence)
+                if not is_readable(quality):
+                    text, quality = self._retry_ocr(file_path, text, quality)
+                else:
+                    record('passed')
+                self._ocr_quality[key] = quality
+                readable = is_readable(quality)
+            if self.image_index is not None and text.strip() and readable:
+                self.image_index.add(file_path, text, self._ocr_variant())
             return text
         except Exception as e:
             logging.error(f"Image text extraction error: {e}")
             return ""
 
+    def _ocr_variant(self):
+        """
+        :return: Key of the settings that shape OCR text, so the image index
+            never serves text made with other settings
+        """
+        from image_preprocessing import PREPROCESS_VERSION
+        preprocess = f"pre{PREPROCESS_VERSION}" if self.preprocess_images else "raw"
+        psm = "auto" if self.auto_psm else "psm6"
+        mode = "layout" if self.layout_ocr else "text"
+        return f"{preprocess}:{psm}:{mode}:retry[{OCR_RETRY_CONFIG}]" if self.ocr_quality_gate \
+            else f"{preprocess}:{psm}:{mode}"
+
+    def _prepare_image(self, file_path):
+        """
+        Load an image for OCR, preprocessed if enabled.
+
+        :return: Tuple of (PIL image, tesseract config, cache variant)
+        """
+        from image_preprocessing import preprocess_image_file, PREPROCESS_VERSION
+        psm = 6
+        if self.preprocess_images:
+            img, suggested_psm = preprocess_image_file(file_path)
+            if self.auto_psm:
+                psm = suggested_psm
+        else:
+            with open_source(file_path) as stream:
+                img = Image.open(stream)
+                img.load()
+        variant = f"pre{PREPROCESS_VERSION}" if self.preprocess_images else "raw"
+        return img, f'--psm {psm}', variant
+
+    def prefetch_image_ocr(self, rows):
+        """
+        OCR the image attachments of the given rows in batches before they are
+        processed one by one, so the default CLI engine starts one tesseract
+        run per batch instead of one per image. Images triage would skip and
+        images the hash index already knows are left out, and identical images
+        are OCR'd once. Archive members and layout OCR (which needs word boxes)
+        still go through the per-image path.
+
+        :param rows: DataFrame of the email rows about to be processed
+        """
+        if self.layout_ocr:
+            return
+        batches = {}
+        queued = set()
+
+        def flush(config):
+            from ocr_engine import get_ocr_engine
+            keys, images = zip(*batches.pop(config))
+            engine = get_ocr_engine()
+            try:
+                # The quality gate scores the text with tesseract's word confidences
+                if self.ocr_quality_gate:
+                    results = engine.images_to_strings_with_confidence(list(images), config=config)
+                else:
+                    results = [(text, None) for text in engine.images_to_strings(list(images), config=config)]
+            except Exception as e:
+                logging.error(f"Batched image OCR failed, OCR'ing images one by one: {e}")
+                return
+            for key, result in zip(keys, results):
+                self._prefetched_ocr[key] = result
+
+        for _, row in rows.iterrows():
+            source, display_name = self.resolve_attachment(str(row.get("Attachment Link", "")).strip())
+            if source is None:
+                continue
+            mime_type = row.get("Attachment Type")
+            inline = str(row.get("Inline", "")).strip().lower() in ('true', '1', 'yes')
+            try:
+                file_type = self.extractors.identify(source, mime_type if isinstance(mime_type, str) else None,
+                                                     os.path.basename(str(display_name)))
+                if file_type != 'image':
+                    continue
+                key = self._match_key(source)
+                if key in queued:
+                    continue
+                from image_triage import triage_image
+                if self.triage_images and not triage_image(source, inline=inline).accepted:
+                    continue
+                queued.add(key)
+                if self.image_index is not None:
+                    match = self.image_index.lookup(source, self._ocr_variant())
+                    if match is not None:
+                        self._prefetched_matches[key] = match
+                        continue
+                img, config, _ = self._prepare_image(source)
+            except Exception as e:
+                logging.warning(f"Not prefetching OCR for {display_name}: {e}")
+                continue
+            batches.setdefault(config, []).append((key, img))
+            if len(batches[config]) >= OCR_BATCH_IMAGES:
+                flush(config)
+        for config in list(batches):
+            flush(config)
+        if self._prefetched_ocr or self._prefetched_matches:
+            logging.info(f"Batched OCR of {len(self._prefetched_ocr)} images, "
+                         f"{len(self._prefetched_matches)} found in the hash index")
+
+    def _ocr_image(self, file_path, img, config, variant):
+        """
+        OCR an image, with the mean word confidence when the quality gate needs it.
+
+        :return: Tuple of (text, mean confidence or None)
+        """
+        if self.layout_ocr:
+            # Word boxes are cached, so re-extraction with another prompt skips OCR
+            from ocr_layout import ocr_words, reconstruct_layout
+            words = ocr_words(file_path, img, config, variant)
+            confidence = sum(word.conf for word in words) / len(words) if words else 0.0
+            return reconstruct_layout(words), confidence
+        from ocr_engine import get_ocr_engine
+        if self.ocr_quality_gate:
+            return get_ocr_engine().image_to_string_with_confidence(img, config=config)
+        return get_ocr_engine().image_to_string(img, config=config), None
+
+    def _retry_ocr(self, file_path, text, quality):
+        """
+        OCR an unreadable image once more with the other profile: the raw image
+        if it was preprocessed (binarization can wipe out low-contrast photos),
+        otherwise the preprocessed one, in sparse-text mode.
+
+        :return: Tuple of (text, QualityScore) of the better attempt
+        """
+        from image_preprocessing import preprocess_image_file, PREPROCESS_VERSION
+        from ocr_quality import is_readable, record, score_text
+        record('retried')
+        try:
+            if self.preprocess_images:
+                with open_source(file_path) as stream:
+                    img = Image.open(stream)
+                    img.load()
+                variant = "raw"
+            else:
+                img, _ = preprocess_image_file(file_path)
+                variant = f"pre{PREPROCESS_VERSION}"
+            retry_text, confidence = self._ocr_image(file_path, img, OCR_RETRY_CONFIG, variant)
+        except Exception as e:
+            logging.error(f"OCR retry failed: {e}")
+            return text, quality
+        retry_quality = score_text(retry_text, confidence)
+        logging.info(f"OCR quality {quality.score} -> {retry_quality.score} after retry")
+        if retry_quality.score > quality.score:
+            text, quality = retry_text, retry_quality
+        if is_readable(quality):
+            record('recovered')
+        return text, quality
+
+    @staticmethod
+    def _match_key(source):
+        # Content hash: identical attachments share OCR results, and a buffer can
+        # never pick up the results of an earlier one
+        return file_sha256(source)
+
     def extract_text_from_excel(self, file_path):
         """
-        Extract text from an Excel file.
+        Extract text from an Excel file. Every sheet is streamed and written as
+        compact '|'-separated rows within a size budget (see spreadsheet_extraction).
         
         :param file_path: Path to the Excel file
         :return: Text representation of the Excel data
         """
         try:
-            df = pd.read_excel(file_path)
-            text = df.to_string()
+            from spreadsheet_extraction import extract_spreadsheet_text
+            text = extract_spreadsheet_text(file_path)
             logging.info(f"Excel text extraction successful: {len(text)} characters")
             return text
         except Exception as e:
@@ -139,28 +378,34 @@ class POExtractor:
 
     def extract_text_from_word(self, file_path):
         """
-        Extract text from a Word document.
-        
+        Extract text from a Word document (.docx or legacy .doc).
+
+        Paragraphs and tables are emitted in document order, tables as
+        '[Table N]' blocks of '|'-separated rows, with headers and footers.
+
         :param file_path: Path to the Word document
         :return: Extracted text from the document
         """
         try:
-            doc = Document(file_path)
-            text = "\n".join([para.text for para in doc.paragraphs])
+            from word_extraction import extract_word_text
+            text = extract_word_text(file_path)
             logging.info(f"Word document text extraction successful: {len(text)} characters")
             return text
         except Exception as e:
             logging.error(f"Word text extraction error: {e}")
             return ""
 
-    def extract_po_details(self, text):
+    def extract_po_details(self, text, label='document'):
         """
         Extract PO details from text using Ollama API with Llama3.1 model.
         
         :param text: Input text to extract PO details from
+        :param label: Document name for logging
         :return: Dictionary of extracted PO details
         """
         try:
+            if self.compact_prompts:
+                text, _ = compact_text(text, stage='extraction', label=label)
             ollama_url = "http://localhost:11434/api/generate"
             headers = {"Content-Type": "application/json"}
             prompt = (
@@ -168,7 +413,9 @@ class POExtractor:
                 "Customer PO Number, Item Name, Quantity, Rate per unit, Unit of measurement, "
                 "Item wise Delivery Dates, Customer Name, Customer details, Applicable Taxes, "
                 "Terms of Payment, Discount, Other remarks/instructions\n\n"
-                "If a detail is not found, use 'N/A' as the value. Ensure the JSON is properly formatted.\n\n"
+                "If a detail is not found, use 'N/A' as the value. Ensure the JSON is properly formatted.\n"
+                "Tables in the text are marked [Table N] or [Line items] and given as '|'-separated rows, "
+                "header row first.\n\n"
                 f"Text:\n{text}"
             )
             payload = {
@@ -231,44 +478,110 @@ class POExtractor:
             logging.error(traceback.format_exc())
             return {key: "N/A" for key in self.output_columns[1:]}
 
-    def extract_attachment_content(self, attachment_path):
+    def resolve_attachment(self, attachment_path):
         """
-        Extract content from an attachment based on its file type.
-        
-        :param attachment_path: Path to the attachment file
-        :return: Extracted PO details
+        Find an attachment's content: bytes handed over in memory by ingestion,
+        or the file in the attachments folder.
+
+        :param attachment_path: Attachment link, or the attachment's bytes
+        :return: Tuple of (source, display name); source is None if the attachment is missing
         """
+        if not is_path(attachment_path):
+            return attachment_path, source_name(attachment_path)
+        data = attachment_store.get(attachment_path)
+        if data is not None:
+            return data, os.path.basename(str(attachment_path))
         full_path = self.normalize_path(attachment_path)
         if not full_path or not os.path.exists(full_path):
             logging.warning(f"Attachment not found: {attachment_path}")
+            return None, attachment_path
+        return full_path, full_path
+
+    def extract_attachment_content(self, attachment_path, inline=False, mime_type=None, name=None):
+        """
+        Extract content from an attachment based on its file type.
+        The type is sniffed from the file content, so misnamed attachments
+        are still routed to the right extractor.
+        
+        :param attachment_path: Attachment link, or the attachment's bytes (bytes, memoryview or BytesIO)
+        :param inline: True if the attachment was an inline (Content-ID) email part
+        :param mime_type: MIME type declared in the email, if any
+        :param name: File name of an in-memory attachment
+        :return: Extracted PO details
+        """
+        source, display_name = self.resolve_attachment(attachment_path)
+        if source is None:
             return {key: "N/A" for key in self.output_columns[1:]}
+        display_name = name or display_name
 
         try:
             # Determine file type and extract text accordingly
-            if full_path.lower().endswith('.pdf'):
-                text = self.extract_text_from_pdf(full_path)
-            elif full_path.lower().endswith(('.png', '.jpg', '.jpeg', '.tiff', '.bmp')):
-                text = self.extract_text_from_image(full_path)
-            elif full_path.lower().endswith(('.xls', '.xlsx')):
-                text = self.extract_text_from_excel(full_path)
-            elif full_path.lower().endswith('.docx'):
-                text = self.extract_text_from_word(full_path)
-            else:
-                logging.error(f"Unsupported file type: {full_path}")
+            file_type, text = self.extractors.extract(source, mime_type=mime_type, name=display_name, inline=inline)
+            if text is None:
                 return {key: "N/A" for key in self.output_columns[1:]}
+            if file_type == 'image':
+                from ocr_quality import is_readable, record
+                key = self._match_key(source)
+                match = self._image_matches.pop(key, None)
+                quality = self._ocr_quality.pop(key, None)
+                if text and quality is not None and not is_readable(quality):
+                    # The LLM would only answer N/A for every field
+                    logging.warning(f"Skipping PO extraction for {display_name}: OCR text unreadable "
+                                    f"(score {quality.score}, words {quality.word_ratio}, "
+                                    f"confidence {quality.confidence})")
+                    record('rejected')
+                    return {key: "N/A" for key in self.output_columns[1:]}
+                # A near-duplicate shares the text, not necessarily the PO; only identical bytes reuse details
+                if text and match is not None and match.exact and match.po_details:
+                    logging.info(f"Reusing PO details of an identical image for {display_name}")
+                    return match.po_details
 
             if text:
-                po_details = self.extract_po_details(text)
+                po_details = self.extract_po_details(text, label=display_name)
                 logging.debug(f"Extracted PO details: {po_details}")
+                if file_type == 'image' and self.image_index is not None:
+                    self.image_index.set_po_details(source, po_details, self._ocr_variant())
                 return po_details
             else:
-                logging.warning(f"No text extracted from {full_path}")
+                logging.warning(f"No text extracted from {display_name}")
                 return {key: "N/A" for key in self.output_columns[1:]}
         except Exception as e:
-            logging.error(f"Error extracting content from {full_path}: {e}")
+            logging.error(f"Error extracting content from {display_name}: {e}")
             logging.error(traceback.format_exc())
             return {key: "N/A" for key in self.output_columns[1:]}
 
+    def extract_attachment_documents(self, attachment_path, inline=False, mime_type=None):
+        """
+        Extract PO details from every document in an attachment.
+        Archives (zip, 7z, tar) and attached emails (.eml) are expanded within
+        nesting, size and file-count limits and each inner document is
+        extracted on its own; any other attachment is a single document.
+
+        :param attachment_path: Attachment link, or the attachment's bytes
+        :param inline: True if the attachment was an inline (Content-ID) email part
+        :param mime_type: MIME type declared in the email, if any
+        :return: List of extracted PO details, one per document
+        """
+        source, display_name = self.resolve_attachment(attachment_path)
+        try:
+            is_archive = source is not None and \
+                self.extractors.identify(source, mime_type, os.path.basename(str(display_name))) in ARCHIVE_TYPES
+        except OSError:
+            is_archive = False
+        if not is_archive:
+            return [self.extract_attachment_content(attachment_path, inline=inline, mime_type=mime_type)]
+
+        documents = []
+        try:
+            for name, member, member_mime in expand_attachment(source, self.extractors.identify, mime_type):
+                logging.info(f"Extracting {name}")
+                documents.append(self.extract_attachment_content(member, mime_type=member_mime,
+                                                                 name=os.path.basename(name)))
+        except Exception as e:
+            logging.error(f"Error expanding {display_name}: {e}")
+            logging.error(traceback.format_exc())
+        return documents or [{key: "N/A" for key in self.output_columns[1:]}]
+
     def process_emails(self):
         """
         Process emails from the input Excel file and extract PO details.
@@ -280,40 +593,70 @@ class POExtractor:
             
             # Filter rows classified as PO
             po_df = df[df['Classification'] == 'PO']
+
+            # Attachments of the other rows are never extracted; free their buffers now.
+            # A PO attachment's buffer is freed after the last row linking to it.
+            remaining_links = Counter(str(link).strip() for link in po_df.get("Attachment Link", []))
+            for link in df.get("Attachment Link", []):
+                if str(link).strip() not in remaining_links:
+                    attachment_store.discard(str(link).strip())
             
             # List to store results
             results = []
 
+            self.prefetch_image_ocr(po_df)
+
             # Process each PO row
             for index, row in po_df.iterrows():
                 logging.info(f"Processing row {index}")
                 
-                # Initialize result row with default 'N/A' values
-                result_row = {col: "N/A" for col in self.output_columns}
-                
-                # Set email sender
-                result_row["Email Sender"] = row.get("Email Sender", "N/A")
-                
-                # Get attachment link and extract content
+                # Get attachment link and extract content; archives yield one result per document
                 attachment_link = str(row.get("Attachment Link", "")).strip()
-                extracted_content = self.extract_attachment_content(attachment_link)
-                
-                # Update result row with extracted content
-                for key in self.output_columns[1:]:
-                    result_row[key] = extracted_content.get(key, "N/A")
-                
-                logging.debug(f"Result row: {result_row}")
-                results.append(result_row)
+                inline = str(row.get("Inline", "")).strip().lower() in ('true', '1', 'yes')
+                mime_type = row.get("Attachment Type")
+                mime_type = mime_type if isinstance(mime_type, str) else None
+                try:
+                    documents = self.extract_attachment_documents(attachment_link, inline=inline,
+                                                                  mime_type=mime_type)
+                finally:
+                    remaining_links[attachment_link] -= 1
+                    if not remaining_links[attachment_link]:
+                        attachment_store.discard(attachment_link)
+
+                for extracted_content in documents:
+                    # Initialize result row with default 'N/A' values
+                    result_row = {col: "N/A" for col in self.output_columns}
+
+                    # Set email sender
+                    result_row["Email Sender"] = row.get("Email Sender", "N/A")
+
+                    # Update result row with extracted content
+                    for key in self.output_columns[1:]:
+                        result_row[key] = extracted_content.get(key, "N/A")
+
+                    logging.debug(f"Result row: {result_row}")
+                    results.append(result_row)
 
             # Save results to JSON
             with open(self.output_json, 'w', encoding='utf-8') as json_file:
                 json.dump(results, json_file, indent=4, ensure_ascii=False)
             
             logging.info(f"Process completed. Results saved to {self.output_json}")
+            if self._image_index is not None:
+                logging.info(f"Perceptual hash cache: {self._image_index.stats()}")
+            logging.info(f"Extractor timings: {self.extractors.stats()}")
+            if self.compact_prompts:
+                logging.info(f"Prompt compaction: {compaction_stats()}")
+            if self.ocr_quality_gate:
+                from ocr_quality import gate_stats
+                logging.info(f"OCR quality gate: {gate_stats()}")
         
         except Exception as e:
             logging.error(f"Error processing emails: {e}")
             logging.error(traceback.format_exc())
+        finally:
+            self._prefetched_ocr.clear()
+            self._prefetched_matches.clear()
 
 '''def main():
     """
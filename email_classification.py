@@ -1,100 +1,391 @@
 import pandas as pd
 import os
+import re
 import json
-from openai import OpenAI
+import time
+import asyncio
+from collections import Counter
+from openai import AsyncOpenAI
 
-def classify_emails_in_file(input_file, output_file, api_key):
+from classification_cache import ClassificationCache, cache_key
+from pre_classifier import LABELS, PreClassifier, email_text
+from prompt_templates import load_template, record_usage, usage_stats
+from text_compaction import compact_text, compaction_stats, estimate_tokens
+
+# Define model parameters
+MODEL = "gpt-4o-mini-2024-07-18"
+TEMPERATURE = 0
+MAX_TOKENS = 3000
+SYSTEM_PROMPT = "You are a helpful assistant trained to classify emails as PO or Not PO."
+FAILED_LABEL = "Error: Classification Failed"
+
+# Classification requests in flight at once; raise towards the account's rate limit
+CLASSIFY_CONCURRENCY = int(os.environ.get('PO_CLASSIFY_CONCURRENCY', 16))
+# Seconds allowed per email, including the client's own retries, before it is marked failed
+REQUEST_TIMEOUT = float(os.environ.get('PO_CLASSIFY_TIMEOUT', 60))
+# Emails packed into one request (1: one request per email). The instructions
+# are then sent once per pack instead of once per email.
+PACK_SIZE = int(os.environ.get('PO_CLASSIFY_PACK_SIZE', 1))
+# Estimated tokens of email content per packed request
+PACK_TOKEN_BUDGET = int(os.environ.get('PO_CLASSIFY_PACK_TOKENS', 12000))
+
+_pack_totals = Counter()
+
+
+# Prompts are read from prompts/<name>.v<N>.txt (newest unless PO_PROMPT_VERSION
+# pins one): fixed instructions first, email fields last, so providers can
+# reuse the cached prefix across requests
+CLASSIFY_TEMPLATE = load_template('classification')
+PACKED_TEMPLATE = load_template('classification-packed')
+# Cached labels are keyed by it; changes with the template's version or text
+PROMPT_VERSION = CLASSIFY_TEMPLATE.key
+# Labels answered in packs are cached apart: a pack's prompt differs from the single-email one
+PACKED_PROMPT_VERSION = PACKED_TEMPLATE.key
+
+
+def create_prompt(subject, body, filename, attachment_link, attachment_info):
+    return CLASSIFY_TEMPLATE.render(subject=subject, body=body, filename=filename,
+                                    attachment_link=attachment_link, attachment_info=attachment_info)
+
+
+def email_fields(row):
     """
-    Classifies emails in an Excel file as "PO" or "Not PO" using OpenAI's API.
+    Pick the prompt fields out of a row of the email sheet.
 
-    Parameters:
-        input_file (str): Path to the input Excel file.
-        output_file (str): Path to save the classified output Excel file.
-        api_key (str): API key for OpenAI.
+    :param row: pandas Series (or dict) of one email
+    :return: Dictionary of subject, body, filename, attachment_link, attachment_info
+    """
+    return {
+        'subject': row.get('Subject', ''),
+        'body': row.get('Body', ''),
+        'filename': row.get('Filename', ''),
+        'attachment_link': row.get('Attachment Link', ''),
+        'attachment_info': row.get('extracted information from attachment', ''),
+    }
 
-    Returns:
-        None
+
+def compact_fields(fields):
+    """
+    Keep the prompt within budget: whitespace, page furniture and boilerplate removed.
+
+    :param fields: Prompt fields (see email_fields)
+    :return: Copy of the fields with body and attachment information compacted
+    """
+    fields = dict(fields)
+    if isinstance(fields['body'], str):
+        fields['body'], _ = compact_text(fields['body'], stage='email_body', label=f"body of '{fields['subject']}'")
+    if isinstance(fields['attachment_info'], str):
+        fields['attachment_info'], _ = compact_text(fields['attachment_info'], stage='classification',
+                                                    label=str(fields['filename']))
+    return fields
+
+
+def build_messages(subject, body, filename, attachment_link, attachment_info):
+    """
+    Build the chat messages classifying one email.
+
+    :return: List of chat messages
+    """
+    fields = compact_fields({'subject': subject, 'body': body, 'filename': filename,
+                             'attachment_link': attachment_link, 'attachment_info': attachment_info})
+    prompt = create_prompt(**fields)
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": prompt},
+    ]
+
+
+def email_block(email_id, subject, body, filename, attachment_link, attachment_info):
+    return (f"### Email id: {email_id}\n"
+            f"- Subject: {subject}\n"
+            f"- Body: {body}\n"
+            f"- Filename: {filename}\n"
+            f"- Attachment Link: {attachment_link}\n"
+            f"- Attachment Information:{attachment_info}\n")
+
+
+def create_packed_prompt(blocks):
+    """
+    Prompt classifying several emails at once; the PO guide is included once.
+
+    :param blocks: Email blocks (see email_block)
+    :return: Prompt text
+    """
+    return PACKED_TEMPLATE.render(emails="\n".join(blocks))
+
+
+def parse_packed_labels(content, ids):
+    """
+    Read the labels out of a packed answer, ignoring unknown, repeated or
+    malformed entries.
+
+    :param content: Model answer
+    :param ids: Email ids sent in the request
+    :return: Dictionary of id -> "PO" / "Not PO" (ids missing from the answer are absent)
+    """
+    match = re.search(r'\[.*\]', content, re.DOTALL)
+    try:
+        items = json.loads(match.group(0) if match else content)
+    except json.JSONDecodeError:
+        return {}
+    if isinstance(items, dict):
+        items = next((value for value in items.values() if isinstance(value, list)), [])
+    labels = {}
+    for item in items if isinstance(items, list) else []:
+        if not isinstance(item, dict):
+            continue
+        email_id = str(item.get('id', '')).strip()
+        label = normalize_label(str(item.get('label', '')))
+        if email_id in ids and email_id not in labels and label in LABELS:
+            labels[email_id] = label
+    return labels
+
+
+def make_packs(indexes, blocks, pack_size, token_budget=PACK_TOKEN_BUDGET):
+    """
+    Group emails into packs of at most pack_size emails and token_budget
+    estimated tokens; an email over the budget gets a pack of its own.
+
+    :param indexes: Row indexes to pack
+    :param blocks: Dictionary of row index -> email block text
+    :param pack_size: Maximum emails per pack
+    :param token_budget: Maximum estimated tokens of email blocks per pack
+    :return: List of packs (lists of row indexes)
+    """
+    packs, pack, tokens = [], [], 0
+    for i in indexes:
+        size = estimate_tokens(blocks[i])
+        if pack and (len(pack) >= pack_size or tokens + size > token_budget):
+            packs.append(pack)
+            pack, tokens = [], 0
+        pack.append(i)
+        tokens += size
+    if pack:
+        packs.append(pack)
+    return packs
+
+
+def normalize_label(content):
+    """
+    Reduce a model answer to "PO" or "Not PO"; local models tend to add
+    punctuation, markdown or an explanation.
+
+    :param content: Model answer
+    :return: "PO", "Not PO", or the stripped answer if it is neither
     """
-    # Initialize OpenAI client
-    client = OpenAI(api_key=api_key)
-
-    # Define model parameters
-    MODEL = "gpt-4o-mini-2024-07-18"
-    TEMPERATURE = 0
-    MAX_TOKENS = 3000
-
-    # Define the prompt template
-    def create_prompt(subject, body, filename, attachment_link, attachment_info):
-        return f"""
-        Classify the following email as PO or Not PO based on the provided information:
-
-    - Subject: {subject}  
-    - Body: {body}  
-    - Filename: {filename}  
-    - Attachment Link: {attachment_link}  
-    - Attachment Information:{attachment_info}  
-
-    ---
-
-    Definition of PO:
-    An email is classified as PO if it contains information related to a Purchase Order (a formal request to purchase goods or services). A Purchase Order typically includes at least some of the following details:  
-    - Customer PO Number  
-    - Item Name(s)  
-    - Quantity  
-    - Rate per Unit  
-    - Unit of Measurement  
-    - Delivery Dates  
-    - Customer Name  
-
-    Examples of Relevant Keywords:
-    - "Purchase Order"  
-    - "PO Number"  
-    - "Order Confirmation"  
-    - "Item Quantity"  
-    - "Delivery Schedule"  
-
-    Instructions for Classification:
-    1. Analyze the Subject and Body:
-       - Look for keywords or phrases indicating a Purchase Order.
-       - Check for mentions of specific items, quantities, delivery details, or rates.
-
-    2. Examine Attachments (if present):
-       - Determine if the attachment contains any PO-related information (e.g., PO Number, item details).
-       - Prioritize files labeled with terms like "PO" or "Order."
-
-    3. Contextual Relevance:
-       - If the email references a PO like pending order or has context of order is been given then classify as PO.
-       - If sufficient PO-related information is found in the email body or attachments, classify it as PO.
-       - Mark all the other general or specific business related email as Not PO whenever it does not implies anything about PO or associated with it.
-
-    Classification Output:
-    - PO: If the email contains PO-related information or references a formal request for items.  
-    - Not PO: If the email lacks sufficient details or relevance to a Purchase Order.
-
-    Strictly Classify as PO or Not PO do not mention any other information. 
-
-        """
-
-    # Function to classify a single email using OpenAI
-    def classify_email(subject, body, filename, attachment_link, attachment_info):
-        prompt = create_prompt(subject, body, filename, attachment_link, attachment_info)
+    answer = content.strip().strip('*_`"\'').strip()
+    lower = answer.lower()
+    if lower.startswith('not po'):
+        return "Not PO"
+    if lower == 'po' or lower.startswith(('po.', 'po\n', 'po ', 'po:')):
+        return "PO"
+    return answer
+
+
+async def classify_email(client, semaphore, fields, timeout=REQUEST_TIMEOUT, cache=None, model=MODEL):
+    """
+    Classify a single email with OpenAI, waiting for a free slot first.
+
+    :param client: AsyncOpenAI client
+    :param semaphore: asyncio.Semaphore bounding the requests in flight
+    :param fields: Prompt fields (see email_fields)
+    :param timeout: Seconds allowed for the request
+    :param cache: ClassificationCache consulted first and filled with new labels, or None
+    :param model: Model name
+    :return: "PO", "Not PO", or FAILED_LABEL if the request failed or timed out
+    """
+    key = None
+    if cache is not None:
+        key = cache_key(model, PROMPT_VERSION, fields['subject'], fields['body'], fields['filename'],
+                        fields['attachment_info'])
+        label = cache.get(key)
+        if label is not None:
+            return label
+    messages = build_messages(**fields)
+    async with semaphore:
         try:
+            started = time.perf_counter()
             # Call OpenAI's chat completion API
-            response = client.chat.completions.create(
-                model=MODEL,
-                messages=[
-                    {"role": "system", "content": "You are a helpful assistant trained to classify emails as PO or Not PO."},
-                    {"role": "user", "content": prompt},
-                ],
-                temperature=TEMPERATURE,
-                max_tokens=MAX_TOKENS,
+            response = await asyncio.wait_for(
+                client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    temperature=TEMPERATURE,
+                    max_tokens=MAX_TOKENS,
+                ),
+                timeout,
             )
+            usage = getattr(response, 'usage', None)
+            record_usage(model, usage, time.perf_counter() - started)
             # Access the `content` attribute directly
-            return response.choices[0].message.content.strip()
+            label = normalize_label(response.choices[0].message.content)
+            # An answer that is neither label is returned but never cached
+            if cache is not None and label in LABELS:
+                cache.set(key, model, label, getattr(usage, 'prompt_tokens', None),
+                          getattr(usage, 'completion_tokens', None))
+            return label
+        except asyncio.TimeoutError:
+            print(f"Classification timed out after {timeout}s: {fields['subject']}")
+            return FAILED_LABEL
         except Exception as e:
             print(f"Error during classification: {e}")
-            return "Error: Classification Failed"
+            return FAILED_LABEL
+
+
+async def classify_pack(client, semaphore, blocks, timeout=REQUEST_TIMEOUT, model=MODEL):
+    """
+    Classify a pack of emails in one request.
+
+    :param client: AsyncOpenAI client
+    :param semaphore: asyncio.Semaphore bounding the requests in flight
+    :param blocks: Dictionary of email id -> email block
+    :param timeout: Seconds allowed for the request
+    :param model: Model name
+    :return: Tuple of (dictionary of id -> label for the ids answered, prompt tokens or None)
+    """
+    messages = [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": create_packed_prompt(list(blocks.values()))},
+    ]
+    async with semaphore:
+        try:
+            started = time.perf_counter()
+            response = await asyncio.wait_for(
+                client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    temperature=TEMPERATURE,
+                    max_tokens=MAX_TOKENS,
+                ),
+                timeout,
+            )
+            usage = getattr(response, 'usage', None)
+            record_usage(model, usage, time.perf_counter() - started)
+            content = response.choices[0].message.content
+            # A refusal or empty answer has no content; its emails are re-sent one by one
+            labels = parse_packed_labels(content, blocks) if isinstance(content, str) else {}
+            return labels, getattr(usage, 'prompt_tokens', None)
+        except Exception as e:
+            print(f"Error during packed classification of {len(blocks)} emails: {e!r}")
+            return {}, None
+
+
+async def classify_packed(rows, client, semaphore, timeout=REQUEST_TIMEOUT, cache=None, model=MODEL,
+                          pack_size=PACK_SIZE):
+    """
+    Classify emails pack_size at a time. Emails whose id is missing from an
+    answer (or whose pack failed) are re-sent one by one. Packed answers are
+    cached under the packed template's key, re-sent ones under the single-email key.
+
+    :return: List of labels, in the order of `rows`
+    """
+    labels = [None] * len(rows)
+    keys = [None] * len(rows)
+    if cache is not None:
+        for i, fields in enumerate(rows):
+            keys[i] = cache_key(model, PACKED_PROMPT_VERSION, fields['subject'], fields['body'], fields['filename'],
+                                fields['attachment_info'])
+            labels[i] = cache.get(keys[i])
+    pending = [i for i, label in enumerate(labels) if label is None]
+    compacted = {i: compact_fields(rows[i]) for i in pending}
+    sizes = {i: email_block('e000', **compacted[i]) for i in pending}
+    packs = make_packs(pending, sizes, pack_size)
 
+    def pack_blocks(pack):
+        return {f"e{n + 1}": email_block(f"e{n + 1}", **compacted[i]) for n, i in enumerate(pack)}
+
+    answers = await asyncio.gather(*(classify_pack(client, semaphore, pack_blocks(pack), timeout, model)
+                                     for pack in packs))
+    prompt_tokens = 0
+    for pack, (answer, tokens) in zip(packs, answers):
+        prompt_tokens += tokens or 0
+        for n, i in enumerate(pack):
+            labels[i] = answer.get(f"e{n + 1}")
+            if labels[i] in LABELS and cache is not None:
+                # Each email is charged an equal share of the pack's prompt
+                cache.set(keys[i], model, labels[i], (tokens or 0) // len(pack))
+
+    missing = [i for i in pending if labels[i] is None]
+    if missing:
+        print(f"Re-sending {len(missing)} emails missing from packed answers one by one")
+        results = await asyncio.gather(*(classify_email(client, semaphore, rows[i], timeout, cache, model)
+                                         for i in missing))
+        for i, label in zip(missing, results):
+            labels[i] = label
+    _pack_totals.update(requests=len(packs), emails=len(pending), requeued=len(missing),
+                        prompt_tokens=prompt_tokens)
+    return labels
+
+
+def packing_stats():
+    """
+    :return: Dictionary of packed requests, emails, re-sent emails and prompt tokens
+    """
+    return dict(_pack_totals)
+
+
+async def classify_rows(rows, client, concurrency=CLASSIFY_CONCURRENCY, timeout=REQUEST_TIMEOUT, cache=None,
+                        model=MODEL, pack_size=1):
+    """
+    Classify many emails concurrently.
+
+    A failed or timed-out email gets FAILED_LABEL; the others are unaffected.
+
+    :param rows: List of prompt field dictionaries (see email_fields)
+    :param client: AsyncOpenAI client
+    :param concurrency: Maximum requests in flight
+    :param timeout: Seconds allowed per request
+    :param cache: ClassificationCache, or None to always call the API
+    :param model: Model name
+    :param pack_size: Emails per request (see classify_packed)
+    :return: List of labels, in the order of `rows`
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    if pack_size > 1:
+        return await classify_packed(rows, client, semaphore, timeout, cache, model, pack_size)
+    # gather returns results in argument order, whatever order the requests finish in
+    return await asyncio.gather(*(classify_email(client, semaphore, fields, timeout, cache, model)
+                                for fields in rows))
+
+
+async def _classify_with_openai(rows, api_key, concurrency, timeout, base_url, cache, model, pack_size):
+    # One client for the whole run: its connection pool keeps connections alive between requests
+    client = AsyncOpenAI(api_key=api_key, base_url=base_url)
+    try:
+        return await classify_rows(rows, client, concurrency, timeout, cache, model, pack_size)
+    finally:
+        await client.close()
+
+
+def classify_emails_in_file(input_file, output_file, api_key, concurrency=CLASSIFY_CONCURRENCY,
+                            timeout=REQUEST_TIMEOUT, base_url=None, use_cache=True, use_pre_classifier=True,
+                            model=MODEL, pack_size=PACK_SIZE):
+    """
+    Classifies emails in an Excel file as "PO" or "Not PO" using OpenAI's API.
+
+    Up to `concurrency` requests run at once. Each email has its own timeout;
+    failed emails are marked FAILED_LABEL without stopping the others.
+    Labels are cached by model, prompt version and email content, so emails
+    classified in an earlier run are not sent again. When a trained
+    pre-classifier exists (see pre_classifier.py), emails it is confident
+    about are labelled locally and only the rest go to the API. With
+    pack_size > 1 several emails share one request (see classify_packed).
+
+    Parameters:
+        input_file (str): Path to the input Excel file.
+        output_file (str): Path to save the classified output Excel file.
+        api_key (str): API key for OpenAI.
+        concurrency (int): Maximum classification requests in flight.
+        timeout (float): Seconds allowed per email.
+        base_url (str): OpenAI-compatible endpoint (default: OpenAI's).
+        use_cache (bool): Read and write the classification cache; False bypasses it.
+        use_pre_classifier (bool): Label confident cases with the local pre-classifier.
+        model (str): Model name (at base_url).
+        pack_size (int): Emails classified per request (1: one request per email).
+
+    Returns:
+        None
+    """
     # Read data from Excel
     try:
         df = pd.read_excel(input_file)
@@ -103,25 +394,42 @@ def classify_emails_in_file(input_file, output_file, api_key):
         return
 
     # Add a new column for Classification
+    cache = ClassificationCache() if use_cache else None
+    pre_classifier = PreClassifier.load() if use_pre_classifier else None
     try:
-        df['Classification'] = df.apply(
-            lambda row: classify_email(
-                row.get('Subject', ''),
-                row.get('Body', ''),
-                row.get('Filename', ''),
-                row.get('Attachment Link', ''),
-                row.get('extracted information from attachment', '')
-            ),
-            axis=1
-        )
+        rows = [email_fields(row) for _, row in df.iterrows()]
+        started = time.perf_counter()
+        labels = [None] * len(rows)
+        if pre_classifier is not None:
+            labels = pre_classifier.decide([email_text(**fields) for fields in rows])
+            print(f"Pre-classifier: {pre_classifier.stats()}")
+        pending = [i for i, label in enumerate(labels) if label is None]
+        results = asyncio.run(_classify_with_openai([rows[i] for i in pending], api_key, concurrency, timeout,
+                                                    base_url, cache, model, pack_size))
+        for i, label in zip(pending, results):
+            labels[i] = label
+        elapsed = time.perf_counter() - started
+        df['Classification'] = labels
+        failed = sum(label == FAILED_LABEL for label in labels)
+        print(f"Classified {len(labels)} emails in {elapsed:.1f}s ({failed} failed, concurrency {concurrency})")
+        if pack_size > 1:
+            print(f"Packed classification: {packing_stats()}")
+        print(f"Prompt caching: {usage_stats()}")
+        if cache is not None:
+            cache.evict()
+            print(f"Classification cache: {cache.stats()}")
     except Exception as e:
         print(f"Error during classification: {e}")
         return
+    finally:
+        if cache is not None:
+            cache.close()
 
     # Write results back to Excel
     try:
         df.to_excel(output_file, index=False)
         print(f"Classification completed. The results are saved in {output_file}.")
+        print(f"Prompt compaction: {compaction_stats()}")
     except Exception as e:
         print(f"Error saving output file: {e}")
 
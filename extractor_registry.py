@@ -0,0 +1,277 @@
+import os
+import time
+import logging
+import tarfile
+import zipfile
+import importlib
+import inspect
+import threading
+
+from attachment_source import open_source, read_head, source_name
+
+# Compound File container of legacy Office formats (.doc, .xls)
+OLE2_MAGIC = b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'
+
+# Leading bytes identifying each file type. Checked before the declared MIME
+# type and the file extension, which are often missing or wrong on attachments.
+MAGIC_SIGNATURES = [
+    (b'%PDF-', 'pdf'),
+    (b'\x89PNG\r\n\x1a\n', 'image'),
+    (b'\xff\xd8\xff', 'image'),            # JPEG
+    (b'II*\x00', 'image'),                 # TIFF, little-endian
+    (b'MM\x00*', 'image'),                 # TIFF, big-endian
+    (b'BM', 'image'),
+    (b'GIF87a', 'image'),
+    (b'GIF89a', 'image'),
+    (b'PK\x03\x04', 'zip'),                # .docx / .xlsx are zip containers
+    (OLE2_MAGIC, 'ole2'),                  # legacy .doc / .xls
+    (b"7z\xbc\xaf'\x1c", '7z'),
+    (b'\x1f\x8b', 'compressed'),          # gzip; 'tar' if it holds a tarball
+    (b'BZh', 'compressed'),
+    (b'\xfd7zXZ\x00', 'compressed'),
+]
+# Plain tar files carry their magic in the first header block
+TAR_MAGIC_OFFSET = 257
+SNIFF_BYTES = 512
+# Lines an RFC 822 message (a forwarded .eml) can start with
+EMAIL_HEADERS = (b'received:', b'return-path:', b'from:', b'message-id:', b'mime-version:',
+                 b'delivered-to:', b'date:', b'subject:', b'to:', b'x-')
+# Legacy Office files are told apart by the stream names in their directory,
+# which is usually near the end of the file
+OLE2_SCAN_BYTES = 8 * 1024 * 1024
+
+MIME_TYPES = {
+    'application/pdf': 'pdf',
+    'application/vnd.ms-excel': 'excel',
+    'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet': 'excel',
+    'application/msword': 'word',
+    'application/vnd.openxmlformats-officedocument.wordprocessingml.document': 'word',
+    'application/zip': 'zip',
+    'application/x-zip-compressed': 'zip',
+    'application/x-tar': 'tar',
+    'application/gzip': 'compressed',
+    'application/x-gzip': 'compressed',
+    'application/x-bzip2': 'compressed',
+    'application/x-xz': 'compressed',
+    'application/x-7z-compressed': '7z',
+    'message/rfc822': 'eml',
+    'text/plain': 'text',
+}
+
+EXTENSIONS = {
+    '.pdf': 'pdf',
+    '.jpg': 'image',
+    '.jpeg': 'image',
+    '.png': 'image',
+    '.tiff': 'image',
+    '.tif': 'image',
+    '.bmp': 'image',
+    '.gif': 'image',
+    '.xlsx': 'excel',
+    '.xls': 'excel',
+    '.docx': 'word',
+    '.doc': 'word',
+    '.zip': 'zip',
+    '.tar': 'tar',
+    '.tgz': 'tar',
+    '.gz': 'compressed',
+    '.bz2': 'compressed',
+    '.xz': 'compressed',
+    '.7z': '7z',
+    '.eml': 'eml',
+    '.txt': 'text',
+}
+
+# Handlers named as 'module:function' are only imported the first time a file
+# of that type is extracted.
+DEFAULT_HANDLERS = {
+    'pdf': 'pdf_extraction:extract_pdf_text',
+    'excel': 'spreadsheet_extraction:extract_spreadsheet_text',
+    'word': 'word_extraction:extract_word_text',
+    'text': 'archive_expansion:read_text',
+}
+
+
+def _ole2_type(file_path):
+    data = read_head(file_path, OLE2_SCAN_BYTES)
+    if 'WordDocument'.encode('utf-16-le') in data:
+        return 'word'
+    if 'Workbook'.encode('utf-16-le') in data or 'Book'.encode('utf-16-le') in data:
+        return 'excel'
+    return 'unknown'
+
+
+def _compressed_type(file_path):
+    # Stream mode reads only the first header block to tell a tarball from a single file
+    try:
+        with open_source(file_path) as stream, tarfile.open(fileobj=stream, mode='r|*'):
+            return 'tar'
+    except (tarfile.TarError, EOFError, OSError, ValueError):
+        return 'compressed'
+
+
+def _zip_type(file_path):
+    try:
+        with open_source(file_path) as stream, zipfile.ZipFile(stream) as archive:
+            names = set(archive.namelist())
+    except zipfile.BadZipFile:
+        return 'unknown'
+    if 'word/document.xml' in names:
+        return 'word'
+    if 'xl/workbook.xml' in names:
+        return 'excel'
+    return 'zip'
+
+
+class ExtractorRegistry:
+    """
+    Maps file types to text extractors and picks one for each attachment.
+
+    The type is decided by magic bytes first, then the declared MIME type,
+    then the file extension. Handlers are callables taking the file path, or
+    'module:function' strings imported on first use; keyword options passed to
+    `extract` are forwarded only to handlers that accept them. Every call is
+    timed per file type.
+    """
+
+    def __init__(self, handlers=None):
+        """
+        :param handlers: Dictionary of file type -> handler; defaults to DEFAULT_HANDLERS
+        """
+        self._handlers = {}
+        self._loaded = {}
+        self._mime_types = dict(MIME_TYPES)
+        self._extensions = dict(EXTENSIONS)
+        self._stats = {}
+        self._lock = threading.Lock()
+        for file_type, handler in (DEFAULT_HANDLERS if handlers is None else handlers).items():
+            self.register(file_type, handler)
+
+    def register(self, file_type, handler, extensions=(), mime_types=()):
+        """
+        Register (or replace) the extractor for a file type.
+
+        :param file_type: File type name, e.g. 'pdf'
+        :param handler: Callable(file_path, **options) -> text, or a 'module:function' string
+        :param extensions: Extra file extensions (with dot) mapping to this type
+        :param mime_types: Extra MIME types mapping to this type
+        """
+        self._handlers[file_type] = handler
+        self._loaded.pop(file_type, None)
+        for extension in extensions:
+            self._extensions[extension.lower()] = file_type
+        for mime_type in mime_types:
+            self._mime_types[mime_type.lower()] = file_type
+
+    def identify(self, file_path, mime_type=None, name=None):
+        """
+        Determine a file's type from its content, declared MIME type and name.
+
+        :param file_path: Path to the file, or its content as an in-memory buffer
+        :param mime_type: MIME type declared by the sender, if any
+        :param name: File name, for buffers (defaults to the path's name)
+        :return: File type name, or 'unknown'
+        """
+        head = read_head(file_path, SNIFF_BYTES)
+        declared = self._mime_types.get((mime_type or '').split(';')[0].strip().lower())
+        if declared is None and (mime_type or '').lower().startswith('image/'):
+            declared = 'image'
+        by_name = self._extensions.get(os.path.splitext(name or source_name(file_path, ''))[1].lower())
+
+        sniffed = next((file_type for magic, file_type in MAGIC_SIGNATURES if head.startswith(magic)), None)
+        if sniffed is None and head[TAR_MAGIC_OFFSET:TAR_MAGIC_OFFSET + 5] == b'ustar':
+            sniffed = 'tar'
+        elif sniffed is None and declared != 'text' and head.lstrip().lower().startswith(EMAIL_HEADERS):
+            sniffed = 'eml'
+        if sniffed == 'zip':
+            sniffed = _zip_type(file_path)
+        elif sniffed == 'compressed':
+            sniffed = _compressed_type(file_path)
+        elif sniffed == 'ole2':
+            # Trust the sender when it agrees with the container format
+            sniffed = next((t for t in (declared, by_name) if t in ('word', 'excel')), None) or _ole2_type(file_path)
+        if sniffed not in (None, 'unknown'):
+            return sniffed
+        return declared or by_name or 'unknown'
+
+    def handler_for(self, file_type):
+        """
+        Return the extractor callable for a file type, importing it if needed.
+
+        :param file_type: File type name
+        :return: Callable, or None if no handler is registered
+        """
+        handler = self._loaded.get(file_type)
+        if handler is not None:
+            return handler
+        handler = self._handlers.get(file_type)
+        if handler is None:
+            return None
+        if isinstance(handler, str):
+            module_name, function_name = handler.split(':')
+            started = time.perf_counter()
+            handler = getattr(importlib.import_module(module_name), function_name)
+            logging.debug(f"Loaded {file_type} extractor {module_name} in {time.perf_counter() - started:.2f}s")
+        self._loaded[file_type] = handler
+        return handler
+
+    def extract(self, file_path, mime_type=None, name=None, **options):
+        """
+        Identify a file and run its extractor.
+
+        :param file_path: Path to the file, or its content as an in-memory buffer
+        :param mime_type: MIME type declared by the sender, if any
+        :param name: File name, for buffers (defaults to the path's name)
+        :param options: Keyword options, passed on to handlers whose signature accepts them
+        :return: Tuple of (file type, extracted text); text is None when no handler exists
+        """
+        file_type = self.identify(file_path, mime_type, name)
+        name = name or source_name(file_path)
+        handler = self.handler_for(file_type)
+        if handler is None:
+            logging.error(f"Unsupported file type ({file_type}): {name}")
+            return file_type, None
+
+        parameters = inspect.signature(handler).parameters
+        if not any(p.kind == p.VAR_KEYWORD for p in parameters.values()):
+            options = {name: value for name, value in options.items() if name in parameters}
+
+        started = time.perf_counter()
+        failed = True
+        try:
+            text = handler(file_path, **options)
+            failed = False
+            return file_type, text
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                stats = self._stats.setdefault(file_type, {'calls': 0, 'failures': 0, 'seconds': 0.0})
+                stats['calls'] += 1
+                stats['failures'] += failed
+                stats['seconds'] += elapsed
+            logging.debug(f"{file_type} extractor took {elapsed:.3f}s for {name}")
+
+    def stats(self):
+        """
+        :return: Dictionary of file type -> calls, failures, total and mean seconds
+        """
+        with self._lock:
+            return {
+                file_type: dict(stats, seconds=round(stats['seconds'], 3),
+                                mean_seconds=round(stats['seconds'] / stats['calls'], 3))
+                for file_type, stats in self._stats.items()
+            }
+
+
+_default_registry = ExtractorRegistry(handlers={})
+
+
+def sniff_file_type(file_path, mime_type=None):
+    """
+    Determine a file's type (pdf, image, excel, word, zip, tar, 7z, eml or unknown) from its content.
+
+    :param file_path: Path to the file, or its content as an in-memory buffer
+    :param mime_type: MIME type declared by the sender, if any
+    :return: File type name
+    """
+    return _default_registry.identify(file_path, mime_type)
@@ -1,15 +1,21 @@
 import pandas as pd
 import os
 import PyPDF2
-import pytesseract
 from PIL import Image
 import openpyxl
 
+from archive_expansion import ARCHIVE_TYPES, expand_attachment
+from attachment_source import open_source, source_bytes
+from preview_extraction import extract_preview, prefetch_image_previews
+from extractor_registry import ExtractorRegistry
+from image_triage import triage_image
+from ocr_engine import get_ocr_engine
+
 # Function to extract text from a PDF
 def extract_text_from_pdf(file_path):
     text = ""
     try:
-        with open(file_path, 'rb') as pdf_file:
+        with open_source(file_path) as pdf_file:
             reader = PyPDF2.PdfReader(pdf_file)
             for page in reader.pages:
                 text += page.extract_text()
@@ -20,40 +26,64 @@ def extract_text_from_pdf(file_path):
 # Function to extract text from an Excel file
 def extract_text_from_excel(file_path):
     try:
-        df = pd.read_excel(file_path, engine='openpyxl')
-        return df.to_string(index=False)
+        from spreadsheet_extraction import extract_spreadsheet_text
+        return extract_spreadsheet_text(file_path)
     except Exception as e:
         return f"Error reading Excel: {e}"
 
 # Function to extract text from an image
-def extract_text_from_image(file_path):
+def extract_text_from_image(file_path, inline=False):
     try:
-        img = Image.open(file_path)
-        text = pytesseract.image_to_string(img)
+        if not triage_image(file_path, inline=inline).accepted:
+            return ""
+        with open_source(file_path) as stream:
+            img = Image.open(stream)
+            text = get_ocr_engine().image_to_string(img)
         return text
     except Exception as e:
         return f"Error reading image: {e}"
 
+# Function to extract text from a Word document
+def extract_text_from_word(file_path):
+    try:
+        from word_extraction import extract_word_text
+        return extract_word_text(file_path)
+    except Exception as e:
+        return f"Error reading Word document: {e}"
+
 # Function to extract text from a .py file
 def extract_text_from_py(file_path):
     try:
-        with open(file_path, 'r') as file:
-            return file.read()
+        return bytes(source_bytes(file_path)).decode('utf-8', errors='replace')
     except Exception as e:
         return f"Error reading Python file: {e}"
 
+# File type -> extractor; the type is sniffed from the file content
+extractors = ExtractorRegistry(handlers={
+    'pdf': extract_text_from_pdf,
+    'excel': extract_text_from_excel,
+    'image': extract_text_from_image,
+    'word': extract_text_from_word,
+    'text': 'archive_expansion:read_text',
+})
+extractors.register('python', extract_text_from_py, extensions=('.py',), mime_types=('text/x-python',))
+
 # Function to handle the attachment extraction based on file type
-def extract_attachment_content(file_path):
-    if file_path.endswith('.pdf'):
-        return extract_text_from_pdf(file_path)
-    elif file_path.endswith(('.xls', '.xlsx')):
-        return extract_text_from_excel(file_path)
-    elif file_path.endswith(('.png', '.jpg', '.jpeg')):
-        return extract_text_from_image(file_path)
-    elif file_path.endswith('.py'):
-        return extract_text_from_py(file_path)
-    else:
+def extract_attachment_content(file_path, inline=False, mime_type=None, name=None):
+    if extractors.identify(file_path, mime_type, name) in ARCHIVE_TYPES:
+        # Archives and attached emails: extract each inner document under its own heading
+        try:
+            parts = []
+            for member_name, member, member_mime in expand_attachment(file_path, extractors.identify, mime_type):
+                content = extract_attachment_content(member, mime_type=member_mime, name=os.path.basename(member_name))
+                parts.append(f"[File: {member_name}]\n{content}")
+            return "\n\n".join(parts) or f"No documents found in {file_path}"
+        except Exception as e:
+            return f"Error reading archive: {e}"
+    _, text = extractors.extract(file_path, mime_type=mime_type, name=name, inline=inline)
+    if text is None:
         return f"Unsupported file type: {file_path}"
+    return text
 
 # Main processing function
 def process_excel(input_excel_path, output_excel_path):
@@ -62,19 +92,30 @@ def process_excel(input_excel_path, output_excel_path):
     
     # Initialize a list to store processed rows
     extracted_data = []
+
+    # Attachment link (backslashes converted), MIME type and inline flag of each row
+    attachments = []
+    for _, row in df.iterrows():
+        attachment_link = str(row.get("Attachment Link", "")).strip().replace("\\", "/")
+        mime_type = row.get("Attachment Type")
+        mime_type = mime_type if isinstance(mime_type, str) else None
+        inline = str(row.get("Inline", "")).strip().lower() in ('true', '1', 'yes')
+        attachments.append((attachment_link, mime_type, inline))
+    # Image previews are OCR'd in batches up front; extract_preview then reads them from the cache
+    prefetch_image_previews([(link, mime_type, os.path.basename(link), inline)
+                             for link, mime_type, inline in attachments if link and os.path.exists(link)])
     
     # Iterate over rows in the DataFrame
-    for _, row in df.iterrows():
-        # Get the attachment link and ensure it's a string
-        attachment_link = str(row.get("Attachment Link", "")).strip()
-        
-        # Convert backslashes to forward slashes for consistent path handling
-        attachment_link = attachment_link.replace("\\", "/")
-        
+    for (_, row), (attachment_link, mime_type, inline) in zip(df.iterrows(), attachments):
         # Check if the attachment link is valid and exists
         if attachment_link and os.path.exists(attachment_link):
             print(f"Processing file: {attachment_link}")  # Debugging line
-            extracted_content = extract_attachment_content(attachment_link)
+            # Classification only needs a preview; full extraction is left to POExtractor
+            try:
+                extracted_content = extract_preview(attachment_link, mime_type=mime_type, inline=inline)
+            except Exception as e:
+                extracted_content = f"Error reading attachment: {e}"
+
         else:
             extracted_content = "File not found or invalid attachment link."
         
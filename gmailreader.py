@@ -1,6 +1,7 @@
 from datetime import timedelta
 import os
 import base64
+import hashlib
 import openpyxl
 from googleapiclient.discovery import build
 from google.oauth2.credentials import Credentials
@@ -10,6 +11,8 @@ from bs4 import BeautifulSoup
 from datetime import datetime
 import re
 
+from attachment_source import attachment_store
+
 def extract_emails_to_excel(start_date, end_date):
     """
     Extract emails and save details in a structured Excel file.
@@ -66,6 +69,11 @@ def extract_emails_to_excel(start_date, end_date):
         except Exception:
             return 'Unknown Date'
 
+    # Inline parts (signature logos, embedded images) carry a Content-ID or an inline disposition
+    def is_inline_part(part):
+        headers = {header['name'].lower(): header['value'] for header in part.get('headers', [])}
+        return 'content-id' in headers or headers.get('content-disposition', '').lower().startswith('inline')
+
     # Extract email details
     def extract_email_details(service):
         adjusted_end_date = (datetime.strptime(end_date, '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d')
@@ -100,35 +108,42 @@ def extract_emails_to_excel(start_date, end_date):
                         attachment_data = base64.urlsafe_b64decode(attachment['data'])
                         filename = part['filename']
                         attachment_type = part['mimeType']
+                        inline = is_inline_part(part)
 
-                        # Save attachment locally
-                        filepath = os.path.join("attachments", filename)
-                        os.makedirs("attachments", exist_ok=True)
-                        with open(filepath, 'wb') as f:
-                            f.write(attachment_data)
+                        # Hand the attachment to extraction; it is written to disk only
+                        # when large or when attachment persistence is configured
+                        filepath = attachment_store.put(filename, attachment_data)
 
-                        attachments.append({'filename': filename, 'type': attachment_type, 'link': filepath})
+                        attachments.append({'filename': filename, 'type': attachment_type, 'link': filepath,
+                                            'inline': inline,
+                                            'hash': hashlib.sha256(attachment_data).hexdigest()})
 
             for attachment in attachments:
                 data.append({
+                    'message_id': msg['id'],
                     'sender_email': sender,
                     'subject': subject,
                     'body': body,
                     'date': email_date,
                     'filename': attachment['filename'],
                     'attachment_type': attachment['type'],
-                    'attachment_link': attachment['link']
+                    'attachment_link': attachment['link'],
+                    'inline': attachment['inline'],
+                    'attachment_hash': attachment['hash']
                 })
 
             if not attachments:
                 data.append({
+                    'message_id': msg['id'],
                     'sender_email': sender,
                     'subject': subject,
                     'body': body,
                     'date': email_date,
                     'filename': 'No attachment',
                     'attachment_type': 'None',
-                    'attachment_link': 'N/A'
+                    'attachment_link': 'N/A',
+                    'inline': False,
+                    'attachment_hash': ''
                 })
 
         return data
@@ -137,12 +152,14 @@ def extract_emails_to_excel(start_date, end_date):
     def write_to_excel(data, filename='emails_data-testcase.xlsx'):
         wb = openpyxl.Workbook()
         sheet = wb.active
-        sheet.append(['Sender Email', 'Subject', 'Body', 'Date', 'Filename', 'Attachment Link', 'Attachment Type'])
+        sheet.append(['Sender Email', 'Subject', 'Body', 'Date', 'Filename', 'Attachment Link', 'Attachment Type',
+                      'Inline', 'Message ID', 'Attachment Hash'])
 
         for entry in data:
             sheet.append([
                 entry['sender_email'], entry['subject'], entry['body'], entry['date'],
-                entry['filename'], entry['attachment_link'], entry['attachment_type']
+                entry['filename'], entry['attachment_link'], entry['attachment_type'], entry['inline'],
+                entry['message_id'], entry['attachment_hash']
             ])
 
         wb.save(filename)
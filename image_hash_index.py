@@ -0,0 +1,529 @@
+import io
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+from PIL import Image, ImageFilter
+
+from attachment_source import is_path, open_source, source_name
+from content_cache import CACHE_DIR, file_sha256
+from image_preprocessing import flatten
+
+HASH_SIZE = 8                   # 8x8 bits = 64-bit hashes
+PHASH_HIGHFREQ_FACTOR = 4       # pHash DCT runs on a 32x32 thumbnail
+# Two images match when both their pHash and dHash differ by at most this many
+# bits. Recompressed or lightly cropped copies typically land within 0-6.
+MAX_HAMMING_DISTANCE = 6
+DEFAULT_DB_PATH = os.path.join(CACHE_DIR, 'image_hashes.sqlite3')
+# A 64-bit hash cannot tell two POs printed from the same template apart, so a
+# hash match is verified on a grayscale copy SIGNATURE_WIDTH pixels wide: no
+# SIGNATURE_TILE x SIGNATURE_TILE tile may differ by more than
+# SIGNATURE_TOLERANCE grey levels on average. A single changed digit at 10 px
+# differs by 10 or more; JPEG re-encodes at quality 75 and up stay below 8.
+SIGNATURE_WIDTH = 1024
+SIGNATURE_TILE = 8
+SIGNATURE_TOLERANCE = 8.0
+# A cropped copy is aligned to the stored image before the tile check: up to
+# this share of each side may be cut, and the aligned images must overlap on
+# at least MIN_OVERLAP of both.
+MAX_CROP_SHARE = 0.1
+MIN_OVERLAP = 0.8
+# Signature pixels left out of the ink profiles the alignment is refined on
+ALIGN_MARGIN = 3
+# Aligned copies are compared after a slight blur, so sub-pixel alignment
+# errors do not count. Crops re-encoded as JPEG stay below 10 then; a changed
+# digit at 10 px still differs by 19 or more.
+ALIGNED_BLUR_RADIUS = 1.0
+ALIGNED_TOLERANCE = 12.0
+# Fingerprints (with their signatures, ~1.5 MB each) kept for repeated lookups
+HASH_MEMO_SIZE = 32
+
+# exact: same bytes (sha256); PO details are only reused then
+ImageMatch = namedtuple('ImageMatch', ['entry_id', 'distance', 'text', 'po_details', 'exact'])
+
+
+def _bits_to_int(bits):
+    value = 0
+    for bit in bits:
+        value = (value << 1) | int(bit)
+    return value
+
+
+def _dct_matrix(size):
+    n = np.arange(size)
+    matrix = np.cos(np.pi * (2 * n[None, :] + 1) * n[:, None] / (2 * size))
+    matrix[0] *= 1 / np.sqrt(2)
+    return matrix * np.sqrt(2 / size)
+
+
+def phash(image):
+    """
+    Perceptual hash: sign of the low-frequency DCT coefficients against their median.
+
+    :param image: PIL image
+    :return: 64-bit hash as an int
+    """
+    size = HASH_SIZE * PHASH_HIGHFREQ_FACTOR
+    pixels = np.asarray(flatten(image).resize((size, size), Image.LANCZOS), dtype=np.float64)
+    dct = _dct_matrix(size)
+    low = (dct @ pixels @ dct.T)[:HASH_SIZE, :HASH_SIZE].flatten()
+    # The DC term is the mean brightness and would dominate the median
+    return _bits_to_int(low > np.median(low[1:]))
+
+
+def dhash(image):
+    """
+    Difference hash: whether each pixel is brighter than its right neighbour.
+
+    :param image: PIL image
+    :return: 64-bit hash as an int
+    """
+    pixels = np.asarray(flatten(image).resize((HASH_SIZE + 1, HASH_SIZE), Image.LANCZOS), dtype=np.int16)
+    return _bits_to_int((pixels[:, 1:] > pixels[:, :-1]).flatten())
+
+
+def signature(image):
+    """
+    Grayscale copy of an image at SIGNATURE_WIDTH, used to verify hash matches.
+
+    :param image: PIL image
+    :return: uint8 numpy array
+    """
+    gray = flatten(image)
+    height = max(1, round(gray.height * SIGNATURE_WIDTH / gray.width))
+    return np.asarray(gray.resize((SIGNATURE_WIDTH, height), Image.BOX), dtype=np.uint8)
+
+
+def _ink_profile(array, axis):
+    return 255.0 - array.mean(axis=axis)
+
+
+def _profile_cost(first, second, scales, offsets):
+    """
+    Mean absolute difference between `first` and `second` sampled at
+    scale * x + offset, for every scale and offset; combinations overlapping
+    less than MIN_OVERLAP of either profile cost infinity.
+
+    :return: Array of costs, shape (len(scales), len(offsets))
+    """
+    positions = np.arange(len(first), dtype=np.float64)
+    costs = np.full((len(scales), len(offsets)), np.inf)
+    for row, scale in enumerate(scales):
+        mapped = scale * positions[None, :] + offsets[:, None]
+        valid = (mapped >= 0) & (mapped <= len(second) - 1)
+        values = np.interp(mapped, np.arange(len(second)), second)
+        count = valid.sum(axis=1)
+        cost = (np.abs(values - first[None, :]) * valid).sum(axis=1) / np.maximum(count, 1)
+        enough = (count >= MIN_OVERLAP * len(first)) & (count * scale >= MIN_OVERLAP * len(second))
+        costs[row] = np.where(enough, cost, np.inf)
+    return costs
+
+
+def _best(costs, scales, offsets):
+    row, column = np.unravel_index(np.argmin(costs), costs.shape)
+    return float(scales[row]), float(offsets[column])
+
+
+def _align_axis(first, second, scales):
+    """
+    Coarse-to-fine search for the scale and offset mapping profile `first`
+    onto `second`: on a 4x smaller grid first, then at full resolution.
+    """
+    def coarse(profile):
+        usable = len(profile) // 4 * 4
+        return profile[:usable].reshape(-1, 4).mean(axis=1)
+
+    shift = int(np.ceil(MAX_CROP_SHARE * len(second) / 4))
+    offsets = np.arange(-shift, shift + 1, dtype=np.float64)
+    scale, offset = _best(_profile_cost(coarse(first), coarse(second), scales, offsets), scales, offsets)
+    scales = scale + np.arange(-0.005, 0.0051, 0.0005)
+    offsets = 4 * offset + np.arange(-6, 7, dtype=np.float64)
+    return _best(_profile_cost(first, second, scales, offsets), scales, offsets)
+
+
+def align_signatures(first, second):
+    """
+    Find the scale and offsets mapping `first` onto `second`, for copies that
+    were cropped (which changes both the offset and, after resizing to
+    SIGNATURE_WIDTH, the scale). Signatures keep their aspect ratio, so one
+    scale applies to both axes. Ink profiles of the whole images give a first
+    estimate; the profiles are then taken again over the estimated overlap
+    only, so rows cut from one copy do not skew the columns (and vice versa).
+
+    :return: Tuple of (scale, x offset, y offset): pixel (x, y) of first is
+        at (scale * x + x offset, scale * y + y offset) in second
+    """
+    scales = np.arange(1 - 2 * MAX_CROP_SHARE, 1 + 2 * MAX_CROP_SHARE + 1e-9, 0.0025)
+    rows_first, rows_second = slice(None), slice(None)
+    for _ in range(2):
+        scale, x_offset = _align_axis(_ink_profile(first[rows_first], 0), _ink_profile(second[rows_second], 0),
+                                      scales)
+        columns_first, columns_second = _overlap(first.shape[1], second.shape[1], scale, x_offset)
+        shift = int(np.ceil(MAX_CROP_SHARE * second.shape[0]))
+        offsets = np.arange(-shift, shift + 1, dtype=np.float64)
+        _, y_offset = _best(_profile_cost(_ink_profile(first[:, columns_first], 1),
+                                          _ink_profile(second[:, columns_second], 1), np.array([scale]), offsets),
+                            np.array([scale]), offsets)
+        rows_first, rows_second = _overlap(first.shape[0], second.shape[0], scale, y_offset)
+        scales = np.array([scale])
+    return scale, x_offset, y_offset
+
+
+def _overlap(first_length, second_length, scale, offset):
+    """
+    :return: Tuple of slices of first and second covering the same content
+    """
+    start = max(0, int(np.ceil(-offset / scale)))
+    stop = min(first_length, int((second_length - 1 - offset) / scale) + 1)
+    return slice(start, stop), slice(int(round(scale * start + offset)), int(round(scale * (stop - 1) + offset)) + 1)
+
+
+def _box_cost(cumulative, target, scales, offsets):
+    """
+    Mean absolute difference between `target` and the profile whose
+    cumulative sum is `cumulative`, resized the way Image.BOX does with a
+    box: pixel X of target averages the profile entries whose centres lie in
+    (scale * X + offset, scale * (X + 1) + offset]. Combinations reaching
+    outside the profile cost infinity.
+
+    :return: Array of costs, shape (len(scales), len(offsets))
+    """
+    edges = np.arange(len(target) + 1, dtype=np.float64)
+    costs = np.full((len(scales), len(offsets)), np.inf)
+    for row, scale in enumerate(scales):
+        mapped = scale * edges[None, :] + offsets[:, None]
+        first_inside = np.clip(np.floor(mapped - 0.5).astype(np.int64) + 1, 0, len(cumulative) - 1)
+        counts = np.diff(first_inside, axis=1)
+        means = np.diff(cumulative[first_inside], axis=1) / np.maximum(counts, 1)
+        cost = np.abs(means - target[None, :]).mean(axis=1)
+        inside = (mapped[:, 0] >= 0) & (mapped[:, -1] <= len(cumulative) - 1)
+        costs[row] = np.where(inside, cost, np.inf)
+    return costs
+
+
+def _refine_axis(profile, target, scale, offset):
+    """
+    Refine the mapping of target's pixel edges X to scale * X + offset in
+    profile, which is taken from the full-resolution image.
+    """
+    cumulative = np.concatenate(([0.0], np.cumsum(profile)))
+    for scale_step, offset_step in ((0.0001, 0.1), (0.00001, 0.01)):
+        scales = scale * (1 + scale_step * np.arange(-20, 21))
+        offsets = offset + scale * offset_step * np.arange(-20, 21)
+        scale, offset = _best(_box_cost(cumulative, target, scales, offsets), scales, offsets)
+    return scale, offset
+
+
+def render_aligned(gray, first, second):
+    """
+    Resample a grayscale image into the pixel grid of `second`, the signature
+    of a (differently cropped) copy of it, for the region both show. Warping
+    `first`, the image's own signature, would resample text strokes a second
+    time and blur them, so the image is resized again instead, from the
+    position align_signatures finds for it, refined against ink profiles of
+    the full-resolution image to a fraction of a pixel.
+
+    :param gray: Grayscale PIL image
+    :param first: Array from signature for gray
+    :param second: Array from signature
+    :return: Tuple of (uint8 array, (left, top, right, bottom) of the region
+        in second), or None if the copies overlap on less than MIN_OVERLAP
+    """
+    scale, x_offset, y_offset = align_signatures(first, second)
+    columns_first, columns_second = _overlap(first.shape[1], second.shape[1], scale, x_offset)
+    rows_first, rows_second = _overlap(first.shape[0], second.shape[0], scale, y_offset)
+    width = columns_second.stop - columns_second.start
+    height = rows_second.stop - rows_second.start
+    if width * height < MIN_OVERLAP * second.size or width * height < MIN_OVERLAP * first.size * scale * scale:
+        return None
+
+    # Pixel edge X of second is at (X - offset - (scale - 1) / 2) / scale in first, from pixel centres;
+    # the profiles leave out a margin the estimate may be off by, so they lie within the image
+    x_ratio = gray.width / first.shape[1]
+    y_ratio = gray.height / first.shape[0]
+    inner_columns = slice(columns_second.start + ALIGN_MARGIN, columns_second.stop - ALIGN_MARGIN)
+    inner_rows = slice(rows_second.start + ALIGN_MARGIN, rows_second.stop - ALIGN_MARGIN)
+    inner = second[inner_rows, inner_columns]
+    y_scale = y_ratio / scale
+    y_start = y_ratio * (inner_rows.start - y_offset - (scale - 1) / 2) / scale
+    pixels = np.asarray(gray, dtype=np.float64)
+    x_scale, x_start = _refine_axis(
+        255.0 - pixels[int(np.ceil(y_start)):int(y_start + y_scale * inner.shape[0])].mean(axis=0),
+        _ink_profile(inner, 0), x_ratio / scale,
+        x_ratio * (inner_columns.start - x_offset - (scale - 1) / 2) / scale,
+    )
+    y_scale, y_start = _refine_axis(
+        255.0 - pixels[:, int(np.ceil(x_start)):int(x_start + x_scale * inner.shape[1])].mean(axis=1),
+        _ink_profile(inner, 1), y_scale, y_start,
+    )
+    x_start -= ALIGN_MARGIN * x_scale
+    y_start -= ALIGN_MARGIN * y_scale
+    left, right, x_start, x_stop = _inside(columns_second, x_scale, x_start, gray.width)
+    top, bottom, y_start, y_stop = _inside(rows_second, y_scale, y_start, gray.height)
+    if right <= left or bottom <= top:
+        return None
+    rendered = gray.resize((right - left, bottom - top), Image.BOX, box=(x_start, y_start, x_stop, y_stop))
+    return np.asarray(rendered, dtype=np.uint8), (left, top, right, bottom)
+
+
+def _inside(pixels, scale, start, limit):
+    """
+    Narrow a slice of signature pixels, the first of which starts at `start`
+    in the image and each `scale` wide, to those lying within the image.
+
+    :return: Tuple of (first pixel, stop pixel, image start, image stop)
+    """
+    skipped = max(0, int(np.ceil(-start / scale - 1e-6)))
+    count = min(pixels.stop - pixels.start, int((limit - start) / scale + 1e-6)) - skipped
+    start += skipped * scale
+    return pixels.start + skipped, pixels.start + skipped + count, start, start + count * scale
+
+
+def _tiles_match(first, second, tile, tolerance):
+    height = first.shape[0] // tile * tile
+    width = first.shape[1] // tile * tile
+    if not height or not width:
+        return bool(np.abs(first.astype(np.int16) - second.astype(np.int16)).mean() <= tolerance)
+    difference = np.abs(first[:height, :width].astype(np.int16) - second[:height, :width].astype(np.int16))
+    tiles = difference.reshape(height // tile, tile, width // tile, tile).mean(axis=(1, 3))
+    return bool(tiles.max() <= tolerance)
+
+
+def signatures_match(first, second, image=None, tile=SIGNATURE_TILE, tolerance=SIGNATURE_TOLERANCE):
+    """
+    Compare two signatures tile by tile. Signatures of different shape come
+    from differently cropped copies: the image `first` was computed from is
+    then resampled onto second's grid with render_aligned, and the region
+    both show is compared after a slight blur, against ALIGNED_TOLERANCE.
+
+    :param first: Array from signature
+    :param second: Array from signature
+    :param image: PIL image first was computed from, needed to compare signatures of different shape
+    :return: True if no tile differs by more than the tolerance on average
+    """
+    if first.shape == second.shape:
+        return _tiles_match(first, second, tile, tolerance)
+    if image is None or min(first.shape) < 2 * tile or min(second.shape) < 2 * tile:
+        return False
+    aligned = render_aligned(flatten(image), first, second)
+    if aligned is None:
+        return False
+    rendered, (left, top, right, bottom) = aligned
+    blur = ImageFilter.GaussianBlur(ALIGNED_BLUR_RADIUS)
+    return _tiles_match(np.asarray(Image.fromarray(rendered).filter(blur)),
+                        np.asarray(Image.fromarray(np.ascontiguousarray(second[top:bottom, left:right])).filter(blur)),
+                        tile, ALIGNED_TOLERANCE)
+
+
+def _encode_signature(array):
+    buffer = io.BytesIO()
+    Image.fromarray(array).save(buffer, format='PNG', optimize=True)
+    return buffer.getvalue()
+
+
+def _decode_signature(blob):
+    with Image.open(io.BytesIO(blob)) as image:
+        return np.asarray(image, dtype=np.uint8)
+
+
+def _hamming(hashes, value):
+    """Bit distance from `value` to every hash in a uint64 array."""
+    xor = hashes ^ np.uint64(value)
+    return np.unpackbits(xor.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+
+
+class ImageHashIndex:
+    """
+    SQLite table of images with the OCR text and PO extraction produced for
+    each, so repeated images can skip both.
+
+    An image with the same bytes (sha256) and OCR variant reuses the stored
+    text and PO details. A near-duplicate found by perceptual hash (pHash and
+    dHash, held in memory as numpy arrays and scanned in one vectorised
+    Hamming-distance pass) reuses only the OCR text, and only after its
+    high-resolution signature is verified; its PO details are extracted anew.
+    """
+
+    def __init__(self, db_path=DEFAULT_DB_PATH, max_distance=MAX_HAMMING_DISTANCE):
+        """
+        :param db_path: SQLite database file
+        :param max_distance: Largest pHash/dHash bit distance treated as a candidate match
+        """
+        self.max_distance = max_distance
+        self.lookups = 0
+        self.hits = 0
+        self.exact_hits = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+        self._hash_memo = OrderedDict()
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS image_hashes ("
+            "id INTEGER PRIMARY KEY, phash TEXT NOT NULL, dhash TEXT NOT NULL, "
+            "text TEXT NOT NULL, po_details TEXT, source TEXT, created_at REAL NOT NULL)"
+        )
+        # Columns added after the first release; older rows have no variant and never match
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(image_hashes)")}
+        for column, kind in (('sha256', 'TEXT'), ('variant', 'TEXT'), ('signature', 'BLOB')):
+            if column not in columns:
+                self._db.execute(f"ALTER TABLE image_hashes ADD COLUMN {column} {kind}")
+        self._db.execute("CREATE INDEX IF NOT EXISTS image_hashes_sha256 ON image_hashes (sha256, variant)")
+        self._db.commit()
+        rows = self._db.execute("SELECT id, phash, dhash, variant FROM image_hashes ORDER BY id").fetchall()
+        self._ids = [row[0] for row in rows]
+        self._phashes = np.array([int(row[1], 16) for row in rows], dtype=np.uint64)
+        self._dhashes = np.array([int(row[2], 16) for row in rows], dtype=np.uint64)
+        self._variants = np.array([row[3] for row in rows], dtype=object)
+
+    def _memo_key(self, file_path):
+        if is_path(file_path):
+            stat = os.stat(file_path)
+            return os.path.abspath(file_path), stat.st_size, stat.st_mtime
+        return file_sha256(file_path)
+
+    def _fingerprint(self, file_path):
+        """
+        Compute (sha256, pHash, dHash, signature) for an image, memoised per
+        path, size and mtime (per content hash for in-memory images) for the
+        HASH_MEMO_SIZE most recently used images.
+        """
+        memo_key = self._memo_key(file_path)
+        with self._lock:
+            fingerprint = self._hash_memo.get(memo_key)
+            if fingerprint is not None:
+                self._hash_memo.move_to_end(memo_key)
+                return fingerprint
+        with open_source(file_path) as stream, Image.open(stream) as image:
+            fingerprint = (file_sha256(file_path), phash(image), dhash(image), signature(image))
+        with self._lock:
+            self._hash_memo[memo_key] = fingerprint
+            while len(self._hash_memo) > HASH_MEMO_SIZE:
+                self._hash_memo.popitem(last=False)
+        return fingerprint
+
+    def hash_file(self, file_path):
+        """
+        :param file_path: Path to the image file, or its bytes
+        :return: Tuple of (pHash, dHash) as 64-bit ints
+        """
+        return self._fingerprint(file_path)[1:3]
+
+    def _exact(self, digest, variant):
+        return self._db.execute(
+            "SELECT id, text, po_details FROM image_hashes WHERE sha256 = ? AND variant = ? ORDER BY id DESC LIMIT 1",
+            (digest, variant),
+        ).fetchone()
+
+    def _nearest(self, p_value, d_value, variant):
+        if not self._ids:
+            return None, None
+        distance = np.maximum(_hamming(self._phashes, p_value), _hamming(self._dhashes, d_value))
+        distance[self._variants != variant] = np.iinfo(distance.dtype).max
+        best = int(np.argmin(distance))
+        if distance[best] > self.max_distance:
+            return None, None
+        return self._ids[best], int(distance[best])
+
+    @staticmethod
+    def _verify(file_path, image_signature, stored_signature):
+        if image_signature.shape == stored_signature.shape:
+            return signatures_match(image_signature, stored_signature)
+        # A differently cropped copy: aligning it needs the image itself
+        with open_source(file_path) as stream, Image.open(stream) as image:
+            return signatures_match(image_signature, stored_signature, image=image)
+
+    def lookup(self, file_path, variant):
+        """
+        Find a stored image with the same content, or a verified near-duplicate.
+
+        :param file_path: Path to the image file, or its bytes
+        :param variant: OCR settings the text must have been produced with
+        :return: ImageMatch (po_details only for exact matches), or None on a miss
+        """
+        digest, p_value, d_value, image_signature = self._fingerprint(file_path)
+        with self._lock:
+            self.lookups += 1
+            row = self._exact(digest, variant)
+            if row is not None:
+                self.hits += 1
+                self.exact_hits += 1
+                entry_id, text, po_details = row
+                logging.info(f"Exact image hit for {source_name(file_path)}")
+                return ImageMatch(entry_id, 0, text, json.loads(po_details) if po_details else None, True)
+            entry_id, distance = self._nearest(p_value, d_value, variant)
+            if entry_id is None:
+                return None
+            text, stored_signature = self._db.execute(
+                "SELECT text, signature FROM image_hashes WHERE id = ?", (entry_id,)
+            ).fetchone()
+            if stored_signature is None or not self._verify(file_path, image_signature,
+                                                            _decode_signature(stored_signature)):
+                self.rejected += 1
+                logging.info(f"Perceptual hash candidate for {source_name(file_path)} (distance {distance}) "
+                             f"failed verification")
+                return None
+            self.hits += 1
+        logging.info(f"Verified near-duplicate image for {source_name(file_path)} (distance {distance})")
+        return ImageMatch(entry_id, distance, text, None, False)
+
+    def add(self, file_path, text, variant):
+        """
+        Record the OCR text of an image.
+
+        :param file_path: Path to the image file, or its bytes
+        :param text: OCR text
+        :param variant: OCR settings the text was produced with
+        :return: Row id of the new entry
+        """
+        digest, p_value, d_value, image_signature = self._fingerprint(file_path)
+        with self._lock:
+            cursor = self._db.execute(
+                "INSERT INTO image_hashes (phash, dhash, text, source, created_at, sha256, variant, signature) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (f"{p_value:016x}", f"{d_value:016x}", text, source_name(file_path), time.time(), digest, variant,
+                 _encode_signature(image_signature)),
+            )
+            self._db.commit()
+            self._ids.append(cursor.lastrowid)
+            self._phashes = np.append(self._phashes, np.uint64(p_value))
+            self._dhashes = np.append(self._dhashes, np.uint64(d_value))
+            self._variants = np.append(self._variants, np.array([variant], dtype=object))
+            return cursor.lastrowid
+
+    def set_po_details(self, file_path, po_details, variant):
+        """
+        Attach a PO extraction to the stored entry with this image's exact content.
+
+        :param file_path: Path to the image file, or its bytes
+        :param po_details: Extracted PO details dictionary
+        :param variant: OCR settings of the text the details were extracted from
+        """
+        digest = self._fingerprint(file_path)[0]
+        with self._lock:
+            row = self._exact(digest, variant)
+            if row is None:
+                return
+            self._db.execute(
+                "UPDATE image_hashes SET po_details = ? WHERE id = ?",
+                (json.dumps(po_details, ensure_ascii=False), row[0]),
+            )
+            self._db.commit()
+
+    def stats(self):
+        """
+        :return: Dictionary of lookups, hits (exact and verified), hash candidates rejected, misses and hit rate
+        """
+        misses = self.lookups - self.hits
+        hit_rate = self.hits / self.lookups if self.lookups else 0.0
+        return {'lookups': self.lookups, 'hits': self.hits, 'exact_hits': self.exact_hits,
+                'rejected': self.rejected, 'misses': misses, 'hit_rate': round(hit_rate, 3)}
+
+    def close(self):
+        self._db.close()
@@ -0,0 +1,231 @@
+import io
+import time
+import logging
+
+import numpy as np
+from PIL import Image, ImageOps
+
+from attachment_source import open_source, source_name
+from content_cache import ContentCache, file_sha256
+
+# Images are scaled down to this resolution when their metadata says they
+# are denser, and never kept larger than MAX_DIMENSION on the longest side.
+# Tesseract gains nothing from more pixels than that; it just runs slower.
+TARGET_DPI = 300
+MAX_DIMENSION = 2500
+# Skew search range and step, in degrees
+MAX_SKEW = 5.0
+SKEW_STEP = 0.5
+DESKEW_SAMPLE = 800  # longest side of the thumbnail used to estimate skew
+BORDER_MARGIN = 10   # pixels kept around the content when cropping
+
+# Bump when the pipeline changes so old cache entries are not reused
+PREPROCESS_VERSION = 1
+
+_cache = ContentCache('preprocessed_images')
+
+
+def flatten(image):
+    """
+    Composite transparency onto white and convert to grayscale.
+
+    Screenshots are RGBA; converting them directly would turn transparent
+    backgrounds black.
+
+    :param image: PIL image
+    :return: Grayscale ('L') image
+    """
+    if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+        image = image.convert('RGBA')
+        background = Image.new('RGBA', image.size, (255, 255, 255, 255))
+        image = Image.alpha_composite(background, image)
+    return ImageOps.grayscale(image)
+
+
+def downscale(image, dpi=None):
+    """
+    Shrink oversized images to TARGET_DPI and MAX_DIMENSION.
+
+    :param image: PIL image
+    :param dpi: Horizontal DPI from the image metadata, if any
+    :return: Resized (or original) image
+    """
+    scale = 1.0
+    if dpi and dpi > TARGET_DPI:
+        scale = TARGET_DPI / dpi
+    longest = max(image.size) * scale
+    if longest > MAX_DIMENSION:
+        scale *= MAX_DIMENSION / longest
+    if scale >= 1.0:
+        return image
+    size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+    return image.resize(size, Image.LANCZOS)
+
+
+def otsu_threshold(image):
+    """
+    Compute Otsu's global threshold from a grayscale histogram.
+
+    :param image: Grayscale image
+    :return: Threshold in 0..255
+    """
+    histogram = np.array(image.histogram()[:256], dtype=np.float64)
+    total = histogram.sum()
+    levels = np.arange(256)
+    weight_background = np.cumsum(histogram)
+    weight_foreground = total - weight_background
+    cumulative_mean = np.cumsum(histogram * levels)
+    mean_background = cumulative_mean / np.maximum(weight_background, 1)
+    mean_foreground = (cumulative_mean[-1] - cumulative_mean) / np.maximum(weight_foreground, 1)
+    between = weight_background * weight_foreground * (mean_background - mean_foreground) ** 2
+    return int(np.argmax(between))
+
+
+def binarize(image):
+    """
+    Convert a grayscale image to black text on a white background.
+
+    Dark-mode screenshots (light text on dark) are inverted first.
+
+    :param image: Grayscale image
+    :return: Binarized grayscale image
+    """
+    threshold = otsu_threshold(image)
+    pixels = np.asarray(image)
+    binary = pixels > threshold
+    # Text is the minority class; if most pixels are dark the colours are inverted
+    if binary.mean() < 0.5:
+        binary = ~binary
+    return Image.fromarray((binary * 255).astype(np.uint8), mode='L')
+
+
+def estimate_skew(image):
+    """
+    Estimate the text skew of a binarized image by projection-profile search.
+
+    The rotation that makes text lines most sharply separated (highest
+    variance of the row ink profile) is taken as the deskew angle.
+
+    :param image: Binarized image (black text on white)
+    :return: Angle in degrees to rotate by to straighten the text
+    """
+    thumbnail = ImageOps.invert(image)
+    thumbnail.thumbnail((DESKEW_SAMPLE, DESKEW_SAMPLE))
+    best_angle, best_score = 0.0, -1.0
+    for angle in np.arange(-MAX_SKEW, MAX_SKEW + SKEW_STEP / 2, SKEW_STEP):
+        rotated = thumbnail.rotate(float(angle), resample=Image.NEAREST, expand=False)
+        profile = np.asarray(rotated, dtype=np.float32).sum(axis=1)
+        score = float(profile.var())
+        if score > best_score:
+            best_angle, best_score = float(angle), score
+    return best_angle
+
+
+def deskew(image):
+    """
+    Rotate a binarized image so its text lines are horizontal.
+
+    :param image: Binarized image
+    :return: Straightened image
+    """
+    angle = estimate_skew(image)
+    if abs(angle) < SKEW_STEP / 2:
+        return image
+    logging.debug(f"Deskewing image by {angle:.1f} degrees")
+    return image.rotate(angle, resample=Image.BICUBIC, expand=True, fillcolor=255)
+
+
+def crop_borders(image):
+    """
+    Crop blank margins around the content of a binarized image.
+
+    :param image: Binarized image
+    :return: Cropped image
+    """
+    bbox = ImageOps.invert(image).getbbox()
+    if not bbox:
+        return image
+    left, top, right, bottom = bbox
+    return image.crop((
+        max(0, left - BORDER_MARGIN),
+        max(0, top - BORDER_MARGIN),
+        min(image.width, right + BORDER_MARGIN),
+        min(image.height, bottom + BORDER_MARGIN),
+    ))
+
+
+def select_psm(image):
+    """
+    Pick a tesseract page segmentation mode from the image's layout.
+
+    A single band of text is read as one line (7); a wide blank gutter down
+    the middle means multiple columns, which need automatic segmentation (3);
+    everything else is read as one uniform block (6), the previous default.
+
+    :param image: Binarized image
+    :return: PSM number
+    """
+    ink = np.asarray(ImageOps.invert(image), dtype=np.float32) > 0
+    if not ink.any():
+        return 6
+    rows = ink.any(axis=1)
+    # Count transitions into inked row bands
+    bands = int(np.count_nonzero(rows[1:] & ~rows[:-1]) + rows[0])
+    if bands == 1:
+        return 7
+    columns = ink.any(axis=0)
+    width = len(columns)
+    middle = columns[width // 4: 3 * width // 4]
+    longest_gap = current = 0
+    for inked in middle:
+        current = 0 if inked else current + 1
+        longest_gap = max(longest_gap, current)
+    if longest_gap >= width * 0.05:
+        return 3
+    return 6
+
+
+def preprocess_image(image):
+    """
+    Run the full preprocessing pipeline on an image.
+
+    :param image: PIL image
+    :return: Preprocessed grayscale image
+    """
+    dpi = image.info.get('dpi', (None,))[0]
+    image = downscale(flatten(image), dpi)
+    image = binarize(image)
+    image = deskew(image)
+    return crop_borders(image)
+
+
+def preprocess_image_file(file_path, use_cache=True):
+    """
+    Preprocess an image file, reusing the cached result for identical content.
+
+    :param file_path: Path to the image file, or its bytes
+    :param use_cache: Read and write the content-hash cache
+    :return: Tuple of (preprocessed image, suggested PSM)
+    """
+    key = None
+    if use_cache:
+        key = f"{file_sha256(file_path)}:v{PREPROCESS_VERSION}"
+        cached = _cache.get(key)
+        if cached is not None:
+            png, psm = cached
+            return Image.open(io.BytesIO(png)), psm
+
+    start = time.perf_counter()
+    with open_source(file_path) as stream, Image.open(stream) as original:
+        image = preprocess_image(original)
+    psm = select_psm(image)
+    logging.debug(
+        f"Preprocessed {source_name(file_path)} to {image.size[0]}x{image.size[1]} "
+        f"(psm {psm}) in {time.perf_counter() - start:.2f}s"
+    )
+
+    if key is not None:
+        buffer = io.BytesIO()
+        image.save(buffer, format='PNG', optimize=False)
+        _cache.set(key, (buffer.getvalue(), psm))
+    return image, psm
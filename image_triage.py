@@ -0,0 +1,96 @@
+import logging
+from collections import namedtuple
+
+import numpy as np
+from PIL import Image
+
+from attachment_source import open_source, source_name, source_size
+from image_preprocessing import flatten, otsu_threshold
+
+# Thresholds for rejecting images before OCR. Triage decisions are logged with
+# their metrics so these can be tuned against real mail.
+MIN_BYTES = 1024                # tracking pixels and spacer GIFs
+MIN_DIMENSION = 32              # social icons, bullets
+MIN_PIXELS = 100 * 100
+MIN_ENTROPY = 0.5               # blank or single-colour images (bits)
+MAX_INK_RATIO = 0.35            # text is a small share of the page; solid graphics are not
+MIN_TEXT_DENSITY = 0.1          # share of rows that look like a line of text
+
+# Inline (Content-ID) parts are mostly signatures and letterhead logos, so they
+# must look clearly document-like to be OCR'd.
+INLINE_MIN_DIMENSION = 150
+INLINE_MIN_TEXT_DENSITY = 0.2
+
+TRIAGE_SAMPLE = 512             # longest side of the thumbnail used for measurements
+MIN_ROW_TRANSITIONS = 6         # ink/paper transitions for a row to count as text
+
+TriageDecision = namedtuple('TriageDecision', ['accepted', 'reason', 'metrics'])
+
+
+def measure_text_density(image):
+    """
+    Measure how text-like an image is from a binarized thumbnail.
+
+    A row of text alternates between ink and paper many times; logos,
+    photos of objects and solid graphics do not.
+
+    :param image: PIL image
+    :return: Tuple of (entropy, ink_ratio, text_density)
+    """
+    thumbnail = image.copy()
+    thumbnail.thumbnail((TRIAGE_SAMPLE, TRIAGE_SAMPLE))
+    entropy = thumbnail.convert('RGB').entropy()
+    gray = flatten(thumbnail)
+    paper = np.asarray(gray) > otsu_threshold(gray)
+    if paper.mean() < 0.5:
+        paper = ~paper
+    ink = ~paper
+    transitions = (ink[:, 1:] != ink[:, :-1]).sum(axis=1)
+    text_density = float((transitions >= MIN_ROW_TRANSITIONS).mean())
+    return entropy, float(ink.mean()), text_density
+
+
+def triage_image(file_path, inline=False):
+    """
+    Decide whether an image is worth OCR'ing.
+
+    Cheap checks (byte size, pixel dimensions) run before the image is decoded.
+
+    :param file_path: Path to the image file, or its bytes
+    :param inline: True if the image came from an inline (Content-ID) MIME part
+    :return: TriageDecision(accepted, reason, metrics)
+    """
+    name = source_name(file_path)
+    metrics = {'bytes': source_size(file_path), 'inline': inline}
+    decision = None
+
+    if metrics['bytes'] < MIN_BYTES:
+        decision = TriageDecision(False, 'too_few_bytes', metrics)
+    else:
+        with open_source(file_path) as stream, Image.open(stream) as image:
+            width, height = image.size
+            metrics['size'] = f"{width}x{height}"
+            min_dimension = INLINE_MIN_DIMENSION if inline else MIN_DIMENSION
+            if min(width, height) < min_dimension or width * height < MIN_PIXELS:
+                decision = TriageDecision(False, 'too_small', metrics)
+            else:
+                entropy, ink_ratio, text_density = measure_text_density(image)
+                metrics.update(
+                    entropy=round(entropy, 2),
+                    ink_ratio=round(ink_ratio, 3),
+                    text_density=round(text_density, 3),
+                )
+                min_density = INLINE_MIN_TEXT_DENSITY if inline else MIN_TEXT_DENSITY
+                if entropy < MIN_ENTROPY:
+                    decision = TriageDecision(False, 'blank', metrics)
+                elif ink_ratio > MAX_INK_RATIO:
+                    decision = TriageDecision(False, 'graphic', metrics)
+                elif text_density < min_density:
+                    decision = TriageDecision(False, 'no_text_regions', metrics)
+
+    decision = decision or TriageDecision(True, 'text_like', metrics)
+    logging.info(
+        f"Image triage {'accepted' if decision.accepted else 'rejected'} {name}: "
+        f"{decision.reason} {decision.metrics}"
+    )
+    return decision
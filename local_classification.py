@@ -0,0 +1,81 @@
+import os
+import time
+import logging
+
+import requests
+
+from email_classification import classify_emails_in_file
+
+# Ollama server, the same one data_extraction uses for PO extraction
+OLLAMA_HOST = os.environ.get('OLLAMA_HOST', 'http://localhost:11434')
+LOCAL_MODEL = os.environ.get('PO_LOCAL_MODEL', 'llama3.1:latest')
+# Match the server's OLLAMA_NUM_PARALLEL: more requests in flight only queue
+# inside Ollama, fewer leave its parallel slots idle
+LOCAL_CONCURRENCY = int(os.environ.get('OLLAMA_NUM_PARALLEL', 4))
+# Local generation is slower than the API, and the first request may load the model
+LOCAL_TIMEOUT = float(os.environ.get('PO_LOCAL_TIMEOUT', 300))
+# How long Ollama keeps the model in memory after the last request
+KEEP_ALIVE = os.environ.get('PO_OLLAMA_KEEP_ALIVE', '30m')
+PRELOAD_TIMEOUT = 600
+
+
+def ollama_url(host=OLLAMA_HOST):
+    """
+    :param host: OLLAMA_HOST value; may lack the scheme ("0.0.0.0:11434")
+    :return: Base URL of the Ollama server
+    """
+    host = host.rstrip('/')
+    return host if host.startswith(('http://', 'https://')) else f"http://{host}"
+
+
+def preload_model(model=LOCAL_MODEL, host=OLLAMA_HOST, keep_alive=KEEP_ALIVE):
+    """
+    Load a model into Ollama before the first classification request, so
+    the load time is not charged to (and does not time out) the first batch
+    of emails.
+
+    :param model: Ollama model name
+    :param host: Ollama server
+    :param keep_alive: How long the server keeps the model loaded
+    :return: True if the model is loaded
+    """
+    started = time.perf_counter()
+    try:
+        # A generate request without a prompt only loads the model
+        response = requests.post(f"{ollama_url(host)}/api/generate",
+                                 json={'model': model, 'keep_alive': keep_alive}, timeout=PRELOAD_TIMEOUT)
+        response.raise_for_status()
+    except requests.RequestException as e:
+        logging.error(f"Could not preload {model} on {ollama_url(host)}: {e}")
+        return False
+    logging.info(f"Loaded {model} in {time.perf_counter() - started:.1f}s")
+    return True
+
+
+def classify_emails_locally(input_file, output_file, model=LOCAL_MODEL, concurrency=LOCAL_CONCURRENCY,
+                            timeout=LOCAL_TIMEOUT, host=OLLAMA_HOST, use_cache=True, use_pre_classifier=True,
+                            pack_size=1):
+    """
+    Classify emails with a model served by Ollama, through its
+    OpenAI-compatible endpoint.
+
+    Same prompt, output, cache and pre-classifier as classify_emails_in_file;
+    the model is loaded first and requests in flight are capped at the
+    server's parallelism.
+
+    :param input_file: Path to the input Excel file
+    :param output_file: Path to save the classified output Excel file
+    :param model: Ollama model name
+    :param concurrency: Requests in flight (the server's OLLAMA_NUM_PARALLEL)
+    :param timeout: Seconds allowed per email
+    :param host: Ollama server
+    :param use_cache: Read and write the classification cache
+    :param use_pre_classifier: Label confident cases with the local pre-classifier
+    :param pack_size: Emails per request; small local models follow the packed
+        JSON answer format less reliably, so packing is off by default
+    """
+    preload_model(model, host)
+    classify_emails_in_file(input_file, output_file, api_key='ollama', concurrency=concurrency, timeout=timeout,
+                            base_url=f"{ollama_url(host)}/v1", use_cache=use_cache,
+                            use_pre_classifier=use_pre_classifier, model=model,
+                            pack_size=pack_size)
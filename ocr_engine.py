@@ -0,0 +1,381 @@
+import os
+import re
+import queue
+import shlex
+import logging
+import tempfile
+import threading
+import subprocess
+from collections import namedtuple
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+import pytesseract
+
+try:
+    import tesserocr
+except ImportError:
+    tesserocr = None
+
+OCR_WORKERS = os.cpu_count() or 1
+OCR_LANG = 'eng'
+DEFAULT_PSM = 3  # tesseract's own default: fully automatic page segmentation
+
+# One recognised word and its bounding box (pixels); conf is 0-100
+Word = namedtuple('Word', ['text', 'conf', 'left', 'top', 'right', 'bottom'])
+
+
+def parse_psm(config):
+    """
+    Read the page segmentation mode out of a tesseract config string.
+
+    :param config: Config string such as '--psm 6'
+    :return: PSM number
+    """
+    match = re.search(r'--psm\s+(\d+)', config or '')
+    return int(match.group(1)) if match else DEFAULT_PSM
+
+
+def join_words(entries):
+    """
+    Rebuild text and mean confidence from tesseract word entries.
+
+    :param entries: Iterable of (line key, word text, confidence); block, paragraph
+        and line entries (confidence -1, no text) are skipped
+    :return: Tuple of (text, mean confidence 0-100; 0.0 when no word was found)
+    """
+    lines, confs = {}, []
+    for key, text, conf in entries:
+        if conf < 0 or not text.strip():
+            continue
+        confs.append(conf)
+        lines.setdefault(key, []).append(text.strip())
+    text = "\n".join(" ".join(words) for words in lines.values())
+    return text, (sum(confs) / len(confs) if confs else 0.0)
+
+
+def chunk(items, count):
+    """
+    Split a list into at most `count` contiguous, near-equal chunks.
+
+    :param items: List to split
+    :param count: Maximum number of chunks
+    :return: List of non-empty chunks
+    """
+    count = max(1, min(count, len(items)))
+    size, remainder = divmod(len(items), count)
+    chunks, start = [], 0
+    for i in range(count):
+        stop = start + size + (1 if i < remainder else 0)
+        chunks.append(items[start:stop])
+        start = stop
+    return chunks
+
+
+class OCREngine:
+    """
+    Common interface for the OCR backends.
+
+    Images may be PIL images or paths to image files.
+    """
+
+    name = 'base'
+
+    def image_to_string(self, image, config=''):
+        """
+        OCR a single image.
+
+        :param image: PIL image or image file path
+        :param config: tesseract config string, e.g. '--psm 6'
+        :return: Recognised text
+        """
+        raise NotImplementedError
+
+    def images_to_strings(self, images, config=''):
+        """
+        OCR many images, returning their texts in input order.
+
+        :param images: List of PIL images or image file paths
+        :param config: tesseract config string, e.g. '--psm 6'
+        :return: List of recognised texts
+        """
+        return [self.image_to_string(image, config) for image in images]
+
+    def image_to_string_with_confidence(self, image, config=''):
+        """
+        OCR a single image and report the mean word confidence in the same pass.
+
+        :param image: PIL image or image file path
+        :param config: tesseract config string, e.g. '--psm 6'
+        :return: Tuple of (recognised text, mean confidence 0-100 or None if unknown)
+        """
+        return self.image_to_string(image, config), None
+
+    def images_to_strings_with_confidence(self, images, config=''):
+        """
+        OCR many images with their mean word confidences, in input order.
+
+        :param images: List of PIL images or image file paths
+        :param config: tesseract config string, e.g. '--psm 6'
+        :return: List of (recognised text, mean confidence 0-100 or None if unknown)
+        """
+        return [self.image_to_string_with_confidence(image, config) for image in images]
+
+    def image_to_words(self, image, config=''):
+        """
+        OCR a single image at word level, keeping each word's bounding box.
+
+        :param image: PIL image or image file path
+        :param config: tesseract config string, e.g. '--psm 6'
+        :return: List of Word tuples in reading order
+        """
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class SubprocessOCREngine(OCREngine):
+    """
+    Original behaviour: one `tesseract` process per image via pytesseract.
+
+    Every call re-loads the language model, so this is only kept as the
+    baseline for benchmarks and as a last-resort fallback.
+    """
+
+    name = 'subprocess'
+
+    def image_to_string(self, image, config=''):
+        return pytesseract.image_to_string(image, config=config)
+
+    def image_to_string_with_confidence(self, image, config=''):
+        data = pytesseract.image_to_data(image, config=config, output_type=pytesseract.Output.DICT)
+        return join_words(((data['block_num'][i], data['par_num'][i], data['line_num'][i]), text,
+                           float(data['conf'][i])) for i, text in enumerate(data['text']))
+
+    def image_to_words(self, image, config=''):
+        data = pytesseract.image_to_data(image, config=config, output_type=pytesseract.Output.DICT)
+        words = []
+        for i, text in enumerate(data['text']):
+            conf = float(data['conf'][i])
+            # Block, paragraph and line entries carry conf -1 and no text
+            if conf < 0 or not text.strip():
+                continue
+            left, top = data['left'][i], data['top'][i]
+            words.append(Word(text.strip(), conf, left, top, left + data['width'][i], top + data['height'][i]))
+        return words
+
+
+class BatchCLIOCREngine(SubprocessOCREngine):
+    """
+    Uses tesseract's list-file mode so one process OCRs a whole batch of images.
+
+    A batch is split across up to `workers` tesseract processes running in
+    parallel, each loading the traineddata once for its share of the images.
+    Single images still go through pytesseract.
+    """
+
+    name = 'batch-cli'
+
+    def __init__(self, workers=OCR_WORKERS, lang=OCR_LANG):
+        self.workers = workers
+        self.lang = lang
+
+    def _run_list_file(self, paths, config, tsv=False):
+        with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False, encoding='utf-8') as list_file:
+            list_file.write("\n".join(paths) + "\n")
+        try:
+            cmd = [pytesseract.pytesseract.tesseract_cmd, list_file.name, 'stdout', '-l', self.lang]
+            cmd += shlex.split(config or '') + (['tsv'] if tsv else [])
+            # Parallelism comes from running several processes; stop each one
+            # from also spinning up its own OpenMP threads.
+            env = dict(os.environ, OMP_THREAD_LIMIT='1')
+            result = subprocess.run(cmd, capture_output=True, check=True, env=env)
+        finally:
+            os.remove(list_file.name)
+        output = result.stdout.decode('utf-8', errors='replace')
+        if tsv:
+            return self._parse_tsv(output, len(paths))
+        # tesseract separates the pages of a list-file run with form feeds
+        pages = output.split('\f')
+        if pages and not pages[-1].strip():
+            pages.pop()
+        if len(pages) != len(paths):
+            raise RuntimeError(f"tesseract returned {len(pages)} pages for {len(paths)} images")
+        return pages
+
+    @staticmethod
+    def _parse_tsv(output, count):
+        """
+        Split the TSV output of a list-file run into per-image text and confidence.
+
+        :param output: TSV text (one header line, then one row per page, block, paragraph, line and word)
+        :param count: Number of images in the run
+        :return: List of (text, mean confidence)
+        """
+        pages = {}
+        for line in output.splitlines()[1:]:
+            columns = line.split('\t')
+            if len(columns) < 12 or not columns[1].isdigit():
+                continue
+            entries = pages.setdefault(int(columns[1]), [])
+            entries.append(((columns[2], columns[3], columns[4]), columns[11], float(columns[10])))
+        if len(pages) != count:
+            raise RuntimeError(f"tesseract returned {len(pages)} pages for {count} images")
+        return [join_words(pages[number]) for number in sorted(pages)]
+
+    def _run_batch(self, images, config, tsv):
+        with tempfile.TemporaryDirectory() as tmp:
+            paths = []
+            for i, image in enumerate(images):
+                if isinstance(image, (str, os.PathLike)):
+                    paths.append(os.fspath(image))
+                else:
+                    path = os.path.join(tmp, f"{i:05d}.png")
+                    image.save(path)
+                    paths.append(path)
+            try:
+                with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                    results = executor.map(lambda part: self._run_list_file(part, config, tsv),
+                                           chunk(paths, self.workers))
+                    return [text for part in results for text in part]
+            except Exception as e:
+                logging.error(f"Batch OCR failed, falling back to per-image OCR: {e}")
+                if tsv:
+                    return super().images_to_strings_with_confidence(paths, config)
+                return super().images_to_strings(paths, config)
+
+    def images_to_strings(self, images, config=''):
+        if len(images) < 2:
+            return super().images_to_strings(images, config)
+        return self._run_batch(images, config, tsv=False)
+
+    def images_to_strings_with_confidence(self, images, config=''):
+        if len(images) < 2:
+            return super().images_to_strings_with_confidence(images, config)
+        return self._run_batch(images, config, tsv=True)
+
+
+class TesserocrOCREngine(OCREngine):
+    """
+    Pool of in-process tesseract API handles (tesserocr).
+
+    Each handle loads the traineddata once and is reused for every image it
+    is given. Handles are created lazily up to `workers` and tesserocr
+    releases the GIL while recognising, so threads give real parallelism.
+    """
+
+    name = 'tesserocr'
+
+    def __init__(self, workers=OCR_WORKERS, lang=OCR_LANG):
+        self.workers = workers
+        self.lang = lang
+        self._idle = queue.Queue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self._executor = None
+
+    @contextmanager
+    def _api(self):
+        try:
+            api = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                create = self._created < self.workers
+                if create:
+                    self._created += 1
+            api = tesserocr.PyTessBaseAPI(lang=self.lang) if create else self._idle.get()
+        try:
+            yield api
+        finally:
+            self._idle.put(api)
+
+    @staticmethod
+    def _set_image(api, image, config):
+        api.SetPageSegMode(parse_psm(config))
+        if isinstance(image, (str, os.PathLike)):
+            api.SetImageFile(os.fspath(image))
+        else:
+            api.SetImage(image)
+
+    def image_to_string(self, image, config=''):
+        with self._api() as api:
+            self._set_image(api, image, config)
+            return api.GetUTF8Text()
+
+    def image_to_string_with_confidence(self, image, config=''):
+        with self._api() as api:
+            self._set_image(api, image, config)
+            text = api.GetUTF8Text()
+            return text, float(api.MeanTextConf())
+
+    def image_to_words(self, image, config=''):
+        with self._api() as api:
+            self._set_image(api, image, config)
+            api.Recognize()
+            words = []
+            iterator = api.GetIterator()
+            level = tesserocr.RIL.WORD
+            for word in tesserocr.iterate_level(iterator, level):
+                text = word.GetUTF8Text(level)
+                if not text or not text.strip():
+                    continue
+                left, top, right, bottom = word.BoundingBox(level)
+                words.append(Word(text.strip(), word.Confidence(level), left, top, right, bottom))
+            return words
+
+    def images_to_strings(self, images, config=''):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers)
+        return list(self._executor.map(lambda image: self.image_to_string(image, config), images))
+
+    def images_to_strings_with_confidence(self, images, config=''):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers)
+        return list(self._executor.map(lambda image: self.image_to_string_with_confidence(image, config), images))
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        while not self._idle.empty():
+            self._idle.get_nowait().End()
+        self._created = 0
+
+
+_engine = None
+_engine_lock = threading.Lock()
+# Workers of the process-wide engine; 1 inside pool worker processes
+_engine_workers = OCR_WORKERS
+
+
+def init_pool_worker():
+    """
+    Initializer for worker processes of a process pool: the pool already runs
+    one process per CPU, so each worker's engine uses a single tesseract
+    process or handle instead of one per CPU. An engine inherited from the
+    parent by fork is dropped rather than shared.
+    """
+    global _engine, _engine_workers
+    with _engine_lock:
+        _engine = None
+        _engine_workers = 1
+
+
+def get_ocr_engine():
+    """
+    Return the process-wide OCR engine, creating it on first use.
+
+    tesserocr is used when installed; otherwise tesseract's batch CLI mode.
+
+    :return: Shared OCREngine instance
+    """
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            engine_class = TesserocrOCREngine if tesserocr is not None else BatchCLIOCREngine
+            _engine = engine_class(workers=_engine_workers)
+            logging.info(f"Using {_engine.name} OCR engine")
+        return _engine
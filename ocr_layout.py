@@ -0,0 +1,159 @@
+import logging
+import statistics
+
+from content_cache import ContentCache, file_sha256
+from ocr_engine import Word, get_ocr_engine
+from table_format import TABLE_DELIMITER
+
+# Words whose vertical centres are within this fraction of the median word
+# height belong to the same row.
+ROW_TOLERANCE = 0.5
+# A horizontal gap wider than this many word heights starts a new cell;
+# ordinary word spacing is well under one word height.
+CELL_GAP = 1.2
+# A run of at least this many consecutive multi-cell rows is treated as a table
+MIN_TABLE_ROWS = 2
+
+# Word boxes are cached so re-extracting with a different prompt or layout
+# setting does not repeat OCR.
+WORDS_VERSION = 1
+_words_cache = ContentCache('ocr_words')
+
+
+def group_rows(words):
+    """
+    Group words into visual rows, top to bottom, each sorted left to right.
+
+    :param words: List of Word tuples
+    :return: List of rows (lists of Word)
+    """
+    if not words:
+        return []
+    height = statistics.median(word.bottom - word.top for word in words) or 1
+    rows = []
+    for word in sorted(words, key=lambda w: (w.top + w.bottom) / 2):
+        centre = (word.top + word.bottom) / 2
+        if rows and abs(centre - rows[-1][0]) <= ROW_TOLERANCE * height:
+            row_centre, row_words = rows[-1]
+            row_words.append(word)
+            rows[-1] = ((row_centre * (len(row_words) - 1) + centre) / len(row_words), row_words)
+        else:
+            rows.append((centre, [word]))
+    return [sorted(row_words, key=lambda w: w.left) for _, row_words in rows]
+
+
+def split_cells(row, height):
+    """
+    Split a row into cells wherever the gap between words is wider than CELL_GAP.
+
+    :param row: Words of one row, left to right
+    :param height: Median word height
+    :return: List of cells (lists of Word)
+    """
+    cells = [[row[0]]]
+    for previous, word in zip(row, row[1:]):
+        if word.left - previous.right > CELL_GAP * height:
+            cells.append([word])
+        else:
+            cells[-1].append(word)
+    return cells
+
+
+def column_intervals(table_rows):
+    """
+    Derive column x-ranges by merging the overlapping x-ranges of every cell in a table.
+
+    :param table_rows: List of rows, each a list of cells
+    :return: Sorted list of (left, right) column intervals
+    """
+    spans = sorted((cell[0].left, cell[-1].right) for row in table_rows for cell in row)
+    columns = [list(spans[0])]
+    for left, right in spans[1:]:
+        if left <= columns[-1][1]:
+            columns[-1][1] = max(columns[-1][1], right)
+        else:
+            columns.append([left, right])
+    return columns
+
+
+def render_table(table_rows):
+    """
+    Render table rows as delimiter-separated lines aligned to shared columns.
+
+    :param table_rows: List of rows, each a list of cells
+    :return: Table text
+    """
+    columns = column_intervals(table_rows)
+    lines = []
+    for row in table_rows:
+        values = [""] * len(columns)
+        for cell in row:
+            index = next(i for i, (left, right) in enumerate(columns) if left <= cell[0].left <= right)
+            text = " ".join(word.text for word in cell)
+            values[index] = f"{values[index]} {text}".strip()
+        while values and not values[-1]:
+            values.pop()
+        lines.append(TABLE_DELIMITER.join(values))
+    return "\n".join(lines)
+
+
+def reconstruct_layout(words):
+    """
+    Rebuild text from word boxes, emitting tables as compact rows.
+
+    Runs of consecutive rows that split into two or more cells are rendered
+    as a '[Table N]' block of '|'-separated rows; all other rows are plain lines.
+
+    :param words: List of Word tuples
+    :return: Reconstructed text
+    """
+    rows = group_rows(words)
+    if not rows:
+        return ""
+    height = statistics.median(word.bottom - word.top for word in words) or 1
+    split = [split_cells(row, height) for row in rows]
+
+    sections, plain, table, tables = [], [], [], 0
+
+    def flush_table():
+        nonlocal tables
+        if len(table) >= MIN_TABLE_ROWS:
+            if plain:
+                sections.append("\n".join(plain))
+                plain.clear()
+            tables += 1
+            sections.append(f"[Table {tables}]\n{render_table(table)}")
+        else:
+            plain.extend(" ".join(word.text for cell in row for word in cell) for row in table)
+        table.clear()
+
+    for cells in split:
+        if len(cells) >= 2:
+            table.append(cells)
+            continue
+        flush_table()
+        plain.append(" ".join(word.text for word in cells[0]))
+    flush_table()
+    if plain:
+        sections.append("\n".join(plain))
+    return "\n\n".join(sections)
+
+
+def ocr_words(file_path, image, config, variant=''):
+    """
+    Word-level OCR of an image file, cached by file content and OCR settings.
+
+    :param file_path: Path of the original image file, or its bytes (used for the cache key)
+    :param image: Image to OCR (may be a preprocessed version of the file)
+    :param config: tesseract config string
+    :param variant: Extra cache-key component describing how `image` was derived
+    :return: List of Word tuples
+    """
+    key = f"{file_sha256(file_path)}:{variant}:{config}:v{WORDS_VERSION}"
+    cached = _words_cache.get(key)
+    if cached is not None:
+        logging.debug(f"Word box cache hit for {file_path}")
+        return [Word(*word) for word in cached]
+    words = get_ocr_engine().image_to_words(image, config=config)
+    _words_cache.set(key, [tuple(word) for word in words])
+    return words
@@ -0,0 +1,162 @@
+import os
+import re
+import logging
+import threading
+from collections import Counter, namedtuple
+
+# OCR output below this score is treated as unreadable: the image is retried
+# once with the other OCR profile and, if still below, not sent to the LLM
+# (which would only answer with N/A for every field).
+MIN_QUALITY_SCORE = 0.45
+# Fewer words than this is not a document worth extracting
+MIN_WORDS = 5
+
+# Weights of the three features; confidence is left out (and the others
+# rescaled) when the engine did not report it
+WORD_WEIGHT = 0.45
+BALANCE_WEIGHT = 0.2
+CONFIDENCE_WEIGHT = 0.35
+
+# Share of digits among letters and digits expected in a PO; photos read as
+# noise tend to be all symbols, all stray letters or all digit fragments
+DIGIT_SHARE_RANGE = (0.02, 0.6)
+# Optional system word list extending the built-in lexicon
+WORDLIST_PATH = os.environ.get('PO_WORDLIST', '/usr/share/dict/words')
+
+# Common English and purchase-order words. Not a dictionary: together with the
+# word-shape check in `word_score` it is enough to tell prose from OCR noise.
+LEXICON = set("""
+a about above account address after against all also amount an and any are as at attention authorised
+authorized bank bill billing by buyer can charges code company contact cost customer date days delivery
+department description details discount dispatch do document due each email every for freight from
+gst hsn igst in inclusive including invoice is it item items kg kindly line lot ltd make material
+mobile name net no not number of on or order our packing page part party payment per phone please
+po price pricing product purchase qty quantity quote quotation rate received reference regards
+remarks required road sale sales sgst ship shipping signature size so specification state street
+subject supplier supply tax taxes terms thank thanks that the this to total transport unit units
+until upon us value vat vendor we will with within you your
+""".split())
+
+QualityScore = namedtuple(
+    'QualityScore', ['score', 'word_ratio', 'digit_share', 'symbol_ratio', 'confidence', 'words']
+)
+
+TOKEN = re.compile(r'\S+')
+LETTERS = re.compile(r'[^\W\d_]+')
+CONSONANT_RUN = re.compile(r'[bcdfghjklmnpqrstvwxz]{5,}')
+
+_wordlist = None
+_wordlist_lock = threading.Lock()
+_totals = Counter()
+_totals_lock = threading.Lock()
+
+
+def wordlist():
+    """
+    :return: Set of known lowercase words (built-in lexicon plus the system word list, if any)
+    """
+    global _wordlist
+    with _wordlist_lock:
+        if _wordlist is None:
+            words = set(LEXICON)
+            if WORDLIST_PATH and os.path.isfile(WORDLIST_PATH):
+                try:
+                    with open(WORDLIST_PATH, encoding='utf-8', errors='ignore') as file:
+                        words.update(line.strip().lower() for line in file if line.strip())
+                except OSError as e:
+                    logging.warning(f"Could not read word list {WORDLIST_PATH}: {e}")
+            _wordlist = words
+        return _wordlist
+
+
+def word_score(word, known):
+    """
+    :param word: Alphabetic token
+    :param known: Set of known words
+    :return: 1 for a known word, 0.5 for an unknown word with a plausible shape, else 0
+    """
+    lower = word.lower()
+    if lower in known:
+        return 1.0
+    if len(word) < 3 or not re.search(r'[aeiouy]', lower) or CONSONANT_RUN.search(lower):
+        return 0.0
+    # Case flips inside a word ("tHe", "cOMp") are typical of misread glyphs
+    if not (word.islower() or word.isupper() or word.istitle()):
+        return 0.0
+    return 0.5
+
+
+def balance_score(digit_share, symbol_ratio):
+    """
+    :param digit_share: Digits / (letters + digits)
+    :param symbol_ratio: Non-alphanumeric visible characters / all visible characters
+    :return: 0-1, highest for PO-like mixes of letters, digits and a little punctuation
+    """
+    low, high = DIGIT_SHARE_RANGE
+    if digit_share < low:
+        digits = digit_share / low
+    elif digit_share > high:
+        digits = max(0.0, (1 - digit_share) / (1 - high))
+    else:
+        digits = 1.0
+    symbols = 1.0 if symbol_ratio <= 0.25 else max(0.0, 1 - (symbol_ratio - 0.25) / 0.35)
+    return digits * symbols
+
+
+def score_text(text, confidence=None):
+    """
+    Score how readable extracted (OCR) text is.
+
+    Combines the share of real-looking words, the balance of letters, digits
+    and symbols, and the engine's mean word confidence when available.
+
+    :param text: Extracted text
+    :param confidence: Mean OCR word confidence (0-100), or None
+    :return: QualityScore; score is 0-1
+    """
+    text = text or ""
+    tokens = TOKEN.findall(text)
+    words = [word for token in tokens for word in LETTERS.findall(token)]
+    visible = "".join(tokens)
+    letters = sum(char.isalpha() for char in visible)
+    digits = sum(char.isdigit() for char in visible)
+    symbols = len(visible) - letters - digits
+
+    known = wordlist()
+    word_ratio = sum(word_score(word, known) for word in words) / len(words) if words else 0.0
+    digit_share = digits / (letters + digits) if letters + digits else 0.0
+    symbol_ratio = symbols / len(visible) if visible else 1.0
+
+    if len(words) < MIN_WORDS:
+        score = 0.0
+    else:
+        weighted = [(WORD_WEIGHT, word_ratio), (BALANCE_WEIGHT, balance_score(digit_share, symbol_ratio))]
+        if confidence is not None:
+            weighted.append((CONFIDENCE_WEIGHT, max(0.0, min(confidence, 100.0)) / 100))
+        score = sum(weight * value for weight, value in weighted) / sum(weight for weight, _ in weighted)
+    return QualityScore(round(score, 3), round(word_ratio, 3), round(digit_share, 3), round(symbol_ratio, 3),
+                        confidence, len(words))
+
+
+def is_readable(quality, threshold=MIN_QUALITY_SCORE):
+    return quality.score >= threshold
+
+
+def record(outcome):
+    """
+    Count a gate outcome: 'passed', 'retried', 'recovered' or 'rejected'.
+
+    :param outcome: Outcome name
+    """
+    with _totals_lock:
+        _totals[outcome] += 1
+
+
+def gate_stats():
+    """
+    :return: Dictionary of outcome counts; 'rejected' is the number of LLM calls avoided
+    """
+    with _totals_lock:
+        stats = dict(_totals)
+    stats['llm_calls_avoided'] = stats.get('rejected', 0)
+    return stats
@@ -0,0 +1,508 @@
+import io
+import os
+import mmap
+import ctypes
+import logging
+import tempfile
+import threading
+import traceback
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+
+import pdfplumber
+import pypdfium2 as pdfium
+import pypdfium2.raw as pdfium_c
+from PyPDF2 import PdfReader
+
+from attachment_source import is_path, open_source, source_bytes, source_name, source_path, source_size
+from ocr_engine import get_ocr_engine, init_pool_worker
+from table_format import TABLE_DELIMITER
+
+# Documents at or above either threshold are split into page ranges and
+# extracted across worker processes; anything smaller stays in-process
+# because spawning workers costs more than it saves.
+PARALLEL_PAGE_THRESHOLD = 16
+PARALLEL_SIZE_THRESHOLD = 4 * 1024 * 1024  # bytes
+MIN_PAGES_PER_SHARD = 4
+
+# Pages whose text layer has fewer characters than this are treated as scanned
+# and rasterized for OCR instead.
+MIN_TEXT_LAYER_CHARS = 16
+OCR_DPI = 300
+OCR_CONFIG = '--psm 6'
+
+# A detected table is only emitted as rows if at least this share of its rows
+# have two or more filled cells; page frames and ruled letterheads that
+# pdfplumber reports as one big merged table fail this and stay plain text.
+MIN_TABLE_ROW_FILL = 0.5
+# Fallback for POs with a ruled line-item header but unruled item rows: a band
+# of at least this many column dividers is used as explicit columns, and rows
+# are taken from the text. Text may overhang the outer dividers by this much.
+MIN_COLUMN_DIVIDERS = 4
+COLUMN_OVERHANG = 30
+# Log each PDF's peak RSS at DEBUG level (opt-in; kept off the production path)
+LOG_PEAK_MEMORY = os.environ.get('PO_LOG_PEAK_MEMORY', '0').lower() in ('1', 'true', 'yes')
+PEAK_SAMPLE_INTERVAL = 0.01  # seconds between RSS samples
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+@contextmanager
+def open_mapped_pdf(file_path):
+    """
+    Open a PDF through a memory-mapped view of the file.
+
+    pdfium reads straight from the mapping, so pages are faulted in from disk
+    on demand instead of the whole file being copied into RAM. In-memory
+    sources are handed to pdfium as they are.
+
+    :param file_path: Path to the PDF file, or its bytes
+    :return: Context manager yielding a pypdfium2 document
+    """
+    if is_path(file_path):
+        with open(file_path, 'rb') as file:
+            # ACCESS_COPY gives a private, lazily-paged mapping that ctypes can wrap
+            # without copying. It is unmapped once the document is garbage collected.
+            mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_COPY)
+        pdf = pdfium.PdfDocument((ctypes.c_char * len(mapped)).from_buffer(mapped))
+    else:
+        pdf = pdfium.PdfDocument(pdf_bytes(file_path))
+    try:
+        yield pdf
+    finally:
+        pdf.close()
+
+
+def pdf_bytes(source):
+    """pdfium only takes immutable bytes, so other buffer types are copied once."""
+    data = source_bytes(source)
+    return data if isinstance(data, bytes) else bytes(data)
+
+
+def current_rss():
+    """
+    :return: Resident set size of this process in bytes, or None where /proc is unavailable
+    """
+    try:
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def max_rss():
+    """
+    :return: This process's lifetime RSS high-water mark in bytes, or None without the resource module
+    """
+    if resource is None:
+        return None
+    # ru_maxrss is KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+@contextmanager
+def log_peak_memory(label):
+    """
+    Log the peak RSS of one document at DEBUG level, when PO_LOG_PEAK_MEMORY
+    is set.
+
+    The process high-water mark (ru_maxrss) only ever grows, so after the
+    first large PDF it says nothing about the next one; instead a thread
+    samples the current RSS every PEAK_SAMPLE_INTERVAL while the block runs.
+    RSS includes pdfium's native buffers and rendered page bitmaps. Shard
+    workers report their own peaks by appending them to the yielded list.
+
+    :param label: Document name to include in the log line
+    :return: Context manager yielding a list for worker peaks in bytes
+    """
+    worker_peaks = []
+    if not LOG_PEAK_MEMORY or current_rss() is None:
+        yield worker_peaks
+        return
+    peak = [current_rss()]
+    done = threading.Event()
+
+    def sample():
+        while not done.wait(PEAK_SAMPLE_INTERVAL):
+            peak[0] = max(peak[0], current_rss() or 0)
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    try:
+        yield worker_peaks
+    finally:
+        done.set()
+        sampler.join()
+        peak[0] = max(peak[0], current_rss() or 0)
+        message = f"Peak memory for {label}: {peak[0] / 1024 / 1024:.1f} MB RSS"
+        if worker_peaks:
+            message += (f", {len(worker_peaks)} shard workers up to {max(worker_peaks) / 1024 / 1024:.1f} MB "
+                        f"({sum(worker_peaks) / 1024 / 1024:.1f} MB together)")
+        logging.debug(message)
+
+
+def count_pdf_pages(file_path):
+    """
+    Count the pages of a PDF without parsing their content.
+
+    :param file_path: Path to the PDF file
+    :return: Number of pages
+    """
+    with open_mapped_pdf(file_path) as pdf:
+        return len(pdf)
+
+
+def should_parallelize(file_path, page_count):
+    """
+    Decide whether a PDF is large enough to be worth sharding across processes.
+
+    :param file_path: Path to the PDF file, or its bytes
+    :param page_count: Number of pages in the PDF
+    :return: True if the PDF should be extracted in parallel
+    """
+    if page_count < 2 * MIN_PAGES_PER_SHARD:
+        return False
+    if page_count >= PARALLEL_PAGE_THRESHOLD:
+        return True
+    return source_size(file_path) >= PARALLEL_SIZE_THRESHOLD
+
+
+def plan_shards(page_count, max_workers):
+    """
+    Split a page count into contiguous (start, stop) ranges, one or more per worker.
+
+    :param page_count: Number of pages in the PDF
+    :param max_workers: Number of worker processes available
+    :return: List of (start, stop) page index ranges covering every page in order
+    """
+    shard_count = max(1, min(max_workers, page_count // MIN_PAGES_PER_SHARD))
+    size, remainder = divmod(page_count, shard_count)
+    shards = []
+    start = 0
+    for i in range(shard_count):
+        stop = start + size + (1 if i < remainder else 0)
+        shards.append((start, stop))
+        start = stop
+    return shards
+
+
+def probe_page(page):
+    """
+    Read a page's text layer and report whether it is usable.
+
+    :param page: pypdfium2 page
+    :return: Tuple of (has_text_layer, text)
+    """
+    textpage = page.get_textpage()
+    try:
+        if textpage.count_chars() < MIN_TEXT_LAYER_CHARS:
+            return False, ""
+        text = textpage.get_text_range()
+    finally:
+        textpage.close()
+    return True, text.replace('\r\n', '\n').replace('\xa0', ' ')
+
+
+def has_ruling(page):
+    """
+    :param page: pypdfium2 page
+    :return: True if the page draws any paths (table rules, frames); only
+        such pages can hold tables pdfplumber will find
+    """
+    return next(iter(page.get_objects(filter=[pdfium_c.FPDF_PAGEOBJ_PATH], max_depth=1)), None) is not None
+
+
+def render_page(page, dpi=OCR_DPI):
+    """
+    Rasterize a page for OCR.
+
+    :param page: pypdfium2 page
+    :param dpi: Render resolution
+    :return: PIL image of the page
+    """
+    return page.render(scale=dpi / 72).to_pil()
+
+
+def ocr_page_files(paths):
+    """
+    OCR rendered pages in one batch, so the default CLI engine loads the
+    language model once per worker process rather than once per page.
+
+    :param paths: Image files of the rendered pages
+    :return: Recognised texts, in order
+    """
+    return get_ocr_engine().images_to_strings(paths, config=OCR_CONFIG)
+
+
+def iter_pdf_pages(file_path, start=0, stop=None):
+    """
+    Stream the pages of a PDF one at a time.
+
+    Each page is probed for a text layer and closed before it is yielded, so
+    pdfium's per-page objects never accumulate. Scanned pages are yielded as
+    rendered images for the caller to OCR.
+
+    :param file_path: Path to the PDF file
+    :param start: Index of the first page to yield
+    :param stop: Index one past the last page to yield (defaults to the page count)
+    :return: Generator of (page_index, text, image, ruled) where image is None
+        for text pages and ruled tells whether the page draws any lines
+    """
+    with open_mapped_pdf(file_path) as pdf:
+        stop = len(pdf) if stop is None else stop
+        for index in range(start, stop):
+            page = pdf[index]
+            try:
+                has_text, text = probe_page(page)
+                image = None if has_text else render_page(page)
+                ruled = has_text and has_ruling(page)
+            finally:
+                page.close()
+            yield index, text, image, ruled
+
+
+def clean_cell(cell):
+    """
+    Collapse a table cell's whitespace and line breaks onto one line.
+
+    :param cell: Raw cell value from pdfplumber (may be None)
+    :return: Cleaned cell text
+    """
+    return " ".join((cell or "").replace('\xad', '-').split())
+
+
+def compact_table(rows):
+    """
+    Render table rows as compact delimiter-separated lines.
+
+    Empty rows and columns are dropped. The first remaining row is treated as
+    the header.
+
+    :param rows: Table rows as returned by pdfplumber's Table.extract()
+    :return: Table text, or "" if the table does not look like a line-item grid
+    """
+    rows = [[clean_cell(cell) for cell in row] for row in rows]
+    rows = [row for row in rows if any(row)]
+    if len(rows) < 2:
+        return ""
+    filled_rows = sum(1 for row in rows if sum(1 for cell in row if cell) >= 2)
+    if filled_rows / len(rows) < MIN_TABLE_ROW_FILL:
+        return ""
+    keep = [i for i in range(len(rows[0])) if any(row[i] for row in rows)]
+    lines = []
+    for row in rows:
+        cells = [row[i] for i in keep]
+        # Trailing blanks carry no alignment information once the header is known
+        while cells and not cells[-1]:
+            cells.pop()
+        lines.append(TABLE_DELIMITER.join(cells))
+    return "\n".join(lines)
+
+
+def find_line_item_table(page):
+    """
+    Find a line-item table whose header is ruled into columns but whose item
+    rows are not (the whole page is often one framed box around it).
+
+    The band of vertical rules shared by the most columns is taken as the
+    header; its dividers are extended down to the next rule spanning the
+    columns (or the first text left of the columns), and rows are cut from
+    the text lines in between.
+
+    :param page: pdfplumber page
+    :return: pdfplumber Table, or None
+    """
+    bands = {}
+    for line in page.lines:
+        if abs(line['x0'] - line['x1']) < 1:
+            band = (round(line['top']), round(line['bottom']))
+            bands.setdefault(band, set()).add(round(line['x0']))
+    if not bands:
+        return None
+    (top, header_bottom), dividers = max(bands.items(), key=lambda item: len(item[1]))
+    if len(dividers) < MIN_COLUMN_DIVIDERS:
+        return None
+    left, right = min(dividers), max(dividers)
+    rules = [line['top'] for line in page.lines
+             if abs(line['top'] - line['bottom']) < 1 and line['top'] > header_bottom + 2
+             and line['x0'] <= left + 2 and line['x1'] >= right - 2]
+    # Text starting left of the first column (totals in words, notes) is past the items
+    outside = [word['top'] for word in page.extract_words()
+               if word['top'] > header_bottom and word['x0'] < left - 2]
+    bottom = min(rules + outside, default=page.bbox[3] + 2) - 2
+    band = page.crop((page.bbox[0], max(page.bbox[1], top - 1), page.bbox[2], bottom))
+    tables = band.find_tables({
+        'vertical_strategy': 'explicit',
+        'explicit_vertical_lines': sorted(dividers),
+        'horizontal_strategy': 'text',
+        'intersection_x_tolerance': COLUMN_OVERHANG,
+    })
+    return tables[0] if tables else None
+
+
+def extract_structured_page(page):
+    """
+    Extract a page as its line-item tables followed by the remaining text.
+
+    :param page: pdfplumber page
+    :return: Tuple of (page_text, table_count)
+    """
+    sections = []
+    remainder = page
+    tables = page.find_tables()
+    for table in tables:
+        table_text = compact_table(table.extract())
+        if not table_text:
+            continue
+        sections.append(f"[Table {len(sections) + 1}]\n{table_text}")
+        remainder = remainder.outside_bbox(table.bbox)
+    if not sections and tables:
+        # Only a frame was found; look for a column-ruled line-item band inside it
+        table = find_line_item_table(page)
+        table_text = compact_table(table.extract()) if table is not None else ""
+        if table_text:
+            sections.append(f"[Table 1]\n{table_text}")
+            remainder = remainder.outside_bbox(table.bbox)
+    if not sections:
+        return None, 0
+    table_count = len(sections)
+    text = remainder.extract_text()
+    if text:
+        sections.append(text)
+    return "\n\n".join(sections), table_count
+
+
+def extract_page_range(file_path, start, stop, tables=False):
+    """
+    Extract text from a contiguous range of PDF pages.
+
+    Text pages are read directly. Image-only (scanned) pages are rendered and
+    written to a temporary folder one at a time (~25 MB each at 300 DPI, so
+    they are not kept in memory), then OCR'd together in one batch. With
+    tables enabled, text pages that draw ruling lines are also run through
+    pdfplumber's table finder and line-item tables are emitted as compact
+    rows; pdfplumber is only opened once such a page comes up. Runs inside a
+    worker process, so it opens its own handle to the file.
+
+    :param file_path: Path to the PDF file
+    :param start: Index of the first page to extract
+    :param stop: Index one past the last page to extract
+    :param tables: Emit detected tables as delimiter-separated rows
+    :return: List of page texts (empty string for pages without text)
+    """
+    texts = [""] * (stop - start)
+    scanned = {}
+    table_count = 0
+    plumber = None
+
+    with tempfile.TemporaryDirectory(prefix='po-ocr-') as tmp:
+        for index, text, image, ruled in iter_pdf_pages(file_path, start, stop):
+            if image is None:
+                texts[index - start] = text
+                if tables and ruled:
+                    if plumber is None:
+                        plumber = pdfplumber.open(file_path if is_path(file_path)
+                                                  else io.BytesIO(source_bytes(file_path)))
+                    page = plumber.pages[index]
+                    structured, found = extract_structured_page(page)
+                    # Drop pdfplumber's layout cache as soon as the page is done
+                    page.close()
+                    if structured:
+                        texts[index - start] = structured
+                        table_count += found
+                continue
+            path = os.path.join(tmp, f"{index:05d}.png")
+            image.save(path)
+            scanned[index - start] = path
+        if scanned:
+            for offset, text in zip(scanned, ocr_page_files(list(scanned.values()))):
+                texts[offset] = text
+
+    if plumber is not None:
+        plumber.close()
+        if table_count:
+            logging.info(f"Extracted {table_count} tables from PDF pages {start + 1}-{stop}")
+    if scanned:
+        logging.info(f"OCR fallback for {len(scanned)} scanned PDF pages")
+    return texts
+
+
+def extract_shard(file_path, start, stop, tables=False):
+    """
+    extract_page_range for a worker process, which also reports the
+    worker's RSS high-water mark. Workers live for one document's pool, so
+    it covers that document only.
+
+    :return: Tuple of (list of page texts, worker process id, peak RSS in bytes or None)
+    """
+    texts = extract_page_range(file_path, start, stop, tables)
+    return texts, os.getpid(), max_rss() if LOG_PEAK_MEMORY else None
+
+
+def extract_pdf_pages(file_path, max_workers=None, tables=False, max_pages=None, worker_peaks=None):
+    """
+    Extract the text of every page of a PDF, sharding large files across processes.
+
+    :param file_path: Path to the PDF file, or its bytes
+    :param max_workers: Worker process cap (defaults to the CPU count)
+    :param tables: Emit detected tables as delimiter-separated rows
+    :param max_pages: Only extract this many leading pages (None for all)
+    :param worker_peaks: List to append each shard worker's peak RSS (bytes) to, if measured
+    :return: List of page texts in page order
+    """
+    if not is_path(file_path):
+        file_path = pdf_bytes(file_path)
+    page_count = count_pdf_pages(file_path)
+    if max_pages is not None:
+        page_count = min(page_count, max_pages)
+    max_workers = max_workers or os.cpu_count() or 1
+
+    if max_workers < 2 or not should_parallelize(file_path, page_count):
+        return extract_page_range(file_path, 0, page_count, tables) if page_count else []
+
+    shards = plan_shards(page_count, max_workers)
+    logging.info(f"Extracting {page_count} PDF pages in {len(shards)} shards")
+    # Workers open the file themselves, so an in-memory PDF is spilled to disk
+    # once rather than pickled to every worker
+    with source_path(file_path, suffix='.pdf') as path:
+        # Shards already use every CPU, so each worker OCRs its scanned pages with one tesseract process
+        with ProcessPoolExecutor(max_workers=min(max_workers, len(shards)), initializer=init_pool_worker) as executor:
+            futures = [executor.submit(extract_shard, path, start, stop, tables) for start, stop in shards]
+            pages = []
+            # A worker may run several shards; its high-water mark is counted once
+            peaks = {}
+            for future in futures:
+                texts, worker, peak = future.result()
+                pages.extend(texts)
+                if peak is not None:
+                    peaks[worker] = max(peak, peaks.get(worker, 0))
+    if worker_peaks is not None:
+        worker_peaks.extend(peaks.values())
+    return pages
+
+
+def extract_pdf_text(file_path, max_workers=None, tables=False, max_pages=None):
+    """
+    Extract text from a PDF in a single pass, falling back to PyPDF2 only if
+    pdfium cannot read the file.
+
+    :param file_path: Path to the PDF file, or its content as bytes, memoryview or BytesIO
+    :param max_workers: Worker process cap for page-parallel extraction
+    :param tables: Emit detected tables as delimiter-separated rows
+    :param max_pages: Only extract this many leading pages (None for all)
+    :return: Extracted text from the PDF
+    """
+    try:
+        with log_peak_memory(source_name(file_path)) as worker_peaks:
+            texts = extract_pdf_pages(file_path, max_workers, tables, max_pages, worker_peaks)
+    except Exception as e:
+        # pdfium could not open the file; PyPDF2 is more forgiving of damaged xrefs
+        logging.error(f"pdfium extraction error: {e}")
+        logging.error(traceback.format_exc())
+        with open_source(file_path) as file:
+            texts = [page.extract_text() for page in PdfReader(file).pages[:max_pages]]
+
+    return "\n".join(text for text in texts if text)
@@ -7,6 +7,9 @@ from typing import Optional, List
 from gmailreader import extract_emails_to_excel
 from email_classification import classify_emails_in_file
 from data_extraction import POExtractor
+from attachment_source import PERSIST_REQUESTED, attachment_store
+from preview_extraction import add_attachment_previews
+from extractor_registry import sniff_file_type
 
 # Configure logging
 logging.basicConfig(
@@ -37,7 +40,7 @@ def validate_date(date_str: str) -> bool:
 
 def check_file_type(file_path: str) -> str:
     """
-    Determine the file type based on file extension.
+    Determine the file type from its content (magic bytes), falling back to the extension.
     
     Args:
         file_path (str): Path to the file
@@ -49,30 +52,19 @@ def check_file_type(file_path: str) -> str:
         logging.error(f"File not found: {file_path}")
         return 'unknown'
     
-    # Get file extension
-    _, ext = os.path.splitext(file_path)
-    ext = ext.lower()
-    
-    file_type_map = {
-        '.xlsx': 'excel',
-        '.xls': 'excel',
-        '.pdf': 'pdf',
-        '.jpg': 'image',
-        '.jpeg': 'image',
-        '.png': 'image',
-        '.tiff': 'image',
-        '.bmp': 'image',
-        '.docx': 'word',
-        '.doc': 'word'
-    }
-    
-    return file_type_map.get(ext, 'unknown')
+    return sniff_file_type(file_path)
 
 def run_pipeline(
     start_date: str, 
     end_date: str, 
     input_file: Optional[str] = None,
-    classification_model: str = 'openai'
+    classification_model: str = 'openai',
+    keep_attachments: bool = False,
+    concurrency: Optional[int] = None,
+    batch: bool = False,
+    use_cache: bool = True,
+    use_pre_classifier: bool = True,
+    pack_size: Optional[int] = None
 ):
     """
     Run the complete Purchase Order extraction pipeline.
@@ -82,6 +74,18 @@ def run_pipeline(
         end_date (str): End date for email extraction in 'YYYY-MM-DD' format
         input_file (str, optional): Specific input file to process
         classification_model (str, optional): Model to use for classification
+        keep_attachments (bool, optional): Write every attachment to the attachments
+            folder (also with PO_PERSIST_ATTACHMENTS=1); otherwise small attachments
+            are passed to extraction in memory
+        concurrency (int, optional): Classification requests in flight at once
+            (default: PO_CLASSIFY_CONCURRENCY or 16; OLLAMA_NUM_PARALLEL or 4 for local)
+        batch (bool, optional): Classify through the OpenAI Batch API (cheaper, results
+            within 24 hours) and wait for the batch to finish
+        use_cache (bool, optional): Reuse labels of emails classified in earlier runs
+        use_pre_classifier (bool, optional): Label obvious cases with the local
+            pre-classifier, when one has been trained
+        pack_size (int, optional): Emails classified per request (default:
+            PO_CLASSIFY_PACK_SIZE or 1 for openai, 1 for local)
     """
     try:
         # Validate date inputs
@@ -90,6 +94,7 @@ def run_pipeline(
 
         # Create required directories
         os.makedirs("attachments", exist_ok=True)
+        attachment_store.persist = keep_attachments or PERSIST_REQUESTED
         
         # Step 1: Email Extraction
         logging.info(f"Starting email extraction from {start_date} to {end_date}")
@@ -97,6 +102,12 @@ def run_pipeline(
         extracted_file = 'emails_data-testcase.xlsx'
         logging.info("Email extraction completed successfully")
 
+        # Classification only sees a preview of each attachment (first page,
+        # first sheet, top of an image); full extraction runs in step 3 for POs only
+        if not input_file:
+            logging.info("Extracting attachment previews for classification")
+            add_attachment_previews(extracted_file, extracted_file)
+
         # Step 2: Email Classification
         # Allow optional input file and classification model specification
         input_file = input_file or extracted_file
@@ -111,12 +122,38 @@ def run_pipeline(
         output_classified_file = 'classified_emails-test-case.xlsx'
         
         # Call classification with more flexibility
-        if classification_model.lower() == 'openai':
-            from email_classification import classify_emails_in_file
+        if classification_model.lower() == 'openai' and batch:
+            from batch_classification import OpenAIBatchBackend, run_batch_classification
+            run_batch_classification(
+                input_file,
+                output_classified_file,
+                OpenAIBatchBackend(os.environ.get("OPENAI_API_KEY")),
+                use_cache=use_cache,
+                use_pre_classifier=use_pre_classifier
+            )
+        elif classification_model.lower() == 'openai':
+            from email_classification import classify_emails_in_file, CLASSIFY_CONCURRENCY, PACK_SIZE
             classify_emails_in_file(
                 input_file, 
                 output_classified_file, 
-                os.environ.get("OPENAI_API_KEY", "enter-your-key")
+                os.environ.get("OPENAI_API_KEY", "enter-your-key"),
+                concurrency=concurrency or CLASSIFY_CONCURRENCY,
+                use_cache=use_cache,
+                use_pre_classifier=use_pre_classifier,
+                pack_size=pack_size or PACK_SIZE
+            )
+        elif classification_model.lower() == 'transformer':
+            from transformer_classification import classify_emails_with_transformer
+            classify_emails_with_transformer(input_file, output_classified_file)
+        elif classification_model.lower() == 'local':
+            from local_classification import classify_emails_locally, LOCAL_CONCURRENCY
+            classify_emails_locally(
+                input_file,
+                output_classified_file,
+                concurrency=concurrency or LOCAL_CONCURRENCY,
+                use_cache=use_cache,
+                use_pre_classifier=use_pre_classifier,
+                pack_size=pack_size or 1
             )
         else:
             raise ValueError(f"Unsupported classification model: {classification_model}")
@@ -161,8 +198,23 @@ def main():
     parser.add_argument('--start-date', required=True, help='Start date (YYYY-MM-DD)')
     parser.add_argument('--end-date', required=True, help='End date (YYYY-MM-DD)')
     parser.add_argument('--input-file', help='Optional specific input file to process')
-    parser.add_argument('--model', choices=['openai', 'local'], default='openai', 
-                        help='Classification model to use')
+    parser.add_argument('--model', choices=['openai', 'local', 'transformer'], default='openai', 
+                        help='Classification model to use (local: Ollama at OLLAMA_HOST, model PO_LOCAL_MODEL; '
+                             'transformer: fine-tuned model in PO_TRANSFORMER_MODEL_DIR on CPU)')
+    parser.add_argument('--keep-attachments', action='store_true',
+                        help='Write every attachment to the attachments folder instead of '
+                             'passing small ones to extraction in memory')
+    parser.add_argument('--concurrency', type=int,
+                        help='Classification requests in flight at once (default 16)')
+    parser.add_argument('--batch', action='store_true',
+                        help='Classify through the OpenAI Batch API and wait for the results '
+                             '(see batch_classification.py to submit and collect separately)')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='Re-classify every email instead of reusing cached labels')
+    parser.add_argument('--no-pre-classifier', action='store_true',
+                        help='Send every email to the LLM, even ones the local pre-classifier is sure of')
+    parser.add_argument('--pack-size', type=int,
+                        help='Emails classified per LLM request; answers come back as a JSON array (default 1)')
 
     args = parser.parse_args()
 
@@ -171,7 +223,13 @@ def main():
         args.start_date, 
         args.end_date, 
         args.input_file, 
-        args.model
+        args.model,
+        args.keep_attachments,
+        args.concurrency,
+        args.batch,
+        not args.no_cache,
+        not args.no_pre_classifier,
+        args.pack_size
     )
 
 if __name__ == "__main__":
@@ -0,0 +1,280 @@
+import os
+import glob
+import time
+import pickle
+import logging
+import argparse
+
+import numpy as np
+import pandas as pd
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.linear_model import LogisticRegression
+from sklearn.model_selection import StratifiedKFold
+from sklearn.pipeline import make_pipeline, make_union
+
+# Cheap local model in front of the LLM: emails it is confident about are
+# labelled here, only the uncertain band goes to the API.
+MODEL_PATH = os.environ.get('PO_PRECLASSIFIER_PATH', os.path.join('models', 'pre_classifier.pkl'))
+# P(PO) below the first bound is "Not PO", above the second "PO"; in between the LLM decides
+UNCERTAIN_BAND = (
+    float(os.environ.get('PO_PRECLASSIFIER_LOW', 0.1)),
+    float(os.environ.get('PO_PRECLASSIFIER_HIGH', 0.9)),
+)
+N_FEATURES = 2 ** 18
+MAX_TEXT_CHARS = 4000
+LABELS = ("Not PO", "PO")
+
+
+def email_text(subject, body, filename, attachment_info, **_):
+    """
+    Text the pre-classifier sees for one email; field names are kept as
+    prefixes so a subject word and a body word are different features.
+
+    :return: Text
+    """
+    parts = []
+    for name, value in (('subject', subject), ('filename', filename), ('body', body), ('attachment', attachment_info)):
+        if isinstance(value, str) and value.strip():
+            parts.append(f"{name}: {value.strip()}")
+    return "\n".join(parts)[:MAX_TEXT_CHARS]
+
+
+def parse_label(label):
+    """
+    :param label: Classification label as written by the classifier (or a person)
+    :return: 1 for PO, 0 for Not PO, None if unusable
+    """
+    if not isinstance(label, str):
+        return None
+    label = label.strip().strip('.').lower()
+    if label.startswith('not po'):
+        return 0
+    if label == 'po':
+        return 1
+    return None
+
+
+def build_model():
+    # Word uni/bigrams catch "purchase order", char n-grams catch PO numbers and misspellings
+    features = make_union(
+        HashingVectorizer(n_features=N_FEATURES, ngram_range=(1, 2), alternate_sign=False, norm='l2'),
+        HashingVectorizer(n_features=N_FEATURES, analyzer='char_wb', ngram_range=(3, 5),
+                          alternate_sign=False, norm='l2'),
+    )
+    return make_pipeline(features, LogisticRegression(C=4.0, class_weight='balanced', max_iter=1000))
+
+
+class PreClassifier:
+    """
+    Hashed n-gram features and a logistic regression labelling the obvious
+    emails (automated newsletters, "Purchase Order PO23008082") without an
+    LLM call.
+    """
+
+    def __init__(self, model=None, band=UNCERTAIN_BAND):
+        """
+        :param model: Fitted sklearn pipeline (None: unfitted)
+        :param band: (low, high) P(PO) bounds of the band sent to the LLM
+        """
+        self.model = model
+        self.band = band
+        self.decided = 0
+        self.deferred = 0
+        self.seconds = 0.0
+
+    def fit(self, texts, labels):
+        """
+        :param texts: List of email texts (see email_text)
+        :param labels: List of 0/1 labels (1 = PO)
+        :return: self
+        """
+        self.model = build_model().fit(texts, labels)
+        return self
+
+    def predict_proba(self, texts):
+        """
+        :param texts: List of email texts
+        :return: numpy array of P(PO)
+        """
+        return self.model.predict_proba(texts)[:, list(self.model.classes_).index(1)]
+
+    def decide(self, texts):
+        """
+        Label the emails the model is confident about.
+
+        :param texts: List of email texts
+        :return: List of "PO", "Not PO", or None where the LLM should decide
+        """
+        if not texts:
+            return []
+        started = time.perf_counter()
+        probabilities = self.predict_proba(texts)
+        self.seconds += time.perf_counter() - started
+        low, high = self.band
+        labels = [LABELS[1] if p > high else LABELS[0] if p < low else None for p in probabilities]
+        decided = sum(label is not None for label in labels)
+        self.decided += decided
+        self.deferred += len(labels) - decided
+        return labels
+
+    def stats(self):
+        """
+        :return: Dictionary of decided, sent_to_llm, llm_calls_avoided share and ms per email
+        """
+        total = self.decided + self.deferred
+        return {
+            'decided': self.decided,
+            'sent_to_llm': self.deferred,
+            'llm_calls_avoided': round(self.decided / total, 3) if total else 0.0,
+            'ms_per_email': round(1000 * self.seconds / total, 3) if total else 0.0,
+        }
+
+    def save(self, path=MODEL_PATH):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as file:
+            pickle.dump({'model': self.model, 'band': self.band}, file, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, path=MODEL_PATH, band=None):
+        """
+        :param path: Model file written by save
+        :param band: Override the saved uncertain band
+        :return: PreClassifier, or None if there is no model file
+        """
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'rb') as file:
+                saved = pickle.load(file)
+        except Exception as e:
+            logging.error(f"Could not load pre-classifier {path}: {e}")
+            return None
+        return cls(saved['model'], band or saved['band'])
+
+
+def load_sheet_history(paths):
+    """
+    Labelled emails from earlier classification outputs (sheets with a Classification column).
+
+    :param paths: Excel files
+    :return: Tuple of (texts, labels)
+    """
+    from email_classification import email_fields
+    texts, labels = [], []
+    for path in paths:
+        try:
+            df = pd.read_excel(path)
+        except Exception as e:
+            logging.error(f"Could not read {path}: {e}")
+            continue
+        if 'Classification' not in df.columns:
+            logging.warning(f"No Classification column in {path}")
+            continue
+        for _, row in df.iterrows():
+            label = parse_label(row['Classification'])
+            if label is not None:
+                texts.append(email_text(**email_fields(row)))
+                labels.append(label)
+    return texts, labels
+
+
+def load_test_cases(folder='test-cases'):
+    """
+    Labelled examples from the test-cases folder: each test_case directory is
+    one email, labelled by its parent ("should accept as po" / "should reject
+    as po"); its text is the preview of every file in it.
+
+    :param folder: test-cases folder
+    :return: Tuple of (texts, labels)
+    """
+    from preview_extraction import extract_preview
+    texts, labels = [], []
+    for case in sorted(glob.glob(os.path.join(folder, '*', '*'))):
+        if not os.path.isdir(case):
+            continue
+        parent = os.path.basename(os.path.dirname(case)).lower()
+        label = 1 if 'accept' in parent else 0 if 'reject' in parent else None
+        if label is None:
+            continue
+        previews = []
+        for path in sorted(glob.glob(os.path.join(case, '*'))):
+            try:
+                previews.append(extract_preview(path))
+            except Exception as e:
+                logging.warning(f"No preview for {path}: {e}")
+        filenames = " ".join(os.path.basename(path) for path in glob.glob(os.path.join(case, '*')))
+        texts.append(email_text("", "", filenames, "\n".join(previews)))
+        labels.append(label)
+    return texts, labels
+
+
+def load_history(sheets=(), test_cases=None):
+    texts, labels = load_sheet_history(sheets)
+    if test_cases:
+        case_texts, case_labels = load_test_cases(test_cases)
+        texts += case_texts
+        labels += case_labels
+    return texts, labels
+
+
+def evaluate(texts, labels, band=UNCERTAIN_BAND, folds=5):
+    """
+    Cross-validate the pre-classifier on labelled history.
+
+    :param texts: Email texts
+    :param labels: 0/1 labels
+    :param band: Uncertain band
+    :param folds: Maximum number of folds (reduced for small classes)
+    :return: Dictionary of accuracy of local decisions, share of LLM calls avoided and ms per email
+    """
+    labels = np.asarray(labels)
+    folds = min(folds, int(np.bincount(labels, minlength=2).min()))
+    if folds < 2:
+        raise ValueError("Need at least two examples of each class to evaluate")
+    correct = decided = 0
+    seconds = 0.0
+    texts = np.asarray(texts, dtype=object)
+    for train, test in StratifiedKFold(folds, shuffle=True, random_state=0).split(texts, labels):
+        model = PreClassifier(band=band).fit(list(texts[train]), labels[train])
+        started = time.perf_counter()
+        predicted = model.decide(list(texts[test]))
+        seconds += time.perf_counter() - started
+        for label, truth in zip(predicted, labels[test]):
+            if label is not None:
+                decided += 1
+                correct += int(LABELS.index(label) == truth)
+    return {
+        'examples': len(labels),
+        'folds': folds,
+        'local_accuracy': round(correct / decided, 3) if decided else None,
+        'llm_calls_avoided': round(decided / len(labels), 3),
+        'ms_per_email': round(1000 * seconds / len(labels), 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train or evaluate the local PO pre-classifier")
+    parser.add_argument('command', choices=['train', 'evaluate'])
+    parser.add_argument('--sheets', nargs='*', default=sorted(glob.glob('classified_emails*.xlsx')),
+                        help='Classified email sheets to learn from (default: classified_emails*.xlsx)')
+    parser.add_argument('--test-cases', default='test-cases', help='Labelled test-cases folder ("" to skip)')
+    parser.add_argument('--model', default=MODEL_PATH)
+    parser.add_argument('--low', type=float, default=UNCERTAIN_BAND[0])
+    parser.add_argument('--high', type=float, default=UNCERTAIN_BAND[1])
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s: %(message)s')
+
+    texts, labels = load_history(args.sheets, args.test_cases)
+    print(f"{len(labels)} labelled emails ({sum(labels)} PO)")
+    band = (args.low, args.high)
+    if args.command == 'evaluate':
+        print(evaluate(texts, labels, band))
+    else:
+        model = PreClassifier(band=band).fit(texts, labels)
+        model.save(args.model)
+        print(f"Saved pre-classifier to {args.model}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+import os
+import logging
+
+import pandas as pd
+from PIL import Image
+
+from archive_expansion import ARCHIVE_TYPES, expand_attachment
+from attachment_source import attachment_store, open_source, source_name
+from content_cache import ContentCache, file_sha256
+from extractor_registry import ExtractorRegistry
+
+# Classification only needs to tell a PO from anything else, so it gets a
+# cheap preview of each attachment; full extraction runs later, in
+# POExtractor, and only for rows classified as PO.
+PREVIEW_BYTES = 4 * 1024
+PREVIEW_PAGES = 1
+PREVIEW_ROWS = 40
+# Images are previewed by OCR'ing only their top strip, where a PO's title,
+# number and buyer block sit
+PREVIEW_IMAGE_SHARE = 0.35
+PREVIEW_OCR_CONFIG = '--psm 6'
+# Image previews of a sheet are OCR'd together in batches of this many
+PREVIEW_OCR_BATCH = 32
+# Archives: preview at most this many inner documents
+PREVIEW_ARCHIVE_FILES = 3
+
+PREVIEW_COLUMN = 'extracted information from attachment'
+PREVIEW_VERSION = 1
+_cache = ContentCache('preview_text')
+
+
+def preview_pdf(file_path):
+    from pdf_extraction import extract_pdf_text
+    return extract_pdf_text(file_path, tables=True, max_pages=PREVIEW_PAGES)
+
+
+def preview_spreadsheet(file_path):
+    from spreadsheet_extraction import extract_spreadsheet_text
+    return extract_spreadsheet_text(file_path, max_rows=PREVIEW_ROWS, max_bytes=PREVIEW_BYTES, max_sheets=1)
+
+
+def preview_word(file_path):
+    from word_extraction import extract_word_text
+    return extract_word_text(file_path, max_bytes=PREVIEW_BYTES)
+
+
+def preview_strip(file_path, inline=False):
+    """
+    :param file_path: Path to the image, or its bytes
+    :param inline: True if the image was an inline (Content-ID) email part
+    :return: Preprocessed top strip of the image, or None if triage rejects it
+    """
+    from image_preprocessing import preprocess_image
+    from image_triage import triage_image
+    if not triage_image(file_path, inline=inline).accepted:
+        return None
+    with open_source(file_path) as stream, Image.open(stream) as image:
+        width, height = image.size
+        top = image.crop((0, 0, width, max(1, int(height * PREVIEW_IMAGE_SHARE))))
+        if 'dpi' in image.info:
+            top.info['dpi'] = image.info['dpi']
+        return preprocess_image(top)
+
+
+def preview_image(file_path, inline=False):
+    from ocr_engine import get_ocr_engine
+    strip = preview_strip(file_path, inline)
+    if strip is None:
+        return ""
+    return get_ocr_engine().image_to_string(strip, config=PREVIEW_OCR_CONFIG)
+
+
+preview_registry = ExtractorRegistry(handlers={
+    'pdf': preview_pdf,
+    'excel': preview_spreadsheet,
+    'word': preview_word,
+    'image': preview_image,
+    'text': 'archive_expansion:read_text',
+})
+
+
+def clip(text, max_bytes):
+    data = text.encode('utf-8')
+    if len(data) <= max_bytes:
+        return text
+    return data[:max_bytes].decode('utf-8', errors='ignore') + "\n[... preview truncated]"
+
+
+def preview_key(file_path, inline=False, max_bytes=PREVIEW_BYTES):
+    return f"{file_sha256(file_path)}:{inline}:{max_bytes}:v{PREVIEW_VERSION}"
+
+
+def prefetch_image_previews(attachments):
+    """
+    OCR the image previews of a sheet in batches and cache them, so the
+    default CLI OCR engine starts one tesseract run per batch instead of one
+    per image; extract_preview then finds them in the cache.
+
+    :param attachments: List of (source, mime_type, name, inline)
+    """
+    from ocr_engine import get_ocr_engine
+    batch = []
+
+    def flush():
+        keys, strips = zip(*batch)
+        batch.clear()
+        try:
+            texts = get_ocr_engine().images_to_strings(list(strips), config=PREVIEW_OCR_CONFIG)
+        except Exception as e:
+            logging.error(f"Batched preview OCR failed, OCR'ing images one by one: {e}")
+            return
+        for key, text in zip(keys, texts):
+            _cache.set(key, clip(text, PREVIEW_BYTES))
+
+    for source, mime_type, name, inline in attachments:
+        try:
+            if preview_registry.identify(source, mime_type, name) != 'image':
+                continue
+            key = preview_key(source, inline)
+            if _cache.get(key) is not None:
+                continue
+            strip = preview_strip(source, inline)
+        except Exception as e:
+            logging.warning(f"Not prefetching preview OCR for {name}: {e}")
+            continue
+        # Rejected images preview as "" without OCR
+        if strip is None:
+            _cache.set(key, "")
+            continue
+        batch.append((key, strip))
+        if len(batch) >= PREVIEW_OCR_BATCH:
+            flush()
+    if batch:
+        flush()
+
+
+def extract_preview(file_path, mime_type=None, name=None, inline=False, max_bytes=PREVIEW_BYTES, use_cache=True):
+    """
+    Extract a cheap preview of an attachment for classification.
+
+    PDFs give their first page, workbooks their first sheet, Word documents
+    their first max_bytes of text and images the OCR of their top strip.
+    Archives give the previews of their first few documents. The result is
+    capped at max_bytes.
+
+    :param file_path: Path to the attachment, or its bytes
+    :param mime_type: MIME type declared in the email, if any
+    :param name: File name, for in-memory attachments
+    :param inline: True if the attachment was an inline (Content-ID) email part
+    :param max_bytes: Size cap of the preview (UTF-8 bytes)
+    :param use_cache: Read and write the content-hash cache
+    :return: Preview text ("" when the type is unsupported)
+    """
+    key = preview_key(file_path, inline, max_bytes)
+    if use_cache:
+        cached = _cache.get(key)
+        if cached is not None:
+            return cached
+
+    name = name or source_name(file_path)
+    if preview_registry.identify(file_path, mime_type, name) in ARCHIVE_TYPES:
+        parts = []
+        for member_name, member, member_mime in expand_attachment(file_path, preview_registry.identify, mime_type):
+            _, text = preview_registry.extract(member, mime_type=member_mime, name=os.path.basename(member_name))
+            if text:
+                parts.append(f"[File: {member_name}]\n{text}")
+            if len(parts) >= PREVIEW_ARCHIVE_FILES or sum(len(part) for part in parts) >= max_bytes:
+                break
+        text = "\n\n".join(parts)
+    else:
+        _, text = preview_registry.extract(file_path, mime_type=mime_type, name=name, inline=inline)
+
+    text = clip(text or "", max_bytes)
+    if use_cache:
+        _cache.set(key, text)
+    return text
+
+
+def add_attachment_previews(input_file, output_file, attachments_folder='attachments'):
+    """
+    Fill the sheet's attachment-information column with a preview of each
+    attachment, ready for classification.
+
+    :param input_file: Email sheet written by gmailreader
+    :param output_file: Path to save the sheet with previews
+    :param attachments_folder: Folder attachment links are relative to
+    """
+    df = pd.read_excel(input_file)
+    attachments = []
+    for _, row in df.iterrows():
+        link = str(row.get('Attachment Link', '')).strip()
+        mime_type = row.get('Attachment Type')
+        mime_type = mime_type if isinstance(mime_type, str) else None
+        inline = str(row.get('Inline', '')).strip().lower() in ('true', '1', 'yes')
+        source = attachment_store.get(link)
+        if source is None:
+            path = link.replace('\\', '/')
+            if path.lower().startswith('attachments/'):
+                path = os.path.join(attachments_folder, path.split('/', 1)[1])
+            source = path if link and os.path.isfile(path) else None
+        attachments.append((source, mime_type, os.path.basename(link), inline))
+    prefetch_image_previews([attachment for attachment in attachments if attachment[0] is not None])
+
+    previews = []
+    for source, mime_type, name, inline in attachments:
+        try:
+            preview = extract_preview(source, mime_type, name=name, inline=inline) if source else ""
+        except Exception as e:
+            logging.error(f"Preview extraction error for {name}: {e}")
+            preview = ""
+        previews.append(preview)
+    df[PREVIEW_COLUMN] = previews
+    df.to_excel(output_file, index=False)
+    logging.info(f"Attachment previews for {len(df)} rows saved to {output_file} ({preview_registry.stats()})")
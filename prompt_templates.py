@@ -0,0 +1,152 @@
+import os
+import re
+import string
+import hashlib
+import logging
+import threading
+from collections import Counter
+
+from classification_cache import MODEL_PRICES
+
+# Prompt templates live in files named <name>.v<version>.txt and are filled
+# with str.format. A template should hold its fixed instructions first and
+# the per-email fields last: providers reuse the computed prefix of a prompt
+# seen recently (OpenAI from 1024 identical leading tokens, Ollama and
+# llama.cpp from any shared prefix), which only works if the prefix does not
+# start with the subject and body.
+PROMPT_DIR = os.environ.get('PO_PROMPT_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'prompts'))
+# Pin a template version (e.g. "1" for the old field-first layout); default: the newest
+PINNED_VERSION = os.environ.get('PO_PROMPT_VERSION')
+# Templates whose fixed text is mostly after the first field are logged as uncacheable
+MIN_STATIC_SHARE = 0.5
+# Share of the input price charged for cached prompt tokens
+CACHED_INPUT_PRICE_SHARE = 0.5
+
+TEMPLATE_FILE = re.compile(r'^(?P<name>.+)\.v(?P<version>\d+)\.txt$')
+
+_templates = {}
+_templates_lock = threading.Lock()
+_usage = Counter()
+_usage_lock = threading.Lock()
+
+
+class PromptTemplate:
+    """A versioned prompt template read from a file."""
+
+    def __init__(self, name, version, text):
+        """
+        :param name: Template name
+        :param version: Template version number
+        :param text: str.format template
+        """
+        self.name = name
+        self.version = version
+        self.text = text
+        parsed = list(string.Formatter().parse(text))
+        self.fields = tuple(field for _, field, _, _ in parsed if field is not None)
+        static = []
+        for literal, field, _, _ in parsed:
+            static.append(literal)
+            if field is not None:
+                break
+        self.static_prefix = "".join(static)
+        literal_length = sum(len(literal) for literal, _, _, _ in parsed)
+        self.static_share = len(self.static_prefix) / literal_length if literal_length else 1.0
+
+    @property
+    def key(self):
+        """
+        Version plus a hash of the text, so editing a template without bumping
+        its version still changes the classification cache key.
+        """
+        return f"{self.version}-{hashlib.sha256(self.text.encode('utf-8')).hexdigest()[:8]}"
+
+    def render(self, **fields):
+        """
+        :param fields: Values of the template's fields
+        :return: Prompt text
+        """
+        return self.text.format(**fields)
+
+
+def template_versions(name, directory=PROMPT_DIR):
+    """
+    :param name: Template name
+    :param directory: Template folder
+    :return: Sorted list of the versions available
+    """
+    versions = []
+    for filename in os.listdir(directory):
+        match = TEMPLATE_FILE.match(filename)
+        if match and match.group('name') == name:
+            versions.append(int(match.group('version')))
+    return sorted(versions)
+
+
+def load_template(name, version=PINNED_VERSION, directory=PROMPT_DIR):
+    """
+    Load a prompt template, once per process.
+
+    :param name: Template name (e.g. 'classification')
+    :param version: Version to load; None for the newest
+    :param directory: Template folder
+    :return: PromptTemplate
+    :raises FileNotFoundError: If the template (version) does not exist
+    """
+    if version is None:
+        versions = template_versions(name, directory)
+        if not versions:
+            raise FileNotFoundError(f"No prompt template '{name}' in {directory}")
+        version = versions[-1]
+    path = os.path.join(directory, f"{name}.v{int(version)}.txt")
+    with _templates_lock:
+        if path not in _templates:
+            with open(path, encoding='utf-8') as file:
+                template = PromptTemplate(name, int(version), file.read())
+            if template.static_share < MIN_STATIC_SHARE:
+                logging.warning(f"Prompt template {name} v{version} puts fields before most of its fixed text; "
+                                f"provider prompt caching cannot reuse it")
+            _templates[path] = template
+        return _templates[path]
+
+
+def record_usage(model, usage, seconds):
+    """
+    Count the prompt tokens the provider served from its prompt cache.
+
+    :param model: Model name
+    :param usage: Response usage object (or None)
+    :param seconds: Request duration
+    """
+    prompt_tokens = getattr(usage, 'prompt_tokens', None) or 0
+    details = getattr(usage, 'prompt_tokens_details', None)
+    cached_tokens = getattr(details, 'cached_tokens', None) or 0
+    input_price = MODEL_PRICES.get(model, (0.0, 0.0))[0]
+    with _usage_lock:
+        _usage['requests'] += 1
+        _usage['prompt_tokens'] += prompt_tokens
+        _usage['cached_tokens'] += cached_tokens
+        _usage['cost_saved_usd'] += cached_tokens * input_price * (1 - CACHED_INPUT_PRICE_SHARE) / 1e6
+        group = 'cached' if cached_tokens else 'uncached'
+        _usage[f'{group}_requests'] += 1
+        _usage[f'{group}_seconds'] += seconds
+
+
+def usage_stats():
+    """
+    :return: Dictionary of requests, prompt and cached tokens, cached share,
+        USD saved and mean latency of requests with and without cached tokens
+    """
+    with _usage_lock:
+        usage = Counter(_usage)
+    stats = {
+        'requests': usage['requests'],
+        'prompt_tokens': usage['prompt_tokens'],
+        'cached_tokens': usage['cached_tokens'],
+        'cached_share': round(usage['cached_tokens'] / usage['prompt_tokens'], 3) if usage['prompt_tokens'] else 0.0,
+        'cost_saved_usd': round(usage['cost_saved_usd'], 4),
+    }
+    for group in ('cached', 'uncached'):
+        requests = usage[f'{group}_requests']
+        stats[f'{group}_latency_s'] = round(usage[f'{group}_seconds'] / requests, 3) if requests else None
+    return stats
@@ -0,0 +1,196 @@
+import logging
+import datetime
+import itertools
+
+import openpyxl
+import pandas as pd
+
+from attachment_source import open_source, read_head, source_name
+from content_cache import ContentCache, file_sha256
+from extractor_registry import OLE2_MAGIC
+from table_format import TABLE_DELIMITER
+
+# Output budget. Line items of a PO fit comfortably; large analysis workbooks
+# are cut off with an explicit marker instead of flooding the prompt.
+MAX_ROWS_PER_SHEET = 200
+MAX_TEXT_BYTES = 32 * 1024
+# The header row is searched for among this many non-empty rows of each sheet
+HEADER_SCAN_ROWS = 30
+MIN_HEADER_CELLS = 3
+# Rows filling less than this share of a wide header span are written as
+# header=value pairs instead of mostly-empty delimited cells
+SPARSE_ROW_FILL = 0.5
+SPARSE_MIN_SPAN = 8
+
+SPREADSHEET_VERSION = 1
+_cache = ContentCache('spreadsheet_text')
+
+
+def format_cell(value):
+    """
+    Render a cell value compactly.
+
+    :param value: Cell value from openpyxl or pandas
+    :return: Cell text ("" for empty cells)
+    """
+    if value is None or (isinstance(value, float) and value != value):
+        return ""
+    if isinstance(value, bool):
+        return str(value)
+    if isinstance(value, float):
+        return str(int(value)) if value.is_integer() else repr(round(value, 6))
+    if isinstance(value, datetime.datetime):
+        return value.date().isoformat() if value.time() == datetime.time() else value.isoformat(sep=' ')
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    return " ".join(str(value).split()).replace('|', '/')
+
+
+def iter_workbook(file_path):
+    """
+    Stream every sheet of a workbook as rows of formatted cells.
+
+    .xlsx files are read with openpyxl in read-only mode using the cached
+    formula values; legacy .xls files (told apart by their OLE2 header) go
+    through pandas.
+
+    :param file_path: Path to the workbook, or its bytes
+    :return: Generator of (sheet_name, declared_row_count, row_iterator)
+    """
+    with open_source(file_path) as stream:
+        if read_head(stream, len(OLE2_MAGIC)) == OLE2_MAGIC:
+            stream.seek(0)
+            for name, df in pd.read_excel(stream, sheet_name=None, header=None).items():
+                rows = ([format_cell(value) for value in row] for row in df.itertuples(index=False, name=None))
+                yield name, len(df), rows
+            return
+
+        workbook = openpyxl.load_workbook(stream, read_only=True, data_only=True)
+        try:
+            for sheet in workbook.worksheets:
+                rows = ([format_cell(value) for value in row] for row in sheet.iter_rows(values_only=True))
+                yield sheet.title, sheet.max_row, rows
+        finally:
+            workbook.close()
+
+
+def is_header(row, next_row):
+    """
+    A header row has several filled cells, mostly text, and is followed by a multi-cell row.
+
+    :param row: Formatted cells of the candidate row
+    :param next_row: Formatted cells of the following non-empty row (or None)
+    :return: True if the row looks like a table header
+    """
+    filled = [cell for cell in row if cell]
+    if len(filled) < MIN_HEADER_CELLS or next_row is None:
+        return False
+    textual = sum(1 for cell in filled if not cell.replace('.', '', 1).replace('-', '', 1).isdigit())
+    return textual >= 0.8 * len(filled) and sum(1 for cell in next_row if cell) >= 2
+
+
+def render_sheet(name, declared_rows, rows, max_rows):
+    """
+    Render one sheet as its preamble lines followed by the line-item region.
+
+    Rows before the detected header are written as their non-empty cells.
+    The header and every row after it are written as delimiter-separated cells
+    clipped to the header's column span, so columns stay aligned; sparse rows
+    of wide sheets are written as header=value pairs instead.
+
+    :param name: Sheet name
+    :param declared_rows: Row count reported by the workbook (may be None)
+    :param rows: Iterator of formatted rows
+    :param max_rows: Maximum non-empty rows to emit
+    :return: Generator of output lines
+    """
+    yield f"[Sheet: {name}]"
+    buffered = []
+    for row in rows:
+        if any(row):
+            buffered.append(row)
+            if len(buffered) > HEADER_SCAN_ROWS:
+                break
+
+    header_index = next(
+        (i for i in range(len(buffered) - 1) if is_header(buffered[i], buffered[i + 1])),
+        None,
+    )
+    span = None
+    if header_index is not None:
+        filled = [i for i, cell in enumerate(buffered[header_index]) if cell]
+        span = (filled[0], filled[-1] + 1)
+        header = buffered[header_index][span[0]:span[1]]
+
+    def render(index, row):
+        filled = [cell for cell in row if cell]
+        if span is None or index < header_index or len(filled) == 1:
+            return TABLE_DELIMITER.join(filled)
+        cells = row[span[0]:span[1]]
+        outside = [cell for cell in row[:span[0]] + row[span[1]:] if cell]
+        width = span[1] - span[0]
+        if width > SPARSE_MIN_SPAN and len(filled) < SPARSE_ROW_FILL * width:
+            if index == header_index:
+                return TABLE_DELIMITER.join(filled)
+            pairs = [f"{header[i] or i + 1}={cell}" for i, cell in enumerate(cells) if cell]
+            return TABLE_DELIMITER.join(pairs + outside)
+        while cells and not cells[-1]:
+            cells.pop()
+        return TABLE_DELIMITER.join(cells + outside) if any(cells) else TABLE_DELIMITER.join(outside)
+
+    non_empty = itertools.chain(buffered, (row for row in rows if any(row)))
+    for index, row in enumerate(non_empty):
+        if index >= max_rows:
+            total = f" of {declared_rows}" if declared_rows else ""
+            yield f"[... sheet '{name}' truncated after {index} rows{total}]"
+            return
+        if index == header_index:
+            yield "[Line items]"
+        yield render(index, row)
+
+
+def extract_spreadsheet_text(file_path, max_rows=MAX_ROWS_PER_SHEET, max_bytes=MAX_TEXT_BYTES, use_cache=True,
+                             max_sheets=None):
+    """
+    Extract every sheet of a workbook as compact delimited rows within a size budget.
+
+    :param file_path: Path to the workbook, or its content as bytes, memoryview or BytesIO
+    :param max_rows: Maximum non-empty rows emitted per sheet
+    :param max_bytes: Maximum size of the returned text (UTF-8 bytes)
+    :param use_cache: Read and write the content-hash cache
+    :param max_sheets: Only extract this many leading sheets (None for all)
+    :return: Extracted text
+    """
+    key = f"{file_sha256(file_path)}:{max_rows}:{max_bytes}:{max_sheets}:v{SPREADSHEET_VERSION}"
+    if use_cache:
+        cached = _cache.get(key)
+        if cached is not None:
+            return cached
+
+    lines = []
+    size = 0
+    sheets = iter_workbook(file_path)
+    for index, (name, declared_rows, rows) in enumerate(sheets):
+        if max_sheets is not None and index >= max_sheets:
+            # Rows of the remaining sheets are never read, only their names
+            remaining = [name] + [sheet_name for sheet_name, _, _ in sheets]
+            lines.append(f"[... sheets not shown: {', '.join(remaining)}]")
+            break
+        for line in render_sheet(name, declared_rows, rows, max_rows):
+            line_size = len(line.encode('utf-8')) + 1
+            if size + line_size > max_bytes:
+                remaining = [sheet_name for sheet_name, _, _ in sheets]
+                lines.append(f"[... output truncated at {max_bytes} bytes in sheet '{name}'"
+                             + (f"; sheets not shown: {', '.join(remaining)}]" if remaining else "]"))
+                break
+            lines.append(line)
+            size += line_size
+        else:
+            continue
+        break
+
+    text = "\n".join(lines)
+    logging.info(f"Spreadsheet extraction of {source_name(file_path)}: {len(lines)} lines, {size} bytes")
+    if use_cache:
+        _cache.set(key, text)
+    return text
@@ -0,0 +1,4 @@
+# Shared by the PDF, OCR layout, spreadsheet and Word extractors, which all
+# write table rows as cells joined by this delimiter. Kept in its own module
+# so the lighter extractors do not import pdf_extraction (pypdfium2, pdfplumber).
+TABLE_DELIMITER = ' | '
@@ -0,0 +1,100 @@
+import io
+import os
+import sys
+import gzip
+import tarfile
+import zipfile
+from email.message import EmailMessage
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from archive_expansion import BODY_NAME, ExpansionBudget, expand_attachment
+from extractor_registry import ExtractorRegistry
+
+identify = ExtractorRegistry().identify
+
+
+def make_zip(members):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, data in members.items():
+            archive.writestr(name, data)
+    return buffer.getvalue()
+
+
+def make_tar(members, mode='w'):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode=mode) as archive:
+        for name, data in members.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
+
+
+def make_eml(body, attachments):
+    message = EmailMessage()
+    message['From'] = 'buyer@example.com'
+    message['To'] = 'orders@example.com'
+    message['Subject'] = 'Order'
+    message.set_content(body)
+    for name, data in attachments.items():
+        message.add_attachment(data, maintype='text', subtype='plain', filename=name)
+    return message.as_bytes()
+
+
+def read(member):
+    if isinstance(member, str):
+        with open(member, 'rb') as stream:
+            return stream.read()
+    return bytes(member)
+
+
+def expand(tmp_path, name, data, **options):
+    path = tmp_path / name
+    path.write_bytes(data)
+    return [(member_name, read(member)) for member_name, member, _ in expand_attachment(str(path), identify, **options)]
+
+
+def test_zip_members(tmp_path):
+    members = expand(tmp_path, 'order.zip', make_zip({'a.txt': b'first', 'b.txt': b'second'}))
+    assert members == [('order.zip/a.txt', b'first'), ('order.zip/b.txt', b'second')]
+
+
+def test_gzipped_tar_and_single_file(tmp_path):
+    assert expand(tmp_path, 'orders.tar.gz', make_tar({'po.txt': b'PO 4711'}, mode='w:gz')) == \
+        [('orders.tar.gz/po.txt', b'PO 4711')]
+    assert expand(tmp_path, 'po.txt.gz', gzip.compress(b'PO 4712')) == [('po.txt.gz/po.txt', b'PO 4712')]
+
+
+def test_eml_body_then_attachments(tmp_path):
+    members = expand(tmp_path, 'forward.eml', make_eml('See the order below', {'po.txt': b'PO 4713'}))
+    assert [name for name, _ in members] == [f'forward.eml/{BODY_NAME}', 'forward.eml/po.txt']
+    assert members[0][1].strip() == b'See the order below'
+
+
+def test_depth_limit(tmp_path):
+    nested = make_zip({'outer.zip': make_zip({'inner.zip': make_zip({'deep.txt': b'deep'})}), 'top.txt': b'top'})
+    assert expand(tmp_path, 'nested.zip', nested, max_depth=2) == [('nested.zip/top.txt', b'top')]
+    assert ('nested.zip/outer.zip/inner.zip/deep.txt', b'deep') in expand(tmp_path, 'nested.zip', nested, max_depth=3)
+
+
+def test_file_limit_keeps_documents_already_yielded(tmp_path):
+    data = make_zip({f'{index}.txt': b'x' for index in range(5)})
+    members = expand(tmp_path, 'many.zip', data, budget=ExpansionBudget(max_files=2))
+    assert [name for name, _ in members] == ['many.zip/0.txt', 'many.zip/1.txt']
+
+
+def test_byte_limit(tmp_path):
+    data = make_tar({'small.txt': b'a' * 100, 'large.txt': b'b' * 1000, 'after.txt': b'c'})
+    members = expand(tmp_path, 'sizes.tar', data, budget=ExpansionBudget(max_bytes=500))
+    assert members == [('sizes.tar/small.txt', b'a' * 100)]
+
+
+def test_zip_bomb_stops_at_the_bytes_actually_read(tmp_path):
+    # 64 MB of zeros deflate to about 64 KB; nested once more, as bombs are
+    bomb = make_zip({'inner.zip': make_zip({'zeros.bin': bytes(64 * 1024 * 1024)})})
+    budget = ExpansionBudget(max_bytes=4 * 1024 * 1024)
+    assert expand(tmp_path, 'bomb.zip', bomb, budget=budget) == []
+    assert budget.bytes <= budget.max_bytes + 1024 * 1024
@@ -0,0 +1,45 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+from transformer_classification import po_label_index
+
+
+@pytest.mark.parametrize('id2label, expected', [
+    ({0: 'Not PO', 1: 'PO'}, 1),
+    ({0: 'PO', 1: 'Not PO'}, 0),
+    ({'0': 'po', '1': 'not_po'}, 0),
+    ({0: 'NON_PO', 1: 'PO'}, 1),
+    ({0: 'PO', 1: 'non-po'}, 0),
+    ({0: 'LABEL_0', 1: 'LABEL_1'}, 1),
+])
+def test_po_label_index(id2label, expected):
+    assert po_label_index(id2label) == expected
+
+
+def test_predictions_come_back_in_input_order(tmp_path):
+    pytest.importorskip('torch')
+    pytest.importorskip('transformers')
+    from fixtures import make_tiny_transformer
+    from transformer_classification import TransformerClassifier
+
+    texts = [
+        "purchase order",
+        "please find attached our purchase order for 40 units of item 7 delivered by friday",
+        "newsletter",
+        "invoice attached for last month with the payment terms and the bank details below",
+        "quote request for bolts",
+    ]
+    model_dir = make_tiny_transformer(str(tmp_path / 'model'), texts)
+    sorted_batches = TransformerClassifier(model_dir, batch_size=2, num_threads=1)
+    one_by_one = TransformerClassifier(model_dir, batch_size=1, num_threads=1, sort_by_length=False)
+
+    batched = sorted_batches.predict_proba(texts)
+    single = one_by_one.predict_proba(texts)
+    assert batched == pytest.approx(single, abs=1e-5)
+    assert sorted_batches.po_index == 1
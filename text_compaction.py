@@ -0,0 +1,267 @@
+import os
+import re
+import logging
+import threading
+from collections import Counter, namedtuple
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# Token budget for the attachment text of each prompt-building stage. Text over
+# budget keeps its beginning and end (PO headers and totals) and loses the
+# middle. Override per stage with PO_TOKEN_BUDGET_<STAGE>, e.g.
+# PO_TOKEN_BUDGET_EXTRACTION=8000; 0 disables the budget.
+STAGE_TOKEN_BUDGETS = {
+    'classification': 1500,
+    'email_body': 1000,
+    'extraction': 6000,
+}
+BUDGET_TAIL_SHARE = 0.25
+CHARS_PER_TOKEN = 4                 # estimate used when tiktoken is not installed
+
+# A line repeated at least this many times, never closer together than a page
+# would put them, is a running page header or footer; only its first
+# occurrence is kept. Short values (units, dates) and table rows are never dropped.
+REPEATED_LINE_MIN = 3
+REPEATED_LINE_MIN_GAP = 8
+REPEATED_LINE_CHARS = (12, 120)
+PAGE_NUMBER = re.compile(r'^\s*(page\s*\d+(\s*(of|/)\s*\d+)?|-\s*\d+\s*-|\d+\s+of\s+\d+)\s*$', re.IGNORECASE)
+
+# OCR noise: lines with no real word or number, or mostly punctuation
+MIN_ALNUM_RATIO = 0.5
+WORD_OR_NUMBER = re.compile(r'[^\W\d_]{2,}|\d+')
+
+# Structural markers written by the extractors; boilerplate sections end at the next one
+SECTION_MARKER = re.compile(r'^\[(Table \d+|Line items|Sheet: .*|File: .*|Header|Footer)\]$')
+# A heading that starts a boilerplate section. The section runs to the next
+# marker, to a blank line not followed by another numbered clause, or for at
+# most BOILERPLATE_MAX_SECTION_LINES lines, so order details printed after the
+# terms are not lost. Short sections are kept: on many POs "Terms &
+# Conditions" holds the payment and delivery terms. In long ones, short lines
+# naming fields we extract are still kept.
+BOILERPLATE_MIN_SECTION_CHARS = 1500
+BOILERPLATE_MAX_SECTION_LINES = 80
+CLAUSE_START = re.compile(r'^(\(?[a-z0-9]{1,3}[.)]|\d+(\.\d+)+)\s', re.IGNORECASE)
+BOILERPLATE_KEEP = re.compile(r'\b(payment|delivery|freight|discount|tax|gst|vat|incoterms?)\b', re.IGNORECASE)
+BOILERPLATE_KEEP_MAX_CHARS = 160
+BOILERPLATE_HEADINGS = re.compile(
+    r'^\s*((general|standard)\s+)?(terms\s*(and|&)\s*conditions|conditions\s+of\s+(purchase|sale))'
+    r'(\s+of\s+(purchase|sale))?\s*:?\s*$',
+    re.IGNORECASE,
+)
+# A paragraph (up to the next blank line) of email legal boilerplate
+BOILERPLATE_PARAGRAPHS = re.compile(
+    r'^\s*(confidentiality notice|disclaimer\s*:|this (e-?mail|message) and any (attachments|files)'
+    r'|this e-?mail is confidential|please consider the environment before printing)',
+    re.IGNORECASE,
+)
+
+CompactionReport = namedtuple(
+    'CompactionReport', ['chars_before', 'chars_after', 'tokens_before', 'tokens_after', 'truncated']
+)
+
+_encoding = None
+_totals = {}
+_totals_lock = threading.Lock()
+
+
+def estimate_tokens(text):
+    """
+    Count tokens with tiktoken when installed, otherwise estimate from length.
+
+    :param text: Text to measure
+    :return: Token count
+    """
+    global _encoding
+    if tiktoken is not None:
+        if _encoding is None:
+            _encoding = tiktoken.get_encoding('o200k_base')
+        return len(_encoding.encode(text, disallowed_special=()))
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def stage_budget(stage):
+    """
+    :param stage: Stage name
+    :return: Token budget for the stage, or None for no budget
+    """
+    budget = int(os.environ.get(f"PO_TOKEN_BUDGET_{stage.upper()}", STAGE_TOKEN_BUDGETS.get(stage, 0)))
+    return budget or None
+
+
+def normalize_whitespace(text):
+    """
+    Collapse runs of spaces and tabs, strip line ends and squeeze blank lines.
+
+    :param text: Text to normalise
+    :return: List of lines
+    """
+    text = text.replace('\r\n', '\n').replace('\r', '\n').replace('\f', '\n')
+    text = text.replace('\u00a0', ' ').replace('\u200b', '')
+    lines = []
+    for line in text.split('\n'):
+        line = re.sub(r'[ \t]+', ' ', line).strip()
+        if line or (lines and lines[-1]):
+            lines.append(line)
+    while lines and not lines[-1]:
+        lines.pop()
+    return lines
+
+
+def is_table_row(line):
+    return '|' in line or SECTION_MARKER.match(line) is not None
+
+
+def is_ocr_noise(line):
+    """
+    :param line: A non-empty line
+    :return: True if the line has no real word or number, or is mostly punctuation
+    """
+    if is_table_row(line):
+        return False
+    visible = line.replace(' ', '')
+    if not WORD_OR_NUMBER.search(visible):
+        return True
+    return sum(char.isalnum() for char in visible) < MIN_ALNUM_RATIO * len(visible)
+
+
+def drop_repeated_lines(lines):
+    """
+    Remove page numbers and every repeat of running headers and footers after the first.
+
+    :param lines: List of lines
+    :return: List of lines
+    """
+    positions = {}
+    for index, line in enumerate(lines):
+        if REPEATED_LINE_CHARS[0] <= len(line) <= REPEATED_LINE_CHARS[1] and not is_table_row(line):
+            positions.setdefault(line, []).append(index)
+    running = {
+        line for line, indexes in positions.items()
+        if len(indexes) >= REPEATED_LINE_MIN
+        and min(b - a for a, b in zip(indexes, indexes[1:])) >= REPEATED_LINE_MIN_GAP
+    }
+    kept, seen = [], set()
+    for line in lines:
+        if line and PAGE_NUMBER.match(line):
+            continue
+        if line in running:
+            if line in seen:
+                continue
+            seen.add(line)
+        kept.append(line)
+    return kept
+
+
+def drop_boilerplate(lines):
+    """
+    Remove terms & conditions sections and email legal paragraphs, leaving a marker.
+
+    :param lines: List of lines
+    :return: List of lines
+    """
+    kept = []
+    section = None
+    skipping = False
+
+    def close_section():
+        heading, body = section[0], section[1:]
+        if sum(len(line) for line in body) < BOILERPLATE_MIN_SECTION_CHARS:
+            kept.extend(section)
+            return
+        kept.append(f"[{heading.rstrip(':')} omitted]")
+        kept.extend(line for line in body
+                    if BOILERPLATE_KEEP.search(line) and len(line) <= BOILERPLATE_KEEP_MAX_CHARS)
+
+    for index, line in enumerate(lines):
+        if section is not None:
+            following = lines[index + 1] if index + 1 < len(lines) else ""
+            ended = (SECTION_MARKER.match(line) or len(section) > BOILERPLATE_MAX_SECTION_LINES
+                     or (not line and not CLAUSE_START.match(following)))
+            if not ended:
+                section.append(line)
+                continue
+            close_section()
+            section = None
+        if skipping:
+            skipping = bool(line)
+            continue
+        if BOILERPLATE_HEADINGS.match(line):
+            section = [line]
+        elif BOILERPLATE_PARAGRAPHS.match(line):
+            skipping = True
+        else:
+            kept.append(line)
+    if section is not None:
+        close_section()
+    return kept
+
+
+def enforce_budget(text, max_tokens):
+    """
+    Cut text to a token budget, keeping its beginning and its end.
+
+    :param text: Text to cut
+    :param max_tokens: Token budget
+    :return: Tuple of (text, truncated flag)
+    """
+    tokens = estimate_tokens(text)
+    if tokens <= max_tokens:
+        return text, False
+    # Cut proportionally by characters; close enough for a budget
+    keep = int(len(text) * max_tokens / tokens)
+    tail = int(keep * BUDGET_TAIL_SHARE)
+    head = keep - tail
+    omitted = len(text) - head - tail
+    return f"{text[:head].rstrip()}\n[... {omitted} characters omitted ...]\n{text[len(text) - tail:].lstrip()}", True
+
+
+def compact_text(text, stage='extraction', label='document', max_tokens=None):
+    """
+    Shrink extracted text before it goes into a prompt.
+
+    Normalises whitespace, drops page numbers and repeated page headers and
+    footers, removes OCR noise lines and known boilerplate (terms &
+    conditions, email disclaimers), then enforces the stage's token budget.
+    Savings are logged per document and totalled per stage.
+
+    :param text: Extracted text
+    :param stage: Prompt stage, selects the budget (see STAGE_TOKEN_BUDGETS)
+    :param label: Document name for the log line
+    :param max_tokens: Token budget overriding the stage default
+    :return: Tuple of (compacted text, CompactionReport)
+    """
+    text = "" if text is None else str(text)
+    lines = normalize_whitespace(text)
+    lines = [line for line in lines if not line or not is_ocr_noise(line)]
+    lines = drop_boilerplate(drop_repeated_lines(lines))
+    compacted = "\n".join(lines).strip()
+    compacted = re.sub(r'\n{3,}', '\n\n', compacted)
+
+    budget = max_tokens or stage_budget(stage)
+    truncated = False
+    if budget:
+        compacted, truncated = enforce_budget(compacted, budget)
+
+    report = CompactionReport(len(text), len(compacted), estimate_tokens(text), estimate_tokens(compacted), truncated)
+    with _totals_lock:
+        totals = _totals.setdefault(stage, Counter())
+        totals.update(documents=1, chars_saved=report.chars_before - report.chars_after,
+                      tokens_saved=report.tokens_before - report.tokens_after, truncated=int(truncated))
+    if report.chars_before:
+        logging.info(
+            f"Compacted {label} for {stage}: {report.chars_before} -> {report.chars_after} chars, "
+            f"{report.tokens_before} -> {report.tokens_after} tokens"
+            + (" (cut to budget)" if truncated else "")
+        )
+    return compacted, report
+
+
+def compaction_stats():
+    """
+    :return: Dictionary of stage -> documents, chars_saved, tokens_saved, truncated
+    """
+    with _totals_lock:
+        return {stage: dict(totals) for stage, totals in _totals.items()}
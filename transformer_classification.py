@@ -0,0 +1,156 @@
+import os
+import re
+import time
+import logging
+
+import pandas as pd
+
+try:
+    import torch
+    from transformers import AutoModelForSequenceClassification, AutoTokenizer
+except ImportError:
+    torch = None
+
+from email_classification import email_fields
+from pre_classifier import email_text
+
+# Fine-tuned sequence-classification model (DistilBERT, RoBERTa, ...) saved
+# with save_pretrained
+MODEL_DIR = os.environ.get('PO_TRANSFORMER_MODEL_DIR', os.path.join('models', 'po-transformer'))
+# Tokens per email; subject, filename and the start of the body carry the signal
+MAX_LENGTH = int(os.environ.get('PO_TRANSFORMER_MAX_LENGTH', 256))
+BATCH_SIZE = int(os.environ.get('PO_TRANSFORMER_BATCH_SIZE', 32))
+# Intra-op threads for CPU inference
+NUM_THREADS = int(os.environ.get('PO_TORCH_THREADS', os.cpu_count() or 1))
+# int8 dynamic quantisation of the Linear layers: ~2x faster on CPU, small accuracy cost
+QUANTIZE = os.environ.get('PO_TRANSFORMER_INT8', '0').lower() in ('1', 'true', 'yes')
+# Words marking a label name as the negative class
+NEGATIONS = {'not', 'non', 'no'}
+
+
+def po_label_index(id2label):
+    """
+    Find the output index meaning "PO". Labels named like "Not PO" or
+    "NON_PO" are the negative class; with generic names (LABEL_0, LABEL_1)
+    index 1 is PO.
+
+    :param id2label: Model config's id -> label name mapping
+    :return: Index of the PO class
+    """
+    names = {int(index): set(re.split(r'[\s_-]+', str(name).lower())) for index, name in id2label.items()}
+    positive = [index for index, words in names.items() if 'po' in words and not words & NEGATIONS]
+    return positive[0] if len(positive) == 1 else 1
+
+
+class TransformerClassifier:
+    """
+    CPU inference for a sequence-classification transformer.
+
+    Emails are tokenised once, sorted by length and batched so each batch is
+    padded only to its own longest email; results come back in input order.
+    """
+
+    def __init__(self, model_dir=MODEL_DIR, max_length=MAX_LENGTH, batch_size=BATCH_SIZE,
+                 num_threads=NUM_THREADS, quantize=QUANTIZE, sort_by_length=True):
+        """
+        :param model_dir: Directory with the tokenizer and model (save_pretrained format)
+        :param max_length: Tokens kept per email
+        :param batch_size: Emails per forward pass
+        :param num_threads: torch intra-op threads
+        :param quantize: Apply int8 dynamic quantisation to the Linear layers
+        :param sort_by_length: Batch emails of similar length together (off only for benchmarks)
+        """
+        if torch is None:
+            raise RuntimeError("torch and transformers are required for the transformer classifier")
+        self.max_length = max_length
+        self.batch_size = batch_size
+        self.sort_by_length = sort_by_length
+        torch.set_num_threads(num_threads)
+        started = time.perf_counter()
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        model = AutoModelForSequenceClassification.from_pretrained(model_dir)
+        model.eval()
+        if quantize:
+            model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        self.model = model
+        self.po_index = po_label_index(model.config.id2label)
+        self.emails = 0
+        self.seconds = 0.0
+        self.tokens = 0
+        self.padded_tokens = 0
+        logging.info(f"Loaded {model_dir} in {time.perf_counter() - started:.1f}s "
+                     f"({num_threads} threads{', int8' if quantize else ''})")
+
+    def predict_proba(self, texts):
+        """
+        :param texts: List of email texts
+        :return: List of P(PO), in input order
+        """
+        if not texts:
+            return []
+        started = time.perf_counter()
+        encoded = self.tokenizer(list(texts), truncation=True, max_length=self.max_length)
+        order = list(range(len(texts)))
+        if self.sort_by_length:
+            order.sort(key=lambda i: len(encoded['input_ids'][i]))
+        probabilities = [0.0] * len(texts)
+        with torch.inference_mode():
+            for start in range(0, len(order), self.batch_size):
+                indexes = order[start:start + self.batch_size]
+                features = [{key: encoded[key][i] for key in encoded.keys()} for i in indexes]
+                # Dynamic padding: only up to the longest email of this batch
+                batch = self.tokenizer.pad(features, padding='longest', return_tensors='pt')
+                logits = self.model(**batch).logits
+                scores = torch.softmax(logits, dim=-1)[:, self.po_index].tolist()
+                for i, score in zip(indexes, scores):
+                    probabilities[i] = score
+                self.tokens += int(batch['attention_mask'].sum())
+                self.padded_tokens += batch['attention_mask'].numel()
+        self.emails += len(texts)
+        self.seconds += time.perf_counter() - started
+        return probabilities
+
+    def predict(self, texts):
+        """
+        :param texts: List of email texts
+        :return: List of "PO" / "Not PO", in input order
+        """
+        return ["PO" if p >= 0.5 else "Not PO" for p in self.predict_proba(texts)]
+
+    def stats(self):
+        """
+        :return: Dictionary of emails, emails per second and the share of padding tokens
+        """
+        return {
+            'emails': self.emails,
+            'emails_per_sec': round(self.emails / self.seconds, 1) if self.seconds else 0.0,
+            'padding_share': round(1 - self.tokens / self.padded_tokens, 3) if self.padded_tokens else 0.0,
+        }
+
+
+def classify_emails_with_transformer(input_file, output_file, model_dir=MODEL_DIR, **options):
+    """
+    Classify the emails of an Excel file as "PO" or "Not PO" with a local
+    transformer model on CPU.
+
+    :param input_file: Path to the input Excel file
+    :param output_file: Path to save the classified output Excel file
+    :param model_dir: Directory of the fine-tuned model
+    :param options: TransformerClassifier options (max_length, batch_size, num_threads, quantize)
+    """
+    try:
+        df = pd.read_excel(input_file)
+    except FileNotFoundError:
+        print(f"Input file {input_file} not found.")
+        return
+
+    classifier = TransformerClassifier(model_dir, **options)
+    texts = [email_text(**email_fields(row)) for _, row in df.iterrows()]
+    df['Classification'] = classifier.predict(texts)
+    print(f"Transformer classification: {classifier.stats()}")
+
+    try:
+        df.to_excel(output_file, index=False)
+        print(f"Classification completed. The results are saved in {output_file}.")
+    except Exception as e:
+        print(f"Error saving output file: {e}")
@@ -0,0 +1,227 @@
+import os
+import shutil
+import signal
+import logging
+import tempfile
+import subprocess
+
+from docx import Document
+from docx.oxml.ns import qn
+from docx.table import Table
+from docx.text.paragraph import Paragraph
+
+from attachment_source import open_source, read_head, source_name, source_path
+from content_cache import ContentCache, file_sha256
+from extractor_registry import OLE2_MAGIC
+from table_format import TABLE_DELIMITER
+
+# Legacy .doc files are converted by LibreOffice in a separate process, which
+# is killed if it does not finish in time (corrupt files can hang it).
+DOC_CONVERT_TIMEOUT = 60  # seconds
+
+WORD_VERSION = 2
+_cache = ContentCache('word_text')
+
+
+def iter_block_items(parent, container):
+    """
+    Yield the paragraphs and tables of a body, header, footer or cell in document order.
+
+    :param parent: python-docx object owning the blocks (Document body, header, cell)
+    :param container: The underlying XML element holding the blocks
+    :return: Generator of Paragraph and Table objects
+    """
+    for child in container.iterchildren():
+        if child.tag == qn('w:p'):
+            yield Paragraph(child, parent)
+        elif child.tag == qn('w:tbl'):
+            yield Table(child, parent)
+
+
+def table_rows(table):
+    """
+    Read a table as rows of cell text, one cell per grid column.
+
+    python-docx repeats a merged cell once per grid column it spans; its text
+    is kept in the first column and the rest of the span is left empty, so
+    every row has the grid's column count and lines up with the others.
+
+    :param table: python-docx Table
+    :return: List of rows (lists of cell text)
+    """
+    rows = []
+    for row in table.rows:
+        cells, previous = [], None
+        for cell in row.cells:
+            if cell._tc is previous:
+                cells.append("")
+                continue
+            previous = cell._tc
+            cells.append(" ".join(cell.text.split()).replace('|', '/'))
+        if any(cells):
+            rows.append(cells)
+    return rows
+
+
+def render_blocks(parent, container, counter):
+    """
+    Render paragraphs as lines and tables as '[Table N]' blocks of delimited rows.
+
+    :param parent: python-docx object owning the blocks
+    :param container: XML element holding the blocks
+    :param counter: Single-item list holding the running table number
+    :return: Generator of output lines
+    """
+    for block in iter_block_items(parent, container):
+        if isinstance(block, Paragraph):
+            text = " ".join(block.text.split())
+            if text:
+                yield text
+            continue
+        rows = table_rows(block)
+        if not rows:
+            continue
+        counter[0] += 1
+        yield f"[Table {counter[0]}]"
+        for row in rows:
+            yield TABLE_DELIMITER.join(row)
+
+
+def extract_docx_lines(file_path):
+    """
+    Stream a .docx file as headers, body (paragraphs and tables in order) and footers.
+
+    Headers and footers shared between sections are only emitted once.
+
+    :param file_path: Path to the .docx file, or a binary stream
+    :return: Generator of output lines
+    """
+    doc = Document(file_path)
+    counter = [0]
+    seen = set()
+
+    def parts(kind):
+        for section in doc.sections:
+            part = getattr(section, kind)
+            if part.is_linked_to_previous:
+                continue
+            lines = list(render_blocks(part, part._element, counter))
+            key = "\n".join(lines)
+            if lines and key not in seen:
+                seen.add(key)
+                yield from lines
+
+    header = list(parts('header'))
+    if header:
+        yield "[Header]"
+        yield from header
+    yield from render_blocks(doc, doc.element.body, counter)
+    footer = list(parts('footer'))
+    if footer:
+        yield "[Footer]"
+        yield from footer
+
+
+def kill_process_group(process):
+    """
+    Kill a process started with start_new_session=True and everything it spawned.
+
+    :param process: subprocess.Popen object
+    """
+    killpg = getattr(os, 'killpg', None)
+    if killpg is None:
+        # Windows has no process groups; kill the converter itself
+        process.kill()
+        return
+    try:
+        killpg(process.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        process.kill()
+
+
+def convert_doc_to_docx(file_path, output_dir, timeout=DOC_CONVERT_TIMEOUT):
+    """
+    Convert a legacy .doc file to .docx with headless LibreOffice.
+
+    Each conversion uses its own temporary LibreOffice profile so concurrent
+    conversions do not block on the shared profile lock.
+
+    :param file_path: Path to the .doc file
+    :param output_dir: Directory to write the converted file to
+    :param timeout: Seconds before the converter process is killed
+    :return: Path to the converted .docx file
+    """
+    soffice = shutil.which('soffice') or shutil.which('libreoffice')
+    if not soffice:
+        raise RuntimeError("LibreOffice (soffice) is required to read .doc files")
+    profile_dir = tempfile.mkdtemp(prefix='lo_profile_')
+    profile = 'file://' + os.path.abspath(profile_dir).replace('\\', '/')
+    # Run soffice in its own session: it forks helper processes, and on a
+    # timeout the whole group has to go or the helpers keep the profile locked.
+    process = subprocess.Popen(
+        [soffice, f'-env:UserInstallation={profile}', '--headless', '--convert-to', 'docx',
+         '--outdir', output_dir, file_path],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, start_new_session=True,
+    )
+    try:
+        try:
+            stdout, stderr = process.communicate(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            kill_process_group(process)
+            process.communicate()
+            raise
+        if process.returncode:
+            raise subprocess.CalledProcessError(process.returncode, process.args, stdout, stderr)
+    finally:
+        shutil.rmtree(profile_dir, ignore_errors=True)
+    converted = os.path.join(output_dir, os.path.splitext(os.path.basename(file_path))[0] + '.docx')
+    if not os.path.exists(converted):
+        raise RuntimeError(f"LibreOffice did not produce {converted}")
+    return converted
+
+
+def take_bytes(lines, max_bytes):
+    """
+    Take lines until their UTF-8 size would exceed max_bytes.
+
+    :param lines: Iterable of lines
+    :param max_bytes: Size budget (None for no limit)
+    :return: List of lines
+    """
+    taken, size = [], 0
+    for line in lines:
+        size += len(line.encode('utf-8')) + 1
+        if max_bytes is not None and size > max_bytes:
+            taken.append("[... truncated]")
+            break
+        taken.append(line)
+    return taken
+
+
+def extract_word_text(file_path, use_cache=True, max_bytes=None):
+    """
+    Extract text from a .docx or legacy .doc file.
+
+    :param file_path: Path to the Word document, or its content as bytes, memoryview or BytesIO
+    :param use_cache: Read and write the content-hash cache
+    :param max_bytes: Stop reading the document once this much text is produced (None for all)
+    :return: Extracted text
+    """
+    key = f"{file_sha256(file_path)}:{max_bytes}:v{WORD_VERSION}"
+    if use_cache:
+        cached = _cache.get(key)
+        if cached is not None:
+            return cached
+
+    if read_head(file_path, len(OLE2_MAGIC)) == OLE2_MAGIC:
+        # Legacy .doc: LibreOffice needs a real file, so buffers are spilled here
+        with tempfile.TemporaryDirectory() as tmp, source_path(file_path, suffix='.doc') as doc_path:
+            text = "\n".join(take_bytes(extract_docx_lines(convert_doc_to_docx(doc_path, tmp)), max_bytes))
+    else:
+        with open_source(file_path) as stream:
+            text = "\n".join(take_bytes(extract_docx_lines(stream), max_bytes))
+
+    logging.info(f"Word extraction of {source_name(file_path)}: {len(text)} characters")
+    if use_cache:
+        _cache.set(key, text)
+    return text